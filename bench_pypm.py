@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""Benchmarks and stress tests for PyPM.
+
+Every benchmark runs against its own throwaway daemon under a temporary HOME, with tiny
+Python scripts as the managed processes, so your own processes and state are never
+touched and nothing needs network access.
+
+    startup  CLI latency of `pypm list`, `status` and `logs`
+    scale    start, restart and stop N processes, `list` latency and idle daemon
+             CPU/memory with N children (start_process, list_processes)
+    crash    time from a child being killed to its replacement running (monitor_and_restart)
+    storm    N children crashing in a loop: restarts and state commits per second (save_state)
+    fleet    `pypm fleet list` and `restart` across several local daemons serving the agent
+             on different ports, including one host that is down (FleetPool, handle_agent)
+    memory   daemon RSS, threads and file descriptors per supervised child, up to
+             thousands of children, checked against MEMORY_TARGETS (ProcessRecord)
+
+Usage: python3 bench_pypm.py [startup|scale|crash|storm|fleet|memory ...] [--sizes 10,100,1000]
+                             [--runs N] [--output results.json]
+
+With --output, the results and a description of the machine are written as JSON, so
+runs can be compared over time.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+PYPM = str(Path(__file__).resolve().parent / 'pypm.py')
+# What the installed `pypm` wrapper runs: importing the module reuses its cached bytecode
+CLIENT = [sys.executable, '-c', "import sys; sys.path.insert(0, %r); import pypm; pypm.cli()"
+          % str(Path(PYPM).parent)]
+
+CHILDREN = {
+    'sleeper.py': "import time\nwhile True:\n    time.sleep(3600)\n",
+    'crasher.py': "import sys\nsys.exit(1)\n",
+    # Replaces itself with sleep(1), so thousands of children fit on a small machine
+    'idler.py': "import os\nos.execvp('sleep', ['sleep', 'infinity'])\n",
+}
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+# Most daemon RSS in MB allowed with this many children, checked by the memory benchmark
+MEMORY_TARGETS = {1000: 40, 2000: 50}
+# Shared by the daemons and the client of the fleet benchmark
+FLEET_TOKEN = 'bench-fleet-token'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Daemon:
+    """A PyPM daemon running under a temporary HOME for the duration of a `with` block."""
+
+    def __init__(self):
+        self.tmp = tempfile.TemporaryDirectory(prefix='pypm-bench-')
+        self.home = self.tmp.name
+        self.env = dict(os.environ, HOME=self.home)
+        # Let the client reuse cached bytecode like an installed pypm does
+        self.env.pop('PYTHONDONTWRITEBYTECODE', None)
+        self.env['PYPM_FLEET_TOKEN'] = FLEET_TOKEN
+        self.metrics_port = None
+        for name, source in CHILDREN.items():
+            Path(self.home, name).write_text(source)
+
+    def __enter__(self):
+        self.cli('start-self')
+        for _ in range(100):
+            try:
+                if self.request({'action': 'ping'}).get('ok'):
+                    break
+            except OSError:
+                pass
+            time.sleep(0.05)
+        else:
+            raise RuntimeError(f"PyPM daemon did not start, see {self.home}/.pypm.log")
+        self.pid = int(Path(self.home, '.pypm_pid').read_text())
+        return self
+
+    def __exit__(self, *exc):
+        self.cli('stop-self')
+        self.tmp.cleanup()
+
+    def cli(self, *args):
+        return subprocess.run(CLIENT + list(args), env=self.env, cwd=self.home,
+                              capture_output=True, text=True)
+
+    def request(self, request, timeout=600):
+        """Send one request over the control socket, like the CLI does."""
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(os.path.join(self.home, '.pypm.sock'))
+            sock.sendall(json.dumps(request).encode() + b'\n')
+            with sock.makefile('rb') as f:
+                return json.loads(f.readline())
+
+    def rows(self):
+        return {row['name']: row for row in self.request({'action': 'list'})['data']}
+
+    def apply(self, processes):
+        for process in processes.values():
+            process.setdefault('directory', self.home)
+        response = self.request({'action': 'apply', 'processes': processes, 'prune': False,
+                                 'dry_run': False, 'concurrency': None})
+        errors = [line for line in response.get('messages', []) if line.startswith('Error')]
+        if not response.get('ok') or errors:
+            raise RuntimeError("; ".join(errors or response.get('messages', [])))
+        return response
+
+    def wait_running(self, names, old_pids=(), timeout=120):
+        """Wait until every process runs with a PID not in old_pids; return the PIDs."""
+        old_pids = set(old_pids)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            rows = self.rows()
+            pids = {name: rows[name]['pid'] for name in names
+                    if name in rows and rows[name]['status'] == 'RUNNING' and rows[name]['pid'] not in old_pids}
+            if len(pids) == len(names):
+                return pids
+            time.sleep(0.005)
+        raise TimeoutError(f"processes did not come up within {timeout}s")
+
+    def cpu_seconds(self):
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+    def memory(self):
+        """VmRSS (MB) and thread count of the daemon."""
+        text = Path(f'/proc/{self.pid}/status').read_text()
+        rss = int(re.search(r'VmRSS:\s+(\d+)', text).group(1)) / 1024
+        threads = int(re.search(r'Threads:\s+(\d+)', text).group(1))
+        return rss, threads
+
+    def supervisor_timings(self):
+        """Scrape the daemon's own operation timings from its Prometheus endpoint."""
+        if self.metrics_port is None:
+            self.metrics_port = free_port()
+            self.request({'action': 'serve-metrics', 'host': '127.0.0.1', 'port': self.metrics_port, 'stop': False})
+        with urllib.request.urlopen(f'http://127.0.0.1:{self.metrics_port}/metrics', timeout=10) as response:
+            text = response.read().decode()
+        timings = {}
+        for operation, suffix, value in re.findall(r'^pypm_supervisor_(\w+)_duration_seconds_(sum|count) (\S+)$',
+                                                   text, re.M):
+            timings.setdefault(operation, {})[suffix] = float(value)
+        return timings
+
+    def serve_agent(self):
+        """Serve the fleet agent on a free local port and return its address."""
+        port = free_port()
+        self.request({'action': 'serve-agent', 'host': '127.0.0.1', 'port': port, 'stop': False})
+        return f'127.0.0.1:{port}'
+
+
+def timed(argv, env, runs):
+    """Wall-clock milliseconds of `runs` executions of argv."""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(argv, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'median_ms': round(statistics.median(samples), 2),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 2),
+        'min_ms': round(samples[0], 2),
+        'max_ms': round(samples[-1], 2),
+    }
+
+
+def sleepers(count, prefix='p'):
+    return {f'{prefix}{i}': {'command': f'{sys.executable} sleeper.py'} for i in range(count)}
+
+
+def bench_startup(options):
+    """Time the client commands people run from scripts against a live daemon."""
+    with Daemon() as daemon:
+        daemon.apply(sleepers(1, prefix='bench'))
+        daemon.wait_running(['bench0'])
+        commands = {
+            'python -c pass': [sys.executable, '-c', 'pass'],
+            'pypm list': CLIENT + ['list'],
+            'pypm status': CLIENT + ['status'],
+            'pypm logs': CLIENT + ['logs', 'bench0', '--lines', '1'],
+            'pypm list (uncached script)': [sys.executable, PYPM, 'list'],
+        }
+        # Warm the page cache and the bytecode cache before measuring
+        timed(commands['pypm list'], daemon.env, 3)
+        results = {label: summarize(timed(argv, daemon.env, options.runs)) for label, argv in commands.items()}
+
+        # The client path must not import the daemon's dependencies
+        probe = CLIENT[2].replace('pypm.cli()', "sys.argv[1:] = ['list']; pypm.cli();")
+        probe += ("print('heavy=' + ','.join(m for m in ('asyncio', 'psutil', 'sqlite3', 'subprocess', 'logging')"
+                  " if m in sys.modules))")
+        output = subprocess.run([sys.executable, '-c', probe], env=daemon.env, capture_output=True, text=True)
+        heavy = output.stdout.rsplit('heavy=', 1)[-1].strip()
+        results['heavy modules imported by list'] = heavy or 'none'
+    return results
+
+
+def bench_scale(options):
+    """Start, list, idle, restart and stop N processes for each N in --sizes."""
+    results = {}
+    for size in options.sizes:
+        with Daemon() as daemon:
+            processes = sleepers(size)
+            names = list(processes)
+            result = {}
+
+            started = time.perf_counter()
+            daemon.apply(processes)
+            pids = daemon.wait_running(names)
+            result['start_s'] = round(time.perf_counter() - started, 3)
+
+            samples = []
+            for _ in range(options.runs):
+                started = time.perf_counter()
+                daemon.request({'action': 'list'})
+                samples.append((time.perf_counter() - started) * 1000)
+            result['list_request'] = summarize(samples)
+            result['list_cli'] = summarize(timed(CLIENT + ['list'], daemon.env, options.runs))
+
+            cpu_before = daemon.cpu_seconds()
+            time.sleep(options.idle)
+            result['idle_cpu_percent'] = round((daemon.cpu_seconds() - cpu_before) / options.idle * 100, 2)
+            result['idle_rss_mb'], result['idle_threads'] = daemon.memory()
+            result['idle_rss_mb'] = round(result['idle_rss_mb'], 1)
+
+            started = time.perf_counter()
+            daemon.request({'action': 'restart', 'target': 'all', 'concurrency': None})
+            daemon.wait_running(names, old_pids=pids.values())
+            result['restart_s'] = round(time.perf_counter() - started, 3)
+
+            started = time.perf_counter()
+            daemon.request({'action': 'stop', 'target': 'all', 'concurrency': None})
+            result['stop_s'] = round(time.perf_counter() - started, 3)
+
+            result['supervisor'] = daemon.supervisor_timings()
+            results[size] = result
+    return results
+
+
+def bench_crash(options):
+    """Kill a child with SIGKILL and time how long until its replacement is running."""
+    with Daemon() as daemon:
+        daemon.apply({'victim': {'command': f'{sys.executable} sleeper.py',
+                                 'restart_delay': 0, 'max_restarts': 1000000}})
+        pid = daemon.wait_running(['victim'])['victim']
+        samples = []
+        for _ in range(options.runs):
+            os.kill(pid, signal.SIGKILL)
+            started = time.perf_counter()
+            pid = daemon.wait_running(['victim'], old_pids=[pid])['victim']
+            samples.append((time.perf_counter() - started) * 1000)
+            # Let the new child settle so the next kill doesn't land mid-spawn
+            time.sleep(0.2)
+        return {'detect_and_restart': summarize(samples), 'supervisor': daemon.supervisor_timings()}
+
+
+def bench_storm(options):
+    """Keep --storm-size children crashing without backoff and count the work done."""
+    with Daemon() as daemon:
+        processes = {f'c{i}': {'command': f'{sys.executable} crasher.py', 'restart_delay': 0,
+                               'max_restarts': 1000000, 'restart_policy': 'always'}
+                     for i in range(options.storm_size)}
+        before = daemon.supervisor_timings()
+        cpu_before = daemon.cpu_seconds()
+        started = time.perf_counter()
+        daemon.apply(processes)
+        time.sleep(options.storm_seconds)
+        restarts = sum(row['restarts'] for row in daemon.rows().values())
+        elapsed = time.perf_counter() - started
+        cpu = daemon.cpu_seconds() - cpu_before
+        after = daemon.supervisor_timings()
+        daemon.request({'action': 'stop', 'target': 'all', 'concurrency': None})
+
+    writes = after['state_write']['count'] - before['state_write']['count']
+    write_time = after['state_write']['sum'] - before['state_write']['sum']
+    return {
+        'processes': options.storm_size,
+        'seconds': round(elapsed, 2),
+        'restarts_per_s': round(restarts / elapsed, 1),
+        'state_commits_per_s': round(writes / elapsed, 1),
+        'state_commit_avg_ms': round(write_time / writes * 1000, 3) if writes else None,
+        'daemon_cpu_percent': round(cpu / elapsed * 100, 1),
+    }
+
+
+def bench_fleet(options):
+    """Fan `pypm fleet` commands out to --fleet-size local daemons, with and without a dead host."""
+    daemons = [Daemon() for _ in range(options.fleet_size)]
+    try:
+        hosts = []
+        for daemon in daemons:
+            daemon.__enter__()
+            daemon.apply(sleepers(10))
+            hosts.append(daemon.serve_agent())
+        for daemon in daemons:
+            daemon.wait_running(list(sleepers(10)))
+        client = daemons[0]
+        fleet = CLIENT + ['fleet', 'list', '--hosts', ','.join(hosts)]
+        down = CLIENT + ['fleet', 'list', '--hosts', ','.join(hosts + [f'127.0.0.1:{free_port()}']), '--timeout', '5']
+
+        listed = client.cli(*fleet[len(CLIENT):])
+        partial = client.cli(*down[len(CLIENT):])
+        results = {
+            'hosts': len(hosts),
+            'processes listed': sum(line.startswith('127.0.0.1:') for line in listed.stdout.splitlines()),
+            'partial failure exit code': partial.returncode,
+            'fleet list': summarize(timed(fleet, client.env, options.runs)),
+            'fleet list, one host down': summarize(timed(down, client.env, options.runs)),
+        }
+        started = time.perf_counter()
+        client.cli('fleet', 'restart', 'all', '--hosts', ','.join(hosts))
+        results['fleet restart all_s'] = round(time.perf_counter() - started, 3)
+        return results
+    finally:
+        for daemon in daemons:
+            daemon.__exit__(None, None, None)
+
+
+def bench_memory(options):
+    """Grow one daemon to each size in --memory-sizes and measure what the children cost it."""
+    results = {}
+    with Daemon() as daemon:
+        # Let the first sampling passes and imports settle before taking the baseline
+        daemon.apply({'base': {'command': f'{sys.executable} idler.py'}})
+        daemon.wait_running(['base'])
+        time.sleep(3)
+        base_rss, base_threads = daemon.memory()
+        results['0'] = {'rss_mb': round(base_rss, 1), 'threads': base_threads}
+        for size in sorted(options.memory_sizes):
+            processes = {f'w{i}': {'command': f'{sys.executable} idler.py'} for i in range(size)}
+            started = time.perf_counter()
+            daemon.apply(processes)
+            daemon.wait_running(list(processes), timeout=1200)
+            start_s = time.perf_counter() - started
+            # Past the next metrics pass (every 10 s by default), so every child's
+            # history ring is allocated too: after that the memory stays flat
+            time.sleep(15)
+            rss, threads = daemon.memory()
+            target = MEMORY_TARGETS.get(size)
+            results[str(size)] = {
+                'start_s': round(start_s, 1),
+                'rss_mb': round(rss, 1),
+                'kb_per_process': round((rss - base_rss) * 1024 / size, 1),
+                'threads': threads,
+                'fds': len(os.listdir(f'/proc/{daemon.pid}/fd')),
+                'target_mb': target,
+                'target_met': None if target is None else rss <= target,
+            }
+        daemon.request({'action': 'stop', 'target': 'all', 'concurrency': None})
+    return results
+
+
+BENCHMARKS = {
+    'startup': bench_startup,
+    'scale': bench_scale,
+    'crash': bench_crash,
+    'storm': bench_storm,
+    'fleet': bench_fleet,
+    'memory': bench_memory,
+}
+
+
+def machine():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=Path(PYPM).parent,
+                                capture_output=True, text=True).stdout.strip() or None
+    except FileNotFoundError:
+        commit = None
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'kernel': platform.release(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PyPM daemon and CLI.")
+    parser.add_argument('benchmarks', nargs='*', help=f"any of {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--runs', type=int, default=20, help="repetitions of each latency measurement")
+    parser.add_argument('--sizes', type=lambda value: [int(n) for n in value.split(',')], default=[10, 100],
+                        help="process counts for the scale benchmark (default: 10,100)")
+    parser.add_argument('--idle', type=float, default=5, help="seconds to measure idle daemon CPU for")
+    parser.add_argument('--storm-size', type=int, default=20, help="crashing processes in the storm benchmark")
+    parser.add_argument('--storm-seconds', type=float, default=10, help="duration of the storm benchmark")
+    parser.add_argument('--memory-sizes', type=lambda value: [int(n) for n in value.split(',')],
+                        default=[1000, 2000], help="child counts for the memory benchmark (default: 1000,2000)")
+    parser.add_argument('--fleet-size', type=int, default=4, help="daemons in the fleet benchmark")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    options = parser.parse_args()
+    unknown = [name for name in options.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark {', '.join(unknown)}")
+
+    report = {'machine': machine(), 'results': {}}
+    for name in options.benchmarks or list(BENCHMARKS):
+        print(f"== {name}", flush=True)
+        result = BENCHMARKS[name](options)
+        report['results'][name] = result
+        for label, value in result.items():
+            print(f"{label!s:<32} {json.dumps(value)}", flush=True)
+
+    if options.output:
+        Path(options.output).write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Results written to {options.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -57,11 +57,12 @@ fi
 wget https://raw.githubusercontent.com/SiliconSquire/pypm/main/pypm.py -O "$PYPM_DIR/pypm.py"
 chmod +x "$PYPM_DIR/pypm.py"
 
-# Create wrapper script
+# Create wrapper script. It imports pypm as a module rather than running the file, so
+# Python reuses the cached bytecode instead of recompiling pypm.py on every command.
 cat > "$LOCAL_BIN_DIR/pypm" << EOF
 #!/bin/bash
 source $PYPM_DIR/venv/bin/activate
-python $PYPM_DIR/pypm.py "\$@"
+exec python -c "import sys; sys.path.insert(0, '$PYPM_DIR'); import pypm; pypm.cli()" "\$@"
 EOF
 
 chmod +x "$LOCAL_BIN_DIR/pypm"
@@ -1,78 +1,335 @@
-import subprocess
+import importlib
 import os
 import sys
 import json
 import signal
-import psutil
 import time
 import re
 import fcntl
-import logging
+import errno
+import socket
 from pathlib import Path
-import threading
 
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access.
+
+    Client commands like `pypm list` only talk to the daemon over its socket, so they
+    should not pay for importing asyncio, psutil or sqlite3 on every run.
+    """
+
+    def __init__(self, name, on_import=None):
+        self.name = name
+        self.on_import = on_import
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.name)
+        globals()[self.name] = module
+        if self.on_import:
+            self.on_import(module)
+        return getattr(module, attr)
+
+
+def setup_logging(logging):
+    logging.basicConfig(
+        filename=LOG_FILE,
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+
+
+# Only the daemon and the commands that run processes locally touch these
+subprocess = LazyModule('subprocess')
+psutil = LazyModule('psutil')
+logging = LazyModule('logging', on_import=setup_logging)
+asyncio = LazyModule('asyncio')
+sqlite3 = LazyModule('sqlite3')
+gzip = LazyModule('gzip')
+glob = LazyModule('glob')
+shutil = LazyModule('shutil')
+shlex = LazyModule('shlex')
+random = LazyModule('random')
+heapq = LazyModule('heapq')
+resource = LazyModule('resource')
+threading = LazyModule('threading')
+ctypes = LazyModule('ctypes')
+struct = LazyModule('struct')
+fnmatch = LazyModule('fnmatch')
+datetime = LazyModule('datetime')
+hmac = LazyModule('hmac')
+collections = LazyModule('collections')
+itertools = LazyModule('itertools')
+secrets = LazyModule('secrets')
+ipaddress = LazyModule('ipaddress')
+
+STATE_DB = Path.home() / '.pypm_state.db'
+STATE_CACHE_KB = 256
+# Legacy JSON config, migrated into STATE_DB on first start
 CONFIG_FILE = Path.home() / '.pypm_config.json'
+# Written by older versions of `pypm save`; `pypm startup` now has the daemon resurrect at boot
 STARTUP_SCRIPT = Path.home() / '.pypm_startup.sh'
+# `pypm enable` starts the daemon at boot from this systemd user unit
+SYSTEMD_UNIT = Path.home() / '.config' / 'systemd' / 'user' / 'pypm.service'
+BOOT_ID_FILE = '/proc/sys/kernel/random/boot_id'
+# Marker of the crontab entries older versions used for `pypm startup`, see remove_legacy_cron_entries()
 CRON_MARKER = "# PyPM autostart entry"
-PYPM_PID_FILE = Path.home() / '.pypm_pid'
+# Marker of the @reboot crontab entry `pypm enable` falls back to without systemd
 PYPM_AUTOSTART_MARKER = "# PyPM self-start entry"
+# Exists while that entry is installed, so `pypm status` needn't run `crontab -l`
+CRON_AUTOSTART_FILE = Path.home() / '.pypm_cron_autostart'
+PYPM_PID_FILE = Path.home() / '.pypm_pid'
 LOG_FILE = Path.home() / '.pypm.log'
+# Captured stdout/stderr of managed processes, one <name>.log per process
+LOG_DIR = Path.home() / '.pypm_logs'
+SOCKET_FILE = Path.home() / '.pypm.sock'
+# Passes children's pipes, sockets and the daemon lock to the new image on restart-self
+HANDOFF_FILE = Path.home() / '.pypm_handoff.json'
+# Largest request line the daemon accepts (an applied ecosystem file travels in one request)
+REQUEST_LIMIT = 16 * 1024 * 1024
+DAEMON_LOCK_FILE = Path.home() / '.pypm.lock'
+
+# Default cap on how many processes are spawned at the same time
+DEFAULT_CONCURRENCY = 16
+
+# Seconds a reloaded instance may take to pass its readiness check
+DEFAULT_READY_TIMEOUT = 30
+# Without a readiness check, a new instance counts as ready once it has stayed up this long
+READY_GRACE_PERIOD = 1
+
+# Health probe defaults, each can be overridden per process with `pypm config`
+DEFAULT_HEALTH_INTERVAL = 10   # seconds between probes
+DEFAULT_HEALTH_TIMEOUT = 5     # seconds before a probe counts as failed
+DEFAULT_HEALTH_THRESHOLD = 3   # failed liveness probes in a row before the process is restarted
+PROBE_KINDS = ['http', 'tcp', 'exec', 'heartbeat', 'port', 'socket', 'file']
+
+# Lifecycle events kept in memory for `pypm events`. A subscriber that falls further
+# behind than this is told how many it missed instead of holding up the daemon
+EVENT_BUFFER = 1000
+
+# State changes within this many seconds are written in a single transaction
+STATE_FLUSH_DELAY = 0.05
+
+# Seconds between resource sampling passes over /proc (PYPM_SAMPLE_INTERVAL overrides)
+SAMPLE_INTERVAL = float(os.environ.get('PYPM_SAMPLE_INTERVAL', 2))
+# Every METRICS_INTERVAL seconds a sample goes into each process's history ring, which
+# holds METRICS_HISTORY samples (one hour by default)
+METRICS_INTERVAL = float(os.environ.get('PYPM_METRICS_INTERVAL', 10))
+METRICS_HISTORY = int(os.environ.get('PYPM_METRICS_HISTORY', 360))
+# Default address of the Prometheus endpoint started by `pypm serve-metrics`
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9105
+# Fleet agent (`pypm serve-agent`): the daemon's control API on TCP for `pypm fleet`.
+# Both sides prove they know the token in FLEET_TOKEN_FILE (or PYPM_FLEET_TOKEN) and then
+# sign every message. Only loopback by default, other interfaces need an explicit --host
+AGENT_HOST = '127.0.0.1'
+AGENT_PORT = 9106
+AGENT_AUTH_TIMEOUT = 5
+AGENT_IDLE_TIMEOUT = 300    # seconds before an idle pooled connection is closed
+FLEET_TOKEN_FILE = Path.home() / '.pypm_fleet_token'
+# Hosts `pypm fleet` talks to without --hosts, one HOST[:PORT] per line
+FLEET_HOSTS_FILE = Path.home() / '.pypm_fleet_hosts'
+FLEET_TIMEOUT = 30          # seconds per host for connecting, logging in and the request
+FLEET_CONCURRENCY = 32      # hosts contacted at the same time
+# Actions an agent accepts; the endpoints themselves can only be changed locally
+FLEET_ACTIONS = ['list', 'events', 'status', 'metrics', 'start', 'stop', 'restart', 'reload', 'delete', 'config', 'save',
+                 'apply', 'resurrect', 'job', 'debug']
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+M_ARENA_MAX = -8  # glibc mallopt parameter
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+# Process log defaults, overridable per process with `pypm config` (log_max_size,
+# log_max_age, log_keep, log_compress)
+LOG_MAX_SIZE = 10 * 1024 * 1024
+LOG_MAX_AGE = 0  # seconds, 0 disables age-based rotation
+LOG_KEEP = 5
+LOG_COMPRESS = False
+# Buffered output above this many bytes pauses reading from the process's pipes
+LOG_BUFFER_LIMIT = 1024 * 1024
+# Longest partial line held back waiting for its newline
+LOG_MAX_LINE = 64 * 1024
+
+# cgroup v2 subtree PyPM may manage (PYPM_CGROUP overrides the daemon's own cgroup)
+CGROUP_ROOT = Path('/sys/fs/cgroup')
+# The cgroup's hard memory.max sits this far above max_memory, so the sampler gets
+# to restart a process gracefully before the kernel OOM-kills it
+CGROUP_MEMORY_HEADROOM = 1.25
+CPU_PERIOD = 100000  # microseconds, the cpu.max period
+
+# Restart policy defaults, each can be overridden per process with `pypm config`
+DEFAULT_RESTART_POLICY = 'always'
+DEFAULT_MAX_RESTART_DELAY = 60    # seconds, cap for the exponential backoff
+DEFAULT_STABLE_AFTER = 60         # seconds of uptime after which a crash no longer counts toward max_restarts
+DEFAULT_CIRCUIT_COOLDOWN = 300    # seconds before a process that hit max_restarts gets one probe start
+
+# File watching (`pypm start --watch`): seconds without changes before the restart, and
+# paths that never trigger one unless the process sets its own watch_ignore
+DEFAULT_WATCH_DELAY = 1.0
+DEFAULT_WATCH_IGNORE = ['.git', '.hg', '__pycache__', '*.pyc', '*.swp', '*~', '.#*', 'venv', '.venv',
+                        'node_modules', '*.log']
+
+# Runs kept per job for `pypm job history`
+JOB_HISTORY = 100
+# The scheduler re-reads the wall clock at least this often, so clock changes are noticed
+SCHEDULER_MAX_SLEEP = 60
+CRON_ALIASES = {
+    '@yearly': '0 0 1 1 *', '@annually': '0 0 1 1 *', '@monthly': '0 0 1 * *', '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *', '@midnight': '0 0 * * *', '@hourly': '0 * * * *',
+}
+CRON_MONTHS = {name: index for index, name in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], 1)}
+CRON_WEEKDAYS = {name: index for index, name in enumerate(['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'])}
+
+# Commands containing any of these need bash; everything else is exec'd directly
+SHELL_SYNTAX = re.compile(r'[;&|<>()$`*?~{}\[\]\\\n]')
+ENV_ASSIGNMENT = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*=')
+
+# Actions that are forwarded to the daemon over the control socket
+DAEMON_ACTIONS = ['list', 'metrics', 'serve-metrics', 'serve-agent', 'start', 'stop', 'delete', 'restart', 'reload', 'config', 'save',
+                  'apply', 'resurrect', 'startup', 'disable-startup', 'job', 'events', 'debug']
+
+# Options accepted by `pypm start` before the command, mapped to (request key, type)
+START_OPTIONS = {
+    '-i': ('instances', int),
+    '--instances': ('instances', int),
+    '--ready': ('ready_check', str),
+    '--ready-timeout': ('ready_timeout', float),
+    '--listen': ('listen', lambda value: value.split(',')),
+    '--watch-include': ('watch_include', lambda value: value.split(',')),
+    '--watch-ignore': ('watch_ignore', lambda value: value.split(',')),
+    '--cron-restart': ('cron_restart', str),
+}
+
+# Options accepted by `pypm job <name>` before the command
+JOB_OPTIONS = {
+    '--cron': ('cron', str),
+    '--at': ('at', lambda value: parse_at(value)),
+    '--overlap': ('overlap', str),
+}
+
+
+def edit_crontab(drop, add=()):
+    """Remove the crontab lines containing any of the strings in drop, then append the lines in add.
+
+    Returns False if there is no crontab command.
+    """
+    if not shutil.which('crontab'):
+        return False
+    current = subprocess.run(['crontab', '-l'], capture_output=True, text=True).stdout
+    kept = [line for line in current.splitlines() if not any(marker in line for marker in drop)]
+    if kept != current.splitlines() or add:
+        subprocess.run(['crontab', '-'], input="\n".join([*kept, *add]) + "\n", text=True)
+    return True
+
+
+def remove_legacy_cron_entries():
+    """Drop the @reboot crontab entries older versions used for `pypm startup`."""
+    edit_crontab([CRON_MARKER, str(STARTUP_SCRIPT), f"{os.path.abspath(__file__)} resurrect"])
 
-# Set up logging
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+
+def self_start_cron_markers():
+    return [PYPM_AUTOSTART_MARKER, f"{os.path.abspath(__file__)} start-self"]
+
+
+def systemctl(*args):
+    """Run `systemctl --user`, returning an error message or None."""
+    try:
+        result = subprocess.run(['systemctl', '--user', *args], capture_output=True, text=True)
+    except FileNotFoundError:
+        return "systemctl not found"
+    return result.stderr.strip() or f"systemctl failed with exit code {result.returncode}" if result.returncode else None
+
+
+def autostart_enabled():
+    if SYSTEMD_UNIT.exists():
+        return (SYSTEMD_UNIT.parent / 'default.target.wants' / SYSTEMD_UNIT.name).exists()
+    return CRON_AUTOSTART_FILE.exists()
 
 
 def enable_pypm_autostart():
-    pypm_command = f"{sys.executable} {os.path.abspath(__file__)} start-self"
-    cron_entry = f"{PYPM_AUTOSTART_MARKER}\n@reboot nohup {pypm_command} >/dev/null 2>&1 &"
-    
-    current_crontab = subprocess.run("crontab -l", shell=True, capture_output=True, text=True).stdout
-    if PYPM_AUTOSTART_MARKER not in current_crontab:
-        new_crontab = current_crontab.strip() + f"\n{cron_entry}\n"
-        subprocess.run(f"echo '{new_crontab}' | crontab -", shell=True)
-        print("PyPM autostart enabled")
-    else:
-        print("PyPM autostart is already enabled")
+    """Start the daemon at boot from a systemd user unit, lingering so it runs without a login.
+
+    Without a systemd user session, fall back to an @reboot crontab entry that only
+    launches the daemon; the daemon resurrects the saved processes itself.
+    """
+    remove_legacy_cron_entries()
+    SYSTEMD_UNIT.parent.mkdir(parents=True, exist_ok=True)
+    with open(SYSTEMD_UNIT, 'w') as f:
+        f.write(f"""[Unit]
+Description=PyPM process manager
+
+[Service]
+ExecStart={' '.join(f'"{arg}"' for arg in daemon_command())}
+# Only stop the daemon itself, it stops the managed processes gracefully
+KillMode=process
+Restart=on-failure
+
+[Install]
+WantedBy=default.target
+""")
+    error = systemctl('daemon-reload') or systemctl('enable', SYSTEMD_UNIT.name)
+    if error:
+        SYSTEMD_UNIT.unlink()
+        start_self = f"{shlex.quote(sys.executable)} {shlex.quote(os.path.abspath(__file__))} start-self"
+        if edit_crontab(self_start_cron_markers(),
+                        [PYPM_AUTOSTART_MARKER, f"@reboot {start_self} >/dev/null 2>&1"]):
+            CRON_AUTOSTART_FILE.touch()
+            print(f"systemd user session not available ({error}), added an @reboot crontab entry instead")
+            print("PyPM autostart enabled")
+        else:
+            print(f"Error: {error}, and there is no crontab to fall back to")
+        return
+    edit_crontab(self_start_cron_markers())
+    CRON_AUTOSTART_FILE.unlink(missing_ok=True)
+    try:
+        subprocess.run(['loginctl', 'enable-linger', os.environ.get('USER') or str(os.getuid())],
+                       capture_output=True)
+    except FileNotFoundError:
+        pass
+    print("PyPM autostart enabled")
 
 
 def disable_pypm_autostart():
-    current_crontab = subprocess.run("crontab -l", shell=True, capture_output=True, text=True).stdout.splitlines()
-    new_crontab = [line for line in current_crontab if PYPM_AUTOSTART_MARKER not in line]
-    subprocess.run("crontab -", input="\n".join(new_crontab), shell=True, text=True)
+    remove_legacy_cron_entries()
+    edit_crontab(self_start_cron_markers())
+    CRON_AUTOSTART_FILE.unlink(missing_ok=True)
+    if SYSTEMD_UNIT.exists():
+        systemctl('disable', SYSTEMD_UNIT.name)
+        SYSTEMD_UNIT.unlink()
+        systemctl('daemon-reload')
     print("PyPM autostart disabled")
 
-def validate_process_name(name):
+def validate_process_name(name, config):
     """Validate process name to prevent duplicates and ensure valid characters."""
     if not name or not re.match(r'^[a-zA-Z0-9_-]+$', name):
         return False, "Process name must contain only alphanumeric characters, underscores, and hyphens."
-    
-    config = load_config()
+
     if name in config:
         return False, f"Process '{name}' already exists. Use a different name or delete the existing process first."
-    
+
     return True, ""
 
+def command_script(command):
+    """Return the Python script a command runs, or None."""
+    match = re.search(r'python3?\s+([^\s;|&]+)', command)
+    return match.group(1) if match else None
+
+
 def validate_command(directory, command):
     """Validate that the command is executable and the script exists."""
-    # Extract the Python script name from the command
-    match = re.search(r'python3?\s+([^\s;|&]+)', command)
-    if not match:
+    script_path = command_script(command)
+    if not script_path:
         return False, "Command must include a Python script (e.g., 'python3 app.py')"
-    
-    script_path = match.group(1)
+
     full_path = os.path.join(directory, script_path)
-    
+
     if not os.path.isfile(full_path):
         return False, f"Python script '{script_path}' not found in directory '{directory}'"
-    
+
     return True, ""
 
 def load_config():
+    """Read the legacy JSON config file, used only to migrate it into the state store."""
     if CONFIG_FILE.exists():
         with open(CONFIG_FILE, 'r') as f:
             # Lock the file for reading
@@ -87,554 +344,4463 @@ def load_config():
     return {}
 
 
-def save_config(config):
-    # Create parent directory if it doesn't exist
-    CONFIG_FILE.parent.mkdir(parents=True, exist_ok=True)
-    
-    # Use atomic write pattern
-    temp_file = CONFIG_FILE.with_suffix('.tmp')
-    with open(temp_file, 'w') as f:
-        # Lock the file for writing
-        fcntl.flock(f, fcntl.LOCK_EX)
-        try:
-            json.dump(config, f, indent=2)
-            f.flush()
-            os.fsync(f.fileno())
-        finally:
-            fcntl.flock(f, fcntl.LOCK_UN)
-    
-    # Atomic rename
-    temp_file.rename(CONFIG_FILE)
+class ProcessRecord:
+    """Configuration and runtime state of one managed process, used like a dict.
 
+    The keys every process has live in slots and the rarer settings in a dict made
+    on first use, which takes a fraction of the memory of a dict per process. Commands,
+    directories and group names are interned, so instances share one copy of each.
+    """
 
-def list_processes(config):
-    if not config:
-        print("No processes are currently being managed by PyPM")
-        return
-    
-    # First call to cpu_percent for all processes to initialize measurement
-    process_objects = {}
-    for name, process in config.items():
-        pid = process.get('pid')
-        if pid is not None and psutil.pid_exists(pid):
+    SLOTS = ('command', 'directory', 'pid', 'max_restarts', 'restart_delay', 'restart_count', 'created_at',
+             'started_at', 'crash_count', 'last_exit_code', 'identity', 'status', 'autostart', 'group',
+             'instance', 'env')
+    SLOT_KEYS = frozenset(SLOTS)
+    INTERNED = frozenset(['command', 'directory', 'group'])
+
+    __slots__ = SLOTS + ('extra',)
+
+    def __init__(self, data=()):
+        self.extra = None
+        self.update(data)
+
+    def __getitem__(self, key):
+        if key in self.SLOT_KEYS:
             try:
-                p = psutil.Process(pid)
-                if p.is_running():
-                    p.cpu_percent()  # First call to initialize
-                    process_objects[name] = p
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                pass
-    
-    # Wait a moment for CPU measurement
-    time.sleep(0.1)
-    
-    # Now get actual measurements and display
-    print(f"{'NAME':<20} {'STATUS':<10} {'PID':<8} {'CPU':<8} {'MEM':<8} {'RESTARTS':<8}")
-    print("-" * 65)
-    
-    for name, process in config.items():
-        pid = process.get('pid')
-        restarts = process.get('restart_count', 0)
-        
-        if name in process_objects and process_objects[name].is_running():
-            p = process_objects[name]
-            status = "RUNNING"
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self.extra is None or key not in self.extra:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self.SLOT_KEYS:
+            if key in self.INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.SLOT_KEYS:
             try:
-                cpu = p.cpu_percent()
-                memory = p.memory_info().rss / 1024 / 1024  # Convert to MB
-                print(f"{name:<20} {status:<10} {pid:<8} {cpu:>6.1f}% {memory:>6.1f}MB {restarts:>8}")
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                print(f"{name:<20} ERROR      {pid:<8} {'N/A':<8} {'N/A':<8} {restarts:>8}")
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self.extra and key in self.extra:
+            del self.extra[key]
         else:
-            print(f"{name:<20} STOPPED    {'N/A':<8} {'N/A':<8} {'N/A':<8} {restarts:>8}")
+            raise KeyError(key)
 
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
 
-def find_venv(directory):
-    venv_dirs = ['venv', '.venv', 'env', '.env', '.']
-    for venv in venv_dirs:
-        venv_path = Path(directory) / venv
-        if (venv_path / 'bin' / 'activate').exists():
-            return venv_path
-        # Check if we're already in a venv
-        elif (venv_path / 'activate').exists():
-            return venv_path.parent
-    
-    # Check parent directory as well
-    parent_dir = Path(directory).parent
-    for venv in venv_dirs:
-        venv_path = parent_dir / venv
-        if (venv_path / 'bin' / 'activate').exists():
-            return venv_path
-    
-    return None
+    def __iter__(self):
+        return iter(self.keys())
 
+    def __len__(self):
+        return len(self.keys())
 
-def start_process(name, directory, command):
-    # Validate command before execution
-    valid, msg = validate_command(directory, command)
-    if not valid:
-        logging.error(f"Invalid command for {name}: {msg}")
-        print(f"Error: {msg}")
-        return None
-    
-    venv_path = find_venv(directory)
-    if venv_path:
-        activate_venv = f"source {venv_path}/bin/activate"
-        full_command = f"cd {directory} && {activate_venv} && {command}"
-    else:
-        full_command = f"cd {directory} && {command}"
-    
-    try:
-        # Start the process in a new session
-        process = subprocess.Popen(
-            full_command, 
-            shell=True, 
-            executable='/bin/bash', 
-            start_new_session=True,
-            stdout=subprocess.DEVNULL, 
-            stderr=subprocess.DEVNULL
-        )
-        
-        # Start a monitor thread for this process
-        monitor_thread = threading.Thread(
-            target=monitor_and_restart, 
-            args=(name, directory, command, process.pid), 
-            daemon=True
-        )
-        monitor_thread.start()
-        
-        logging.info(f"Started process {name} with PID {process.pid}")
-        return process.pid
-    except Exception as e:
-        logging.error(f"Failed to start process {name}: {e}")
-        print(f"Error starting process: {e}")
-        return None
+    def __repr__(self):
+        return f"ProcessRecord({dict(self.items())!r})"
+
+    def keys(self):
+        keys = [key for key in self.SLOTS if hasattr(self, key)]
+        if self.extra:
+            keys.extend(self.extra)
+        return keys
 
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
 
-def monitor_and_restart(name, directory, command, pid):
-    config = load_config()
-    process_config = config.get(name, {})
-    max_restarts = process_config.get('max_restarts', 5)
-    restart_delay = process_config.get('restart_delay', 3)
-    restart_count = process_config.get('restart_count', 0)
-    
-    # Use exponential backoff for restart delays
-    current_delay = restart_delay
+    def values(self):
+        return [self[key] for key in self.keys()]
 
-    while restart_count < max_restarts:
+    def get(self, key, default=None):
         try:
-            # Check if process exists
-            if not psutil.pid_exists(pid):
-                raise psutil.NoSuchProcess(pid)
-                
-            # Wait for process to exit
-            process = psutil.Process(pid)
-            
-            # Use polling instead of blocking wait
-            while process.is_running():
-                time.sleep(1)
-            
-            # If process exited, restart it
-            logging.info(f"Process {name} (PID: {pid}) exited, restarting in {current_delay}s...")
-            print(f"Process {name} (PID: {pid}) exited, restarting in {current_delay}s...")
-            time.sleep(current_delay)
-            
-            # Start the process again
-            new_pid = start_process(name, directory, command)
-            if new_pid is None:
-                logging.error(f"Failed to restart process {name}")
-                break
-                
-            # Update the config with new PID and restart count
-            config = load_config()
-            if name in config:
-                restart_count += 1
-                config[name]['pid'] = new_pid
-                config[name]['restart_count'] = restart_count
-                save_config(config)
-            
-            pid = new_pid
-            
-            # Increase delay for next restart (exponential backoff)
-            current_delay = min(current_delay * 2, 60)  # Cap at 60 seconds
-            
-        except psutil.NoSuchProcess:
-            logging.info(f"Process {name} (PID: {pid}) no longer exists")
-            break
-        except Exception as e:
-            logging.error(f"Error monitoring process {name}: {e}")
-            print(f"Error monitoring process {name}: {e}")
-            break
-
-    if restart_count >= max_restarts:
-        logging.warning(f"Process {name} failed to stay running after {max_restarts} restarts. Giving up.")
-        print(f"Process {name} failed to stay running after {max_restarts} restarts. Giving up.")
-        
-        # Update config to mark process as failed
-        config = load_config()
-        if name in config:
-            config[name]['status'] = 'failed'
-            config[name]['pid'] = None
-            save_config(config)
+            return self[key]
+        except KeyError:
+            return default
 
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
 
-def stop_process(pid):
-    if pid and psutil.pid_exists(pid):
+    def setdefault(self, key, default=None):
         try:
-            # Send SIGTERM to process group
-            os.killpg(os.getpgid(pid), signal.SIGTERM)
-            
-            # Wait up to 5 seconds for process to terminate
-            for _ in range(5):
-                if not psutil.pid_exists(pid):
-                    return True
-                time.sleep(1)
-                
-            # If process still exists, send SIGKILL
-            if psutil.pid_exists(pid):
-                logging.warning(f"Process {pid} did not terminate with SIGTERM, sending SIGKILL")
-                os.killpg(os.getpgid(pid), signal.SIGKILL)
-                return True
-        except (ProcessLookupError, psutil.NoSuchProcess):
-            # Process already gone
-            return True
-        except Exception as e:
-            logging.error(f"Error stopping process {pid}: {e}")
-            return False
-    return True
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def update(self, other=(), **fields):
+        for key, value in (other.items() if hasattr(other, 'items') else other):
+            self[key] = value
+        for key, value in fields.items():
+            self[key] = value
+
+
+class StateStore:
+    """Process state kept in SQLite (WAL mode), one row per managed process.
+
+    Only changed rows are written, and many changes can share one transaction,
+    so a crash loop costs a small WAL append instead of rewriting every process.
+    """
+
+    def __init__(self, path=STATE_DB):
+        self.path = Path(path)
+        self.conn = self.connect()
+
+    def connect(self):
+        conn = sqlite3.connect(str(self.path), isolation_level=None)
+        try:
+            if conn.execute("PRAGMA quick_check").fetchone()[0] != 'ok':
+                raise sqlite3.DatabaseError("quick_check failed")
+        except sqlite3.DatabaseError as e:
+            # Keep the damaged file for inspection and start from an empty store
+            conn.close()
+            corrupt_path = self.path.with_suffix('.corrupt')
+            logging.error(f"State database {self.path} is damaged ({e}), moving it to {corrupt_path}")
+            self.path.rename(corrupt_path)
+            conn = sqlite3.connect(str(self.path), isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL with synchronous=NORMAL survives process crashes; only power loss can drop the last commits
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Rows are read once at start and then only written by key: the default 2 MB page
+        # cache would mostly add to the daemon's RSS
+        conn.execute(f"PRAGMA cache_size=-{STATE_CACHE_KB}")
+        conn.execute("CREATE TABLE IF NOT EXISTS processes (name TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS jobs (name TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS job_runs (id INTEGER PRIMARY KEY, job TEXT NOT NULL, "
+                     "trigger TEXT, started_at REAL, finished_at REAL, pid INTEGER, exit_code INTEGER, "
+                     "status TEXT NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS job_runs_job ON job_runs (job, id)")
+        return conn
+
+    def load(self):
+        config = {}
+        for name, data in self.conn.execute("SELECT name, data FROM processes ORDER BY rowid"):
+            try:
+                config[name] = json.loads(data)
+            except json.JSONDecodeError:
+                logging.error(f"Skipping unreadable state row for process {name}")
+        if not config and CONFIG_FILE.exists():
+            config = self.migrate_legacy_config()
+        return {name: ProcessRecord(data) for name, data in config.items()}
 
+    def migrate_legacy_config(self):
+        """Import ~/.pypm_config.json into the store and keep the old file as a backup."""
+        config = load_config()
+        self.write(config, config.keys())
+        backup = CONFIG_FILE.with_suffix('.json.migrated')
+        CONFIG_FILE.rename(backup)
+        logging.info(f"Migrated {len(config)} processes from {CONFIG_FILE} to {self.path}, old file kept as {backup}")
+        return config
 
-def create_startup_script(config):
-    with open(STARTUP_SCRIPT, 'w') as f:
-        f.write("#!/bin/bash\n")
-        for name, process in config.items():
-            if process.get('autostart', False):
-                venv_path = find_venv(process['directory'])
-                if venv_path:
-                    f.write(f"cd {process['directory']} && source {venv_path}/bin/activate && {process['command']} &\n")
+    def write(self, config, names):
+        """Write the rows for `names` in one transaction, deleting the ones no longer in config."""
+        with self.conn:
+            self.conn.execute("BEGIN")
+            for name in names:
+                if name in config:
+                    # An upsert keeps the row's rowid, and with it the process's place in load()
+                    self.conn.execute("INSERT INTO processes (name, data) VALUES (?, ?) "
+                                      "ON CONFLICT(name) DO UPDATE SET data = excluded.data",
+                                      (name, json.dumps(dict(config[name]))))
                 else:
-                    f.write(f"cd {process['directory']} && {process['command']} &\n")
-    os.chmod(STARTUP_SCRIPT, 0o755)
+                    self.conn.execute("DELETE FROM processes WHERE name = ?", (name,))
 
+    def get_setting(self, key, default=None):
+        """Read a daemon-wide setting, stored as JSON."""
+        row = self.conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
 
-def setup_autostart():
-    cron_command = f"{CRON_MARKER}\n@reboot {STARTUP_SCRIPT}"
-    current_crontab = subprocess.run("crontab -l", shell=True, capture_output=True, text=True).stdout
-    if CRON_MARKER not in current_crontab:
-        new_crontab = current_crontab.strip() + f"\n{cron_command}\n"
-        subprocess.run(f"echo '{new_crontab}' | crontab -", shell=True)
-        print("Set up autostart on system boot")
-    else:
-        print("Autostart is already set up")
+    def set_setting(self, key, value):
+        """Store a daemon-wide setting; None removes it."""
+        with self.conn:
+            if value is None:
+                self.conn.execute("DELETE FROM settings WHERE key = ?", (key,))
+            else:
+                self.conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                                  (key, json.dumps(value)))
 
+    def load_jobs(self):
+        return {name: json.loads(data) for name, data in self.conn.execute("SELECT name, data FROM jobs")}
 
-def disable_autostart():
-    current_crontab = subprocess.run("crontab -l", shell=True, capture_output=True, text=True).stdout
-    new_crontab = "\n".join([line for line in current_crontab.split("\n") if CRON_MARKER not in line and STARTUP_SCRIPT not in line])
-    subprocess.run(f"echo '{new_crontab}' | crontab -", shell=True)
-    print("Disabled autostart on system boot")
+    def write_job(self, name, job):
+        """Store a job definition and its runtime state; None deletes the job and its history."""
+        with self.conn:
+            if job is None:
+                self.conn.execute("DELETE FROM jobs WHERE name = ?", (name,))
+                self.conn.execute("DELETE FROM job_runs WHERE job = ?", (name,))
+            else:
+                self.conn.execute("INSERT OR REPLACE INTO jobs (name, data) VALUES (?, ?)", (name, json.dumps(job)))
 
+    def start_run(self, job, trigger, pid, status='running'):
+        """Record a job run and return its ID, keeping the last JOB_HISTORY runs of the job."""
+        now = time.time()
+        with self.conn:
+            run_id = self.conn.execute(
+                "INSERT INTO job_runs (job, trigger, started_at, finished_at, pid, status) VALUES (?, ?, ?, ?, ?, ?)",
+                (job, trigger, now, None if status == 'running' else now, pid, status)).lastrowid
+            self.conn.execute("DELETE FROM job_runs WHERE job = ? AND id <= ?", (job, run_id - JOB_HISTORY))
+        return run_id
 
-def save_pid():
-    with open(PYPM_PID_FILE, 'w') as f:
-        f.write(str(os.getpid()))
+    def finish_run(self, run_id, exit_code, status):
+        with self.conn:
+            self.conn.execute("UPDATE job_runs SET finished_at = ?, exit_code = ?, status = ? WHERE id = ?",
+                              (time.time(), exit_code, status, run_id))
 
+    def job_runs(self, job, limit):
+        rows = self.conn.execute("SELECT trigger, started_at, finished_at, pid, exit_code, status FROM job_runs "
+                                 "WHERE job = ? ORDER BY id DESC LIMIT ?", (job, limit))
+        keys = ['trigger', 'started_at', 'finished_at', 'pid', 'exit_code', 'status']
+        return [dict(zip(keys, row)) for row in rows]
 
-def get_saved_pid():
-    if PYPM_PID_FILE.exists():
-        with open(PYPM_PID_FILE, 'r') as f:
-            return int(f.read().strip())
-    return None
+    def close(self):
+        self.conn.close()
 
 
-def stop_self():
-    pid = get_saved_pid()
-    if pid and psutil.pid_exists(pid):
-        try:
-            parent = psutil.Process(pid)
-            parent.terminate()
-            print(f"PyPM (PID: {pid}) has been stopped.")
-        except psutil.NoSuchProcess:
-            print("PyPM process not found.")
-    else:
-        print("No running PyPM process found.")
-    if PYPM_PID_FILE.exists():
-        PYPM_PID_FILE.unlink()
-    sys.exit(0)
+def read_proc_stat(pid):
+    """Parse /proc/<pid>/stat into (ppid, session, cpu_ticks, threads, start_ticks)."""
+    with open(f'/proc/{pid}/stat', 'rb') as f:
+        data = f.read()
+    # The command name may contain spaces and parentheses, so split after the last ')'
+    fields = data[data.rindex(b')') + 2:].split()
+    return int(fields[1]), int(fields[3]), int(fields[11]) + int(fields[12]), int(fields[17]), int(fields[19])
 
 
-def restart_self():
-    stop_self()
-    time.sleep(1)  # Give the process time to terminate
-    start_self()
+def read_boot_id():
+    """The kernel's ID for the current boot, or None if /proc doesn't provide one."""
+    try:
+        with open(BOOT_ID_FILE) as f:
+            return f.read().strip()
+    except OSError:
+        return None
 
 
-def start_self():
-    pypm_path = Path(sys.executable).parent / 'pypm'
-    if pypm_path.exists():
-        subprocess.Popen(f"nohup {pypm_path} >/dev/null 2>&1 &", shell=True, start_new_session=True)
-        print("PyPM has been started.")
-    else:
-        print("PyPM executable not found. Please ensure it's installed correctly.")
+def process_identity(pid):
+    """Identify one process instance by boot ID, start time (clock ticks since boot) and argv.
 
-def setup_signal_handlers():
-    """Set up signal handlers for graceful shutdown."""
-    def signal_handler(sig, frame):
-        logging.info(f"Received signal {sig}, shutting down gracefully")
-        print(f"Received signal {sig}, shutting down gracefully")
-        
-        # Stop all managed processes
-        config = load_config()
-        for name, process in config.items():
-            pid = process.get('pid')
-            if pid and psutil.pid_exists(pid):
-                print(f"Stopping process {name} (PID: {pid})")
-                stop_process(pid)
-                config[name]['pid'] = None
-        
-        save_config(config)
-        sys.exit(0)
-    
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+    A reused PID gets a different start time, and the boot ID rules out matching a
+    process from before a reboot. Returns None if the process is gone.
+    """
+    try:
+        start_ticks = read_proc_stat(pid)[4]
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            cmdline = [arg.decode(errors='replace') for arg in f.read().split(b'\0')[:-1]]
+        with open(BOOT_ID_FILE) as f:
+            # Every identity from this boot shares the one string
+            boot_id = sys.intern(f.read().strip())
+    except (OSError, ValueError):
+        return None
+    return {'boot_id': boot_id, 'start_ticks': start_ticks, 'cmdline': cmdline}
 
-def main():
-    save_pid()  # Save the PID when PyPM starts
-    setup_signal_handlers()  # Set up signal handlers
-    config = load_config()
 
-    if len(sys.argv) < 2:
-        print("Usage: pypm [list|start|stop|restart|delete|save|startup|disable-startup|stop-self|restart-self|start-self|enable|disable]")
-        return
+def read_proc_rss(pid):
+    """Resident set size of a process in bytes, from /proc/<pid>/statm."""
+    with open(f'/proc/{pid}/statm', 'rb') as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
 
-    action = sys.argv[1]
 
-    if action == 'list':
-        list_processes(config)
-    elif action == 'start':
-        if len(sys.argv) < 4:  # Require command parameter
-            print("Usage: pypm start <name> <command>")
-            return
-        
-        name = sys.argv[2]
-        directory = os.getcwd()
-        command = ' '.join(sys.argv[3:])
-        
-        # Validate process name
-        if name in config:
-            print(f"Process '{name}' already exists. Use a different name or delete the existing process first.")
-            return
-        
-        valid_name, name_msg = validate_process_name(name)
-        if not valid_name:
-            print(f"Error: {name_msg}")
-            return
-        
-        pid = start_process(name, directory, command)
-        if pid:
-            config[name] = {
-                'command': command, 
-                'pid': pid, 
-                'directory': directory,
-                'max_restarts': 5,  # Default value
-                'restart_delay': 3,  # Default value
-                'restart_count': 0,
-                'created_at': time.time()
-            }
-            save_config(config)
-            print(f"Started {name} with PID {pid}")
-    elif action in ['stop', 'delete']:
-        if len(sys.argv) < 3:
-            print(f"Usage: pypm {action} <name|all>")
-            return
-        
-        target = sys.argv[2]
-        if target == 'all':
-            for name in list(config.keys()):
-                pid = config[name].get('pid')
-                if pid:
-                    if stop_process(pid):
-                        if action == 'delete':
-                            del config[name]
-                            print(f"Deleted {name}")
-                            logging.info(f"Deleted process {name}")
-                        else:
-                            config[name]['pid'] = None
-                            print(f"Stopped {name}")
-                            logging.info(f"Stopped process {name}")
-                    else:
-                        print(f"Failed to stop {name}")
-                        logging.error(f"Failed to stop process {name}")
-        elif target in config:
-            pid = config[target].get('pid')
-            if pid:
-                if stop_process(pid):
-                    if action == 'delete':
-                        del config[target]
-                        print(f"Deleted {target}")
-                        logging.info(f"Deleted process {target}")
-                    else:
-                        config[target]['pid'] = None
-                        print(f"Stopped {target}")
-                        logging.info(f"Stopped process {target}")
-                else:
-                    print(f"Failed to stop {target}")
-                    logging.error(f"Failed to stop process {target}")
-            else:
-                if action == 'delete':
-                    del config[target]
-                    print(f"Deleted {target}")
-                    logging.info(f"Deleted process {target}")
-                else:
-                    print(f"{target} is already stopped")
-        else:
-            print(f"Process {target} not found")
-        
-        save_config(config)
-    elif action == 'restart':
-        if len(sys.argv) < 3:
-            print(f"Usage: pypm {action} <name|all>")
-            return
-        
-        target = sys.argv[2]
-        if target == 'all':
-            for name in list(config.keys()):
-                pid = config[name].get('pid')
-                if pid:
-                    if stop_process(pid):
-                        print(f"Stopped {name}, restarting...")
-                        time.sleep(2)  # Shorter delay
-                        new_pid = start_process(name, config[name]['directory'], config[name]['command'])
-                        if new_pid:
-                            config[name]['pid'] = new_pid
-                            config[name]['restart_count'] = config[name].get('restart_count', 0) + 1
-                            print(f"Restarted {name} with PID {new_pid}")
-                            logging.info(f"Restarted process {name} with PID {new_pid}")
-                        else:
-                            print(f"Failed to restart {name}")
-                            logging.error(f"Failed to restart process {name}")
-                    else:
-                        print(f"Failed to stop {name} for restart")
-                        logging.error(f"Failed to stop process {name} for restart")
-        elif target in config:
-            pid = config[target].get('pid')
-            if pid:
-                if stop_process(pid):
-                    print(f"Stopped {target}, restarting...")
-                    time.sleep(2)  # Shorter delay
-                    new_pid = start_process(target, config[target]['directory'], config[target]['command'])
-                    if new_pid:
-                        config[target]['pid'] = new_pid
-                        config[target]['restart_count'] = config[target].get('restart_count', 0) + 1
-                        print(f"Restarted {target} with PID {new_pid}")
-                        logging.info(f"Restarted process {target} with PID {new_pid}")
-                    else:
-                        print(f"Failed to restart {target}")
-                        logging.error(f"Failed to restart process {target}")
-                else:
-                    print(f"Failed to stop {target} for restart")
-                    logging.error(f"Failed to stop process {target} for restart")
-            else:
-                # Process is already stopped, just start it
-                new_pid = start_process(target, config[target]['directory'], config[target]['command'])
-                if new_pid:
-                    config[target]['pid'] = new_pid
-                    config[target]['restart_count'] = config[target].get('restart_count', 0) + 1
-                    print(f"Started {target} with PID {new_pid}")
-                    logging.info(f"Started process {target} with PID {new_pid}")
-                else:
-                    print(f"Failed to start {target}")
-                    logging.error(f"Failed to start process {target}")
-        else:
-            print(f"Process {target} not found")
-        
-        save_config(config)
-    elif action == 'config':
-        if len(sys.argv) < 4:
-            print("Usage: pypm config <name> <key> <value>")
-            return
-        
-        name = sys.argv[2]
-        if name not in config:
-            print(f"Process {name} not found")
-            return
-            
-        key = sys.argv[3]
-        value = sys.argv[4]
-        
-        # Convert value to appropriate type
-        if key in ['max_restarts', 'restart_delay']:
+def read_proc_io(pid):
+    """Return (read_bytes, write_bytes) from /proc/<pid>/io."""
+    counters = {}
+    with open(f'/proc/{pid}/io', 'rb') as f:
+        for line in f:
+            key, _, value = line.partition(b':')
+            counters[key] = int(value)
+    return counters.get(b'read_bytes', 0), counters.get(b'write_bytes', 0)
+
+
+def count_open_fds(pid):
+    return len(os.listdir(f'/proc/{pid}/fd'))
+
+
+def scan_process_table():
+    """Read /proc/<pid>/stat for every process on the host in a single pass."""
+    table = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
             try:
-                value = int(value)
-            except ValueError:
-                print(f"Value for {key} must be a number")
-                return
-        
-        # Update config
-        config[name][key] = value
-        save_config(config)
-        print(f"Updated {key} to {value} for process {name}")
-        logging.info(f"Updated {key} to {value} for process {name}")
-    
-    elif action == 'status':
-        # Show PyPM status
-        pid = get_saved_pid()
-        if pid and psutil.pid_exists(pid):
-            print(f"PyPM is running with PID {pid}")
-            print(f"Log file: {LOG_FILE}")
-            print(f"Config file: {CONFIG_FILE}")
-            print(f"Startup script: {STARTUP_SCRIPT}")
-            
-            # Check if autostart is enabled
-            current_crontab = subprocess.run("crontab -l", shell=True, capture_output=True, text=True).stdout
-            if PYPM_AUTOSTART_MARKER in current_crontab:
-                print("PyPM autostart: Enabled")
-            else:
-                print("PyPM autostart: Disabled")
-                
-            if CRON_MARKER in current_crontab:
-                print("Process autostart: Enabled")
-            else:
-                print("Process autostart: Disabled")
+                table[int(entry)] = read_proc_stat(entry)
+            except (OSError, ValueError, IndexError):
+                # Exited between listdir and open
+                pass
+    return table
+
+
+class Sample:
+    """Resource usage of one managed process tree from a sampling pass."""
+
+    __slots__ = ('pid', 'cpu', 'memory', 'threads', 'processes', 'fds', 'read_bytes', 'write_bytes',
+                 'cpu_ticks', 'time')
+
+    def __init__(self, pid, cpu, memory, threads, processes, fds, read_bytes, write_bytes, cpu_ticks, time):
+        self.pid = pid
+        self.cpu = cpu
+        self.memory = memory  # MB
+        self.threads = threads
+        self.processes = processes
+        self.fds = fds
+        self.read_bytes = read_bytes
+        self.write_bytes = write_bytes
+        self.cpu_ticks = cpu_ticks
+        self.time = time
+
+
+def sample_process_trees(roots, previous):
+    """Sample CPU, memory and thread usage for each managed process and its descendants.
+
+    `roots` maps names to PIDs, `previous` is the result of the last pass and is
+    used to turn CPU tick counters into a percentage over the sampling interval.
+    A process's tree is everything below it by parent PID plus every member of its
+    session, since managed processes are started as session leaders.
+    """
+    now = time.monotonic()
+    table = scan_process_table()
+    with open('/proc/uptime', 'rb') as f:
+        uptime = float(f.read().split()[0])
+
+    children = {}
+    sessions = {}
+    for pid, (ppid, session, _, _, _) in table.items():
+        children.setdefault(ppid, []).append(pid)
+        sessions.setdefault(session, []).append(pid)
+
+    samples = {}
+    for name, root in roots.items():
+        if root not in table:
+            continue
+        tree = {root}
+        stack = [root]
+        while stack:
+            for child in children.get(stack.pop(), ()):
+                if child not in tree:
+                    tree.add(child)
+                    stack.append(child)
+        tree.update(sessions.get(root, ()))
+
+        cpu_ticks = sum(table[pid][2] for pid in tree)
+        rss = fds = read_bytes = write_bytes = 0
+        for pid in tree:
+            try:
+                rss += read_proc_rss(pid)
+                fds += count_open_fds(pid)
+                pid_read, pid_write = read_proc_io(pid)
+                read_bytes += pid_read
+                write_bytes += pid_write
+            except (OSError, ValueError, IndexError):
+                pass
+
+        last = previous.get(name)
+        if last is not None and last.pid == root and now > last.time:
+            cpu = max(cpu_ticks - last.cpu_ticks, 0) / CLOCK_TICKS / (now - last.time) * 100
         else:
-            print("PyPM is not running")
-    
-    elif action == 'save':
-        for name, process in config.items():
-            process['autostart'] = True
-        save_config(config)
-        create_startup_script(config)
-        print("Saved current process list for autostart")
-        logging.info("Saved current process list for autostart")
-    elif action == 'startup':
-        setup_autostart()
-        logging.info("Set up autostart on system boot")
-    elif action == 'disable-startup':
-        disable_autostart()
-        logging.info("Disabled autostart on system boot")
-    elif action == 'stop-self':
-        logging.info("Stopping PyPM")
-        stop_self()
-    elif action == 'restart-self':
-        logging.info("Restarting PyPM")
-        restart_self()
-    elif action == 'start-self':
-        logging.info("Starting PyPM")
-        start_self()
-    elif action == 'enable':
-        enable_pypm_autostart()
-        logging.info("Enabled PyPM autostart")
-    elif action == 'disable':
-        disable_pypm_autostart()
-        logging.info("Disabled PyPM autostart")
-    else:
-        print("Unknown action. Use list, start, stop, restart, delete, save, startup, disable-startup, stop-self, restart-self, start-self, enable, disable, config, or status.")
+            # First sample: average since the process started
+            age = uptime - table[root][4] / CLOCK_TICKS
+            cpu = cpu_ticks / CLOCK_TICKS / age * 100 if age > 0 else 0.0
 
+        samples[name] = Sample(root, cpu, rss / 1024 / 1024, sum(table[pid][3] for pid in tree), len(tree),
+                               fds, read_bytes, write_bytes, cpu_ticks, now)
+    return samples
 
-if __name__ == "__main__":
-    try:
-        main()
-    except Exception as e:
-        logging.error(f"Unhandled exception: {e}", exc_info=True)
-        print(f"Error: {e}")
-        sys.exit(1)
+
+class MetricsRing:
+    """Fixed-size history of resource samples for one process.
+
+    Samples are packed into one buffer that is allocated once, so memory stays
+    constant however long the process runs; new samples overwrite the oldest.
+    Times are kept in tenths of a second since the ring was created, CPU in tenths of
+    a percent, fd and thread counts capped at 65535 and the I/O counters in KiB,
+    wrapping at 4 TiB (counter_rates skips the wrap like a restart), which brings a
+    sample down to 22 bytes.
+    """
+
+    __slots__ = ('capacity', 'index', 'count', 'base', 'buffer')
+
+    # Sample keys in the order they are packed
+    FIELDS = ('time', 'cpu', 'memory', 'fds', 'threads', 'read_bytes', 'write_bytes')
+    FORMAT = '=IHfHHII'
+    SIZE = 22
+
+    def __init__(self, capacity=METRICS_HISTORY):
+        self.capacity = capacity
+        self.index = 0
+        self.count = 0
+        self.base = time.time()
+        self.buffer = bytearray(capacity * self.SIZE)
+
+    def append(self, sample, timestamp):
+        struct.pack_into(self.FORMAT, self.buffer, self.index * self.SIZE,
+                         max(round((timestamp - self.base) * 10), 0), min(round(sample.cpu * 10), 0xFFFF), sample.memory,
+                         min(sample.fds, 0xFFFF), min(sample.threads, 0xFFFF),
+                         (sample.read_bytes >> 10) & 0xFFFFFFFF, (sample.write_bytes >> 10) & 0xFFFFFFFF)
+        self.index = (self.index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def since(self, timestamp):
+        """Return the samples taken at or after `timestamp` as a dict of lists, oldest first."""
+        samples = list(struct.iter_unpack(self.FORMAT, self.buffer))
+        start = (self.index - self.count) % self.capacity
+        samples = [samples[(start + offset) % self.capacity] for offset in range(self.count)]
+        # Rounded like the stored times, so a sample taken at `timestamp` is included
+        threshold = round((timestamp - self.base) * 10)
+        samples = [sample for sample in samples if sample[0] >= threshold]
+        history = {key: [sample[column] for sample in samples] for column, key in enumerate(self.FIELDS)}
+        history['time'] = [self.base + tenths / 10 for tenths in history['time']]
+        history['cpu'] = [tenths / 10 for tenths in history['cpu']]
+        for key in ('read_bytes', 'write_bytes'):
+            history[key] = [kb << 10 for kb in history[key]]
+        return history
+
+
+# Operations the daemon times, shown by `pypm debug stats` and on the metrics endpoint
+SUPERVISOR_TIMINGS = {
+    'state_load': 'Time to load the process state at daemon start.',
+    'state_write': 'Time to commit a batch of state changes.',
+    'launch_spec': 'Time to resolve a command and its virtualenv into a launch spec.',
+    'spawn_wait': 'Time a spawn waited for a free worker thread.',
+    'spawn': 'Time to fork and exec a managed process.',
+    'restart': 'Time from a process exiting to its replacement running, excluding backoff.',
+    'health_check': 'Time taken by health and readiness probes.',
+    'sample': 'Time taken by a resource sampling pass over /proc.',
+    'loop_lag': 'How late the event loop, which also runs the reaper, fired the sampler timer.',
+}
+# Seconds between stack samples taken by `pypm debug profile`
+PROFILE_INTERVAL = 0.005
+
+
+class Timing:
+    """Running count, total and maximum duration of a supervisor operation."""
+
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+
+def profile_stacks(seconds, interval):
+    """Sample the stacks of every other thread for `seconds`.
+
+    Returns the number of sampling passes and a {folded stack: samples} dict, where a
+    folded stack is "thread;outermost frame;...;innermost frame" as flame graph tools expect.
+    """
+    me = threading.get_ident()
+    folded = {}
+    passes = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ';'.join([names.get(ident, str(ident))] + stack[::-1])
+            folded[key] = folded.get(key, 0) + 1
+        passes += 1
+        time.sleep(interval)
+    return {'seconds': seconds, 'passes': passes, 'stacks': folded}
+
+
+def prometheus_labels(**labels):
+    """Format Prometheus labels, escaping backslashes, quotes and newlines in values."""
+    escaped = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def summarize(values):
+    """Return min/avg/p95/max for a list of numbers, or None if it is empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    p95 = ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+    return {'min': ordered[0], 'avg': sum(ordered) / len(ordered), 'p95': p95, 'max': ordered[-1]}
+
+
+def counter_rates(times, counters):
+    """Turn cumulative counters into per-second rates, skipping resets after restarts."""
+    rates = []
+    for i in range(1, len(counters)):
+        elapsed = times[i] - times[i - 1]
+        if elapsed > 0 and counters[i] >= counters[i - 1]:
+            rates.append((counters[i] - counters[i - 1]) / elapsed)
+    return rates
+
+
+def parse_duration(text):
+    """Parse durations like '90', '90s', '30m', '1h' or '2d' into seconds."""
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+
+def parse_cron_field(text, low, high, names=None):
+    """Parse one cron field into the set of values it matches, e.g. '1-5/2' -> {1, 3, 5}.
+
+    `names` maps month or weekday names to numbers for the fields that accept them.
+    """
+    names = names or {}
+    values = set()
+    for part in text.lower().split(','):
+        part, _, step = part.partition('/')
+        try:
+            if part == '*':
+                start, end = low, high
+            else:
+                start, _, end = part.partition('-')
+                start = names.get(start, start)
+                end = names.get(end, end) if end else (high if step else start)
+                start, end = int(start), int(end)
+            step = int(step) if step else 1
+        except ValueError:
+            raise ValueError(f"'{text}' is not a number, range or name")
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f"'{text}' is outside {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def parse_cron(expression):
+    """Parse a cron expression ("minute hour day month weekday", or @daily and the like).
+
+    Returns (minutes, hours, days, months, weekdays) as sets, with days or weekdays None
+    when the field is '*'. Like cron, if both are restricted a time matches either one.
+    Raises ValueError for invalid expressions.
+    """
+    fields = CRON_ALIASES.get(expression.strip().lower(), expression).split()
+    if len(fields) != 5:
+        raise ValueError("a cron expression has 5 fields: minute hour day month weekday")
+    try:
+        minutes = parse_cron_field(fields[0], 0, 59)
+        hours = parse_cron_field(fields[1], 0, 23)
+        days = None if fields[2] == '*' else parse_cron_field(fields[2], 1, 31)
+        months = parse_cron_field(fields[3], 1, 12, CRON_MONTHS)
+        # 0 and 7 are both Sunday
+        weekdays = None if fields[4] == '*' else {day % 7 for day in parse_cron_field(fields[4], 0, 7, CRON_WEEKDAYS)}
+    except ValueError as e:
+        raise ValueError(f"invalid cron expression '{expression}': {e}")
+    return minutes, hours, days, months, weekdays
+
+
+def next_cron_time(cron, after):
+    """Return the first timestamp after `after` that the parsed cron expression matches (local time)."""
+    minutes, hours, days, months, weekdays = cron
+    timedelta = datetime.timedelta
+    moment = datetime.datetime.fromtimestamp(after).replace(second=0, microsecond=0) + timedelta(minutes=1)
+    # Every valid expression matches within a leap-year cycle
+    limit = moment + timedelta(days=366 * 4)
+    while moment < limit:
+        if moment.month not in months:
+            moment = (moment.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            continue
+        weekday = (moment.weekday() + 1) % 7
+        if days is not None and weekdays is not None:
+            day_ok = moment.day in days or weekday in weekdays
+        else:
+            day_ok = (days is None or moment.day in days) and (weekdays is None or weekday in weekdays)
+        if not day_ok:
+            moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            continue
+        if moment.hour not in hours:
+            moment = moment.replace(minute=0) + timedelta(hours=1)
+            continue
+        if moment.minute not in minutes:
+            moment += timedelta(minutes=1)
+            continue
+        return time.mktime(moment.timetuple())
+    raise ValueError("cron expression never matches")
+
+
+def parse_at(text):
+    """Parse 'HH:MM' (the next time it comes round) or 'YYYY-MM-DD HH:MM' into a timestamp."""
+    try:
+        if len(text) <= 5:
+            clock = datetime.datetime.strptime(text, '%H:%M')
+            moment = datetime.datetime.now().replace(hour=clock.hour, minute=clock.minute, second=0, microsecond=0)
+            if moment <= datetime.datetime.now():
+                moment += datetime.timedelta(days=1)
+        else:
+            moment = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f"--at expects HH:MM or YYYY-MM-DD HH:MM, got '{text}'") from None
+    if moment.timestamp() <= time.time():
+        raise ValueError(f"--at {text} is in the past")
+    return moment.timestamp()
+
+
+def process_log_path(name):
+    return LOG_DIR / f"{name}.log"
+
+
+class LogWriter:
+    """Buffered, rotating log file for one managed process.
+
+    The event loop only appends to an in-memory buffer; the file writes,
+    rotation and gzip run in the supervisor's log thread via write_chunks().
+    """
+
+    __slots__ = ('path', 'max_size', 'max_age', 'keep', 'compress', 'buffer', 'pending',
+                 'flushing', 'file', 'opened_at')
+
+    def __init__(self, path, max_size=LOG_MAX_SIZE, max_age=LOG_MAX_AGE, keep=LOG_KEEP, compress=LOG_COMPRESS):
+        # A plain string: a Path per process costs more memory than the rest of the writer
+        self.path = str(path)
+        self.max_size = max_size
+        self.max_age = max_age
+        self.keep = keep
+        self.compress = compress
+        self.buffer = []
+        self.pending = 0
+        self.flushing = False
+        self.file = None
+        self.opened_at = None
+
+    def append(self, data):
+        self.buffer.append(data)
+        self.pending += len(data)
+
+    def take(self):
+        """Hand the buffered chunks to a flush and start a new buffer."""
+        chunks, self.buffer, self.pending = self.buffer, [], 0
+        return chunks
+
+    def write_chunks(self, chunks):
+        """Write buffered output to disk, rotating first if the file is too big or too old."""
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Unbuffered: every batch is written whole, so a buffer per log would only use memory
+            self.file = open(self.path, 'ab', buffering=0)
+            self.opened_at = time.time()
+        data = memoryview(b''.join(chunks))
+        while data:
+            data = data[self.file.write(data):]
+        too_big = self.max_size and self.file.tell() >= self.max_size
+        too_old = self.max_age and time.time() - self.opened_at >= self.max_age
+        if too_big or too_old:
+            self.rotate()
+
+    def rotate(self):
+        """Shift <name>.log.N segments up, drop the oldest and start a new file."""
+        self.close()
+        path = Path(self.path)
+        suffix = '.gz' if self.compress else ''
+        for index in range(self.keep - 1, 0, -1):
+            for ext in ('', '.gz'):
+                older = Path(f"{self.path}.{index}{ext}")
+                if older.exists():
+                    older.rename(f"{self.path}.{index + 1}{ext}")
+        # Drop everything past `keep`, including segments left over from a larger keep
+        for segment in path.parent.glob(f"{glob.escape(path.name)}.*"):
+            index = segment.name[len(path.name) + 1:].split('.')[0]
+            if index.isdigit() and int(index) > self.keep:
+                segment.unlink()
+        if self.keep < 1:
+            path.unlink()
+            return
+        rotated = Path(f"{path}.1")
+        path.rename(rotated)
+        if suffix:
+            with open(rotated, 'rb') as source, gzip.open(f"{rotated}{suffix}", 'wb') as target:
+                shutil.copyfileobj(source, target)
+            rotated.unlink()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def format_log_lines(label, lines):
+    """Prefix each captured line with a timestamp and its stream (out/err)."""
+    prefix = f"{time.strftime('%Y-%m-%d %H:%M:%S')} [{label}] ".encode()
+    return b''.join(prefix + line + b'\n' for line in lines)
+
+
+def tail_lines(path, count):
+    """Return the last `count` lines of a file, reading backwards from the end in blocks."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        while position > 0 and data.count(b'\n') <= count:
+            step = min(8192, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    lines = data.splitlines()
+    return [line.decode(errors='replace') for line in lines[-count:]] if count else []
+
+
+def follow_logs(paths, count):
+    """Print the tail of each log, then keep printing new lines, surviving rotation."""
+    positions = {}
+    for path in paths:
+        if path.exists():
+            for line in tail_lines(path, count):
+                print(f"[{path.stem}] {line}" if len(paths) > 1 else line)
+            positions[path] = (path.stat().st_ino, path.stat().st_size)
+    try:
+        while True:
+            for path in paths:
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                inode, offset = positions.get(path, (stat.st_ino, 0))
+                if stat.st_ino != inode or stat.st_size < offset:
+                    # Rotated or truncated, start from the top of the new file
+                    offset = 0
+                if stat.st_size > offset:
+                    with open(path, 'rb') as f:
+                        f.seek(offset)
+                        data = f.read()
+                    # Only print complete lines
+                    data = data[:data.rfind(b'\n') + 1]
+                    for line in data.decode(errors='replace').splitlines():
+                        print(f"[{path.stem}] {line}" if len(paths) > 1 else line)
+                    offset += len(data)
+                    sys.stdout.flush()
+                positions[path] = (stat.st_ino, offset)
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+
+
+def show_logs(name, lines, follow):
+    """`pypm logs`: print a process's log, or its instances' logs for a group."""
+    paths = [process_log_path(name)]
+    if not paths[0].exists():
+        paths = sorted(LOG_DIR.glob(f"{glob.escape(name)}:*.log")) or paths
+    if not any(path.exists() for path in paths) and not follow:
+        print(f"No logs found for {name} in {LOG_DIR}")
+        return
+    if follow:
+        follow_logs(paths, lines)
+        return
+    for path in paths:
+        if len(paths) > 1:
+            print(f"==> {path} <==")
+        for line in tail_lines(path, lines):
+            print(line)
+
+
+def list_processes(rows):
+    """Print the process table returned by the daemon's list action."""
+    if not rows:
+        print("No processes are currently being managed by PyPM")
+        return
+
+    # Rows merged from several agents by `pypm fleet list` carry their host
+    fleet = any('host' in row for row in rows)
+    print(f"{'HOST':<22} " * fleet + f"{'NAME':<20} {'STATUS':<10} {'PID':<8} {'CPU':<8} {'MEM':<8} {'RESTARTS':<8} {'HEALTH':<14}")
+    print("-" * (80 + 23 * fleet))
+
+    for row in rows:
+        name = row['name']
+        pid = row['pid']
+        restarts = row['restarts']
+        if fleet:
+            print(f"{row['host']:<22} ", end='')
+
+        if row['status'] == 'RUNNING':
+            print(f"{name:<20} {'RUNNING':<10} {pid:<8} {row['cpu']:>7.1f}% {row['memory']:>6.1f}MB {restarts:>8} "
+                  f"{row['health'] or '-':<14}")
+        elif row['status'] == 'ERROR':
+            print(f"{name:<20} ERROR      {pid:<8} {'N/A':<8} {'N/A':<8} {restarts:>8} {'-':<14}")
+        else:
+            print(f"{name:<20} {row['status']:<10} {'N/A':<8} {'N/A':<8} {'N/A':<8} {restarts:>8} {'-':<14}")
+
+
+def format_time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp)) if timestamp else '-'
+
+
+def print_jobs(rows):
+    """Print the job table returned by `pypm job list`."""
+    if not rows:
+        print("No jobs are defined, add one with `pypm job <name> --cron EXPR <command>`")
+        return
+    print(f"{'NAME':<20} {'SCHEDULE':<25} {'NEXT RUN':<17} {'RUNNING':<8} {'LAST RUN':<17} {'RESULT':<10}")
+    print("-" * 101)
+    for row in rows:
+        last = row['last_run'] or {}
+        result = last.get('status', '-')
+        if last.get('exit_code') not in (None, 0):
+            result += f" ({last['exit_code']})"
+        print(f"{row['name']:<20} {row['schedule']:<25} {format_time(row['next_run']):<17} {row['running']:<8} "
+              f"{format_time(last.get('started_at')):<17} {result:<10}")
+
+
+def print_job_history(runs):
+    if not runs:
+        print("The job has not run yet")
+        return
+    print(f"{'STARTED':<17} {'TRIGGER':<9} {'DURATION':>9} {'PID':<8} {'EXIT':<5} {'STATUS':<8}")
+    for run in runs:
+        duration = f"{run['finished_at'] - run['started_at']:.1f}s" if run['finished_at'] else '-'
+        exit_code = '-' if run['exit_code'] is None else run['exit_code']
+        print(f"{format_time(run['started_at']):<17} {run['trigger']:<9} {duration:>9} {run['pid'] or '-':<8} "
+              f"{exit_code:<5} {run['status']:<8}")
+
+
+def find_venv(directory):
+    venv_dirs = ['venv', '.venv', 'env', '.env', '.']
+    for venv in venv_dirs:
+        venv_path = Path(directory) / venv
+        if (venv_path / 'bin' / 'activate').exists():
+            return venv_path
+        # Check if we're already in a venv
+        elif (venv_path / 'activate').exists():
+            return venv_path.parent
+
+    # Check parent directory as well
+    parent_dir = Path(directory).parent
+    for venv in venv_dirs:
+        venv_path = parent_dir / venv
+        if (venv_path / 'bin' / 'activate').exists():
+            return venv_path
+
+    return None
+
+
+def launch_fingerprint(paths):
+    """Stat the paths a launch spec depends on; any change means it must be resolved again."""
+    fingerprint = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            fingerprint.append((st.st_ino, st.st_mtime_ns))
+        except OSError:
+            fingerprint.append(None)
+    return fingerprint
+
+
+def resolve_launch_spec(directory, command):
+    """Resolve a command once into everything needed to exec it directly.
+
+    Activating the venv only amounts to putting its bin/ first on PATH and setting
+    VIRTUAL_ENV, so that is done in the environment instead of sourcing bin/activate.
+    Commands using shell syntax (pipes, redirects, globs, ...) still run under bash.
+    Raises ValueError if the command can't be run.
+    """
+    valid, msg = validate_command(directory, command)
+    if not valid:
+        raise ValueError(msg)
+
+    env = {}
+    path = os.environ.get('PATH', os.defpath)
+    venv_path = find_venv(directory)
+    if venv_path:
+        path = f"{venv_path}/bin:{path}"
+        env.update(VIRTUAL_ENV=str(venv_path), PATH=path)
+
+    if SHELL_SYNTAX.search(command):
+        argv = ['/bin/bash', '-c', command]
+    else:
+        argv = shlex.split(command)
+        # Leading NAME=value words are environment assignments, as in the shell
+        while argv and ENV_ASSIGNMENT.match(argv[0]):
+            key, _, value = argv.pop(0).partition('=')
+            env[key] = value
+    if not argv:
+        raise ValueError("Empty command")
+    if '/' in argv[0]:
+        executable = os.path.join(directory, argv[0])
+    else:
+        executable = shutil.which(argv[0], path=path)
+    if not executable:
+        raise ValueError(f"'{argv[0]}' not found in PATH")
+
+    # Creating a venv changes its parent directory, so the directories cover that case
+    watched = [directory, str(Path(directory).parent), os.path.join(directory, command_script(command))]
+    if venv_path:
+        watched.append(str(Path(venv_path) / 'bin'))
+    return {
+        'directory': directory,
+        'command': command,
+        'argv': argv,
+        'executable': executable,
+        'env': env,
+        'venv': bool(venv_path),
+        'watched': watched,
+        'fingerprint': launch_fingerprint(watched),
+    }
+
+
+# Restart policies: given the exit code, should the process be started again?
+RESTART_POLICIES = {
+    'always': lambda exit_code: True,
+    'on-failure': lambda exit_code: exit_code != 0,
+    'never': lambda exit_code: False,
+}
+
+
+def parse_restart_policy(text):
+    if text not in RESTART_POLICIES:
+        raise ValueError(f"use one of {', '.join(RESTART_POLICIES)}")
+    return text
+
+
+def parse_exit_codes(text):
+    """Parse per exit code policies like '0=never,3=always' into {'0': 'never', '3': 'always'}."""
+    policies = {}
+    for part in str(text).split(','):
+        code, sep, policy = part.strip().partition('=')
+        if not sep:
+            raise ValueError("use CODE=POLICY pairs, e.g. 0=never,3=always")
+        policies[str(int(code))] = parse_restart_policy(policy.strip())
+    return policies
+
+
+def restart_policy(process_config, exit_code):
+    """Return the restart policy that applies to an exit code."""
+    return (process_config.get('exit_codes') or {}).get(
+        str(exit_code), process_config.get('restart_policy', DEFAULT_RESTART_POLICY))
+
+
+def backoff_delay(base, attempt, cap):
+    """Exponential backoff with jitter: somewhere between half and all of base * 2^attempt.
+
+    The jitter spreads out processes that crashed together, e.g. on a database blip,
+    so they don't all come back (and fail again) at the same instant.
+    """
+    delay = min(base * 2 ** attempt, cap)
+    return random.uniform(delay / 2, delay)
+
+
+# Settings stored as whole numbers (seconds or counts)
+INT_SETTINGS = ['max_restarts', 'restart_delay', 'max_restart_delay', 'stable_after', 'circuit_cooldown',
+                'stop_timeout', 'ready_timeout', 'log_max_size', 'log_max_age', 'log_keep',
+                'health_interval', 'health_timeout', 'health_threshold']
+
+
+def parse_setting(key, value):
+    """Convert a setting from `pypm config` or an ecosystem file to the type it is stored as.
+
+    Raises ValueError with a message for the user, also for keys that are not settings.
+    """
+    if key in INT_SETTINGS:
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError(f"Value for {key} must be a number")
+    elif key == 'watch_delay':
+        try:
+            return float(value)
+        except ValueError:
+            raise ValueError(f"Value for {key} must be a number")
+    elif key in ['log_compress', 'autostart', 'watch']:
+        if isinstance(value, bool):
+            return value
+        if str(value).lower() not in ['true', 'false']:
+            raise ValueError(f"Value for {key} must be true or false")
+        return str(value).lower() == 'true'
+    elif key == 'cron_restart':
+        if value is None or str(value).lower() in ['none', 'off']:
+            return None
+        try:
+            next_cron_time(parse_cron(str(value)), time.time())
+        except ValueError as e:
+            raise ValueError(f"Invalid value for {key}: {e}")
+        return str(value)
+    elif key in ['depends_on', 'watch_include', 'watch_ignore']:
+        if value is None or str(value).lower() in ['none', 'off']:
+            return None
+        return [str(name).strip() for name in (value.split(',') if isinstance(value, str) else value)]
+    elif key in ['health_check', 'ready_check', 'restart_policy', 'exit_codes'] or key in LIMIT_PARSERS:
+        if value is None or str(value).lower() in ['none', 'off']:
+            return None
+        if key == 'exit_codes' and isinstance(value, dict):
+            value = ','.join(f"{code}={policy}" for code, policy in value.items())
+        try:
+            if key in ['health_check', 'ready_check']:
+                return parse_probe(str(value))
+            elif key == 'restart_policy':
+                return parse_restart_policy(str(value))
+            elif key == 'exit_codes':
+                return parse_exit_codes(value)
+            return LIMIT_PARSERS[key](str(value))
+        except ValueError as e:
+            raise ValueError(f"Invalid value for {key}: {e}")
+    raise ValueError(f"Unknown setting '{key}'")
+
+
+def parse_size(text):
+    """Parse sizes like '512M', '2G', '100K' or plain bytes."""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = str(text).strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def parse_cpu_list(text):
+    """Parse a CPU list like '0-3,6' into a sorted list of CPU numbers."""
+    cpus = set()
+    for part in str(text).split(','):
+        start, _, end = part.strip().partition('-')
+        cpus.update(range(int(start), int(end or start) + 1))
+    if not cpus:
+        raise ValueError("empty CPU list")
+    return sorted(cpus)
+
+
+def parse_ionice(text):
+    """Parse 'idle', 'best-effort[:0-7]' or 'realtime[:0-7]' into (class, level)."""
+    classes = {'idle': psutil.IOPRIO_CLASS_IDLE, 'best-effort': psutil.IOPRIO_CLASS_BE,
+               'realtime': psutil.IOPRIO_CLASS_RT}
+    ioclass, _, level = str(text).partition(':')
+    if ioclass not in classes:
+        raise ValueError("use idle, best-effort[:0-7] or realtime[:0-7]")
+    if ioclass == 'idle':
+        return classes[ioclass], None
+    level = int(level or 4)
+    if not 0 <= level <= 7:
+        raise ValueError("level must be between 0 and 7")
+    return classes[ioclass], level
+
+
+def parse_nice(text):
+    value = int(text)
+    if not -20 <= value <= 19:
+        raise ValueError("nice must be between -20 and 19")
+    return value
+
+
+def parse_cpu_quota(text):
+    value = float(text)
+    if value <= 0:
+        raise ValueError("cpu_quota is a percentage of one CPU and must be positive")
+    return value
+
+
+# Per-process resource limit settings and the parser that validates each one
+LIMIT_PARSERS = {
+    'max_memory': parse_size,
+    'cpu_quota': parse_cpu_quota,
+    'nice': parse_nice,
+    'ionice': lambda text: (parse_ionice(text), str(text))[1],
+    'cpu_affinity': lambda text: (parse_cpu_list(text), str(text))[1],
+    'max_open_files': int,
+}
+
+
+# Keys an ecosystem file declares; everything else in a config entry is runtime state
+SETTING_KEYS = INT_SETTINGS + ['log_compress', 'health_check', 'ready_check', 'restart_policy',
+                               'exit_codes', 'depends_on', 'watch', 'watch_include', 'watch_ignore',
+                               'watch_delay', 'cron_restart', 'autostart'] + list(LIMIT_PARSERS)
+DECLARED_KEYS = ['command', 'directory', 'env', 'listen', 'group', 'instance'] + SETTING_KEYS
+# Changing any of these needs a new process
+RELAUNCH_KEYS = ['command', 'directory', 'env', 'listen']
+
+
+def find_cgroup_root():
+    """Return a delegated cgroup v2 directory PyPM can create child groups in, or None.
+
+    Controllers can only be delegated to children of a cgroup that has no processes
+    of its own, so the daemon first moves itself into a `supervisor` leaf.
+    """
+    if not (CGROUP_ROOT / 'cgroup.controllers').exists():
+        return None
+    configured = os.environ.get('PYPM_CGROUP')
+    if configured:
+        root = Path(configured)
+    else:
+        with open('/proc/self/cgroup') as f:
+            own = next((line.split('::', 1)[1].strip() for line in f if line.startswith('0::')), None)
+        if own is None:
+            return None
+        root = CGROUP_ROOT / own.lstrip('/')
+        if root.name == 'supervisor':
+            # Still in the leaf from a previous daemon with the same PID namespace layout
+            root = root.parent
+    try:
+        supervisor = root / 'supervisor'
+        supervisor.mkdir(exist_ok=True)
+        (supervisor / 'cgroup.procs').write_text(str(os.getpid()))
+        available = (root / 'cgroup.controllers').read_text().split()
+        for controller in ('memory', 'cpu'):
+            if controller in available:
+                (root / 'cgroup.subtree_control').write_text(f"+{controller}")
+    except OSError as e:
+        logging.info(f"cgroup v2 subtree {root} is not delegated to PyPM ({e}), using rlimits only")
+        return None
+    return root
+
+
+def build_limits(process_config, cgroup_procs=None):
+    """Return a function that applies a process's resource limits to it by PID, from the daemon.
+
+    It runs as soon as the exec has succeeded, normally before the new process starts
+    threads or forks, though the bash wrapper of a shell command may have. Applying
+    them in the child instead would need a Python preexec_fn, which can deadlock in a
+    threaded daemon and rules out vfork. The process is moved into its cgroup first,
+    so everything it forks later is accounted there. Returns None when nothing needs
+    applying.
+    """
+    nice = process_config.get('nice')
+    max_open_files = process_config.get('max_open_files')
+    affinity = parse_cpu_list(process_config['cpu_affinity']) if process_config.get('cpu_affinity') else None
+    ionice = parse_ionice(process_config['ionice']) if process_config.get('ionice') else None
+    if cgroup_procs is None and nice is None and max_open_files is None and affinity is None and ionice is None:
+        return None
+
+    def apply_limits(pid):
+        if cgroup_procs is not None:
+            with open(cgroup_procs, 'w') as f:
+                f.write(str(pid))
+        if nice is not None:
+            os.setpriority(os.PRIO_PROCESS, pid, nice)
+        if max_open_files is not None:
+            resource.prlimit(pid, resource.RLIMIT_NOFILE, (max_open_files, max_open_files))
+        if affinity is not None:
+            os.sched_setaffinity(pid, affinity)
+        if ionice is not None:
+            ioclass, level = ionice
+            if level is None:
+                psutil.Process(pid).ionice(ioclass)
+            else:
+                psutil.Process(pid).ionice(ioclass, level)
+
+    return apply_limits
+
+
+def parse_listen_spec(spec):
+    """Parse 'tcp:PORT', 'tcp:HOST:PORT' or 'unix:PATH' into (family, address)."""
+    kind, _, address = spec.partition(':')
+    if kind == 'unix' and address:
+        return socket.AF_UNIX, address
+    if kind == 'tcp':
+        host, _, port = address.rpartition(':')
+        host = host.strip('[]')
+        if port.isdigit():
+            return (socket.AF_INET6 if ':' in host else socket.AF_INET), (host or '0.0.0.0', int(port))
+    raise ValueError(f"Invalid listen address '{spec}', use tcp:PORT, tcp:HOST:PORT or unix:PATH")
+
+
+def open_listener(spec):
+    """Bind and listen on a socket that will be handed to managed processes."""
+    family, address = parse_listen_spec(spec)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        if family == socket.AF_UNIX:
+            if os.path.exists(address):
+                os.unlink(address)
+        else:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+        sock.listen(socket.SOMAXCONN)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def listen_trampoline(argv, executable, fds):
+    """Wrap a command so the listening sockets arrive as fds 3, 4, ... with LISTEN_PID set.
+
+    The sd_listen_fds() convention needs LISTEN_PID to be the application's own PID,
+    which isn't known before fork, so a bash one-liner sets it and execs the command
+    (keeping that PID). The fds are parked above the highest source fd first so that
+    moving them into place can't overwrite one another.
+    """
+    base = max(fds) + 1
+    park = ' '.join(f"{base + index}<&{fd} {fd}<&-" for index, fd in enumerate(fds))
+    place = ' '.join(f"{3 + index}<&{base + index} {base + index}<&-" for index in range(len(fds)))
+    script = f'exec {park}; exec {place}; export LISTEN_PID=$$; exec -a "$0" "$@"'
+    return ['/bin/bash', '-c', script, argv[0], executable, *argv[1:]]
+
+
+def start_process(name, spec, env=None, apply_limits=None, listeners=None):
+    """Spawn a managed process from its launch spec and return its Popen handle, or None on failure.
+
+    The command is exec'd directly, so the PID is the application's own. `env` holds
+    extra environment variables layered over PyPM's own environment, `apply_limits`
+    applies resource limits to the new PID (see build_limits); a process whose limits
+    can't be applied is killed. The child is started with vfork/exec, which is much
+    cheaper for a large daemon. `listeners` maps listen specs to bound sockets, passed
+    on in order as LISTEN_FDS.
+    """
+    child_env = {**os.environ, 'PYTHONUNBUFFERED': '1', **spec['env'], **(env or {})}
+    if spec['venv']:
+        # bin/activate unsets it too
+        child_env.pop('PYTHONHOME', None)
+    argv, executable, pass_fds = spec['argv'], spec['executable'], ()
+    if listeners:
+        pass_fds = [sock.fileno() for sock in listeners.values()]
+        argv, executable = listen_trampoline(argv, executable, pass_fds), '/bin/bash'
+        child_env['LISTEN_FDS'] = str(len(pass_fds))
+
+    try:
+        # Start the process in a new session
+        process = subprocess.Popen(
+            argv,
+            executable=executable,
+            pass_fds=pass_fds,
+            cwd=spec['directory'],
+            start_new_session=True,
+            # Unbuffered so captured output reaches the log as it is printed
+            env=child_env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            # The pipes are read with os.read on the event loop, a read buffer would sit unused
+            bufsize=0
+        )
+    except Exception as e:
+        logging.error(f"Failed to start process {name}: {e}")
+        print(f"Error starting process: {e}")
+        return None
+
+    try:
+        if apply_limits is not None:
+            apply_limits(process.pid)
+    except Exception as e:
+        logging.error(f"Failed to apply resource limits to process {name} (PID: {process.pid}): {e}")
+        process.kill()
+        process.wait()
+        process.stdout.close()
+        process.stderr.close()
+        return None
+    logging.info(f"Started process {name} with PID {process.pid}")
+    return process
+
+
+def dependency_waves(config, names):
+    """Order processes into waves where each process only depends on earlier waves.
+
+    `depends_on` may name processes or groups. Dependencies outside `names` (already
+    running, or not saved for autostart) hold nothing up. Raises ValueError on a cycle.
+    """
+    pending = {}
+    for name in names:
+        dependencies = set()
+        for dependency in config[name].get('depends_on') or []:
+            dependencies.update(member for member in names
+                                if member == dependency or config[member].get('group') == dependency)
+        dependencies.discard(name)
+        pending[name] = dependencies
+
+    waves = []
+    while pending:
+        wave = [name for name, dependencies in pending.items() if not dependencies]
+        if not wave:
+            raise ValueError(f"Dependency cycle between {', '.join(sorted(pending))}")
+        waves.append(wave)
+        for name in wave:
+            del pending[name]
+        for dependencies in pending.values():
+            dependencies.difference_update(wave)
+    return waves
+
+
+def save_pid():
+    with open(PYPM_PID_FILE, 'w') as f:
+        f.write(str(os.getpid()))
+
+
+def get_saved_pid():
+    if PYPM_PID_FILE.exists():
+        with open(PYPM_PID_FILE, 'r') as f:
+            return int(f.read().strip())
+    return None
+
+
+def send_request(request, timeout=None):
+    """Send one request to the daemon over the control socket and return its response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(str(SOCKET_FILE))
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("PyPM daemon closed the connection without a response")
+    return json.loads(line)
+
+
+def fleet_token(create=False):
+    """The shared fleet token from PYPM_FLEET_TOKEN or FLEET_TOKEN_FILE, generating the file if asked."""
+    token = os.environ.get('PYPM_FLEET_TOKEN', '').strip()
+    if token:
+        return token
+    try:
+        with open(FLEET_TOKEN_FILE) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        if not create:
+            return None
+    token = secrets.token_hex(32)
+    fd = os.open(FLEET_TOKEN_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token + '\n')
+    return token
+
+
+def fleet_signature(token, role, challenge):
+    """HMAC of a login challenge; the role keeps a client's answer from being replayed as the agent's."""
+    return hmac.new(token.encode(), f"{role}:{challenge}".encode(), 'sha256').hexdigest()
+
+
+def fleet_session_key(token, agent_challenge, client_challenge):
+    """Key that signs the messages of one fleet connection, fresh for every login."""
+    return hmac.new(token.encode(), f"session:{agent_challenge}:{client_challenge}".encode(), 'sha256').digest()
+
+
+def fleet_seal(key, role, sequence, message):
+    """Encode a message for a logged-in fleet connection as one line: its signature, then its JSON.
+
+    The signature covers the sender's role and the message's sequence number on the
+    connection, so a message can't be altered, replayed, reordered or reflected back.
+    """
+    body = json.dumps(message)
+    signature = hmac.new(key, f"{role}:{sequence}:{body}".encode(), 'sha256').hexdigest()
+    return f"{signature} {body}\n".encode()
+
+
+def fleet_unseal(key, role, sequence, line):
+    """Check and decode a line from fleet_seal(). Raises ValueError if the signature doesn't match."""
+    signature, _, body = line.decode(errors='replace').rstrip('\n').partition(' ')
+    expected = hmac.new(key, f"{role}:{sequence}:{body}".encode(), 'sha256').hexdigest()
+    if not hmac.compare_digest(signature, expected):
+        raise ValueError("message failed the integrity check")
+    return json.loads(body)
+
+
+def is_loopback(host):
+    """Whether a listen address only accepts connections from this machine."""
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == 'localhost'
+
+
+def parse_address(text, default_port):
+    """Split 'host', 'host:port' or '[v6 address]:port' into (host, port)."""
+    match = re.fullmatch(r'\[([^\]]+)\](?::(\d+))?|([^:\[\]]+)(?::(\d+))?', text.strip())
+    if not match:
+        raise ValueError(f"Invalid host address '{text}'")
+    port = match.group(2) or match.group(4)
+    return match.group(1) or match.group(3), int(port) if port else default_port
+
+
+def fleet_addresses(hosts):
+    """Agent addresses from a comma-separated --hosts value, or from FLEET_HOSTS_FILE."""
+    if hosts:
+        entries = hosts.split(',')
+    else:
+        try:
+            with open(FLEET_HOSTS_FILE) as f:
+                entries = [line.split('#')[0] for line in f]
+        except FileNotFoundError:
+            entries = []
+    return [parse_address(entry, AGENT_PORT) for entry in entries if entry.strip()]
+
+
+class FleetConnection:
+    """A logged-in connection to one fleet agent, with its session key and message count."""
+
+    __slots__ = ('reader', 'writer', 'key', 'sequence')
+
+    def __init__(self, reader, writer, key):
+        self.reader = reader
+        self.writer = writer
+        self.key = key
+        self.sequence = 0
+
+
+class FleetPool:
+    """Logged-in connections to fleet agents, one per host, reused for every request."""
+
+    def __init__(self, token, timeout=FLEET_TIMEOUT):
+        self.token = token
+        self.timeout = timeout
+        self.connections = {}   # (host, port) -> FleetConnection
+        self.limit = asyncio.Semaphore(FLEET_CONCURRENCY)
+
+    async def connect(self, address):
+        reader, writer = await asyncio.open_connection(*address, limit=REQUEST_LIMIT)
+        try:
+            hello = json.loads(await reader.readline() or b'{}')
+            challenge = secrets.token_hex(16)
+            agent_challenge = str(hello.get('challenge', ''))
+            answer = fleet_signature(self.token, 'fleet', agent_challenge)
+            writer.write(json.dumps({'auth': answer, 'challenge': challenge}).encode() + b'\n')
+            await writer.drain()
+            reply = json.loads(await reader.readline() or b'{}')
+            if not reply.get('ok'):
+                raise ConnectionError("authentication failed, check the fleet token")
+            if not hmac.compare_digest(str(reply.get('auth', '')), fleet_signature(self.token, 'agent', challenge)):
+                raise ConnectionError("the agent does not know the fleet token")
+        except BaseException:
+            writer.close()
+            raise
+        return FleetConnection(reader, writer, fleet_session_key(self.token, agent_challenge, challenge))
+
+    async def request(self, address, request):
+        """Send one request to one agent and return its response."""
+        connection = self.connections.pop(address, None)
+        if connection is not None:
+            try:
+                return await self.exchange(address, connection, request)
+            except ConnectionError:
+                pass  # the agent closed the idle connection, log in again
+        return await self.exchange(address, await self.connect(address), request)
+
+    async def exchange(self, address, connection, request):
+        sequence = connection.sequence
+        try:
+            connection.writer.write(fleet_seal(connection.key, 'fleet', sequence, request))
+            await connection.writer.drain()
+            line = await connection.reader.readline()
+            if not line:
+                raise ConnectionError("the agent closed the connection")
+            response = fleet_unseal(connection.key, 'agent', sequence, line)
+        except ValueError as e:
+            connection.writer.close()
+            raise ValueError(f"response from the agent {e}")
+        except BaseException:
+            connection.writer.close()
+            raise
+        connection.sequence += 1
+        self.connections[address] = connection
+        return response
+
+    async def fan_out(self, addresses, request):
+        """Send a request to every agent concurrently. Returns {address: response, or an error message}."""
+        async def one(address):
+            async with self.limit:
+                try:
+                    return await asyncio.wait_for(self.request(address, request), self.timeout)
+                except asyncio.TimeoutError:
+                    return f"timed out after {self.timeout:g}s"
+                except (OSError, ValueError) as e:
+                    return str(e) or type(e).__name__
+        results = await asyncio.gather(*(one(address) for address in addresses))
+        return dict(zip(addresses, results))
+
+    def close(self):
+        for connection in self.connections.values():
+            connection.writer.close()
+        self.connections.clear()
+
+
+def fleet(args, as_json=False):
+    """`pypm fleet list|restart|apply`: run a command on every agent and merge the results.
+
+    Returns False if any host failed to respond, after reporting the others.
+    """
+    hosts = pop_option(args, '--hosts')
+    timeout = pop_option(args, '--timeout', default=FLEET_TIMEOUT, cast=float)
+    if not args or args[0] not in ['list', 'restart', 'apply']:
+        print("Usage: pypm fleet list|restart <name|all>|apply <ecosystem file> [--prune] [--dry-run] "
+              "[--hosts HOST[:PORT],...] [--timeout S]")
+        return False
+    request = build_request(args[0], args[1:])
+    if request is None:
+        return False
+    addresses = fleet_addresses(hosts)
+    if not addresses:
+        print(f"No hosts given, use --hosts or list them in {FLEET_HOSTS_FILE}")
+        return False
+    token = fleet_token()
+    if token is None:
+        print(f"No fleet token, copy {FLEET_TOKEN_FILE} from an agent host or set PYPM_FLEET_TOKEN")
+        return False
+
+    async def run():
+        pool = FleetPool(token, timeout)
+        try:
+            return await pool.fan_out(addresses, request)
+        finally:
+            pool.close()
+    results = asyncio.run(run())
+    if as_json:
+        print(json.dumps({f"{host}:{port}": result if isinstance(result, dict) else {'ok': False, 'error': result}
+                          for (host, port), result in results.items()}, indent=2))
+        return all(isinstance(result, dict) and result.get('ok') for result in results.values())
+
+    rows = []
+    failed = {}
+    for (host, port), result in results.items():
+        label = host if port == AGENT_PORT else f"{host}:{port}"
+        if isinstance(result, str) or not result.get('ok'):
+            failed[label] = result if isinstance(result, str) else '; '.join(result.get('messages', []))
+            continue
+        for line in result.get('messages', []):
+            print(f"[{label}] {line}")
+        if request['action'] == 'list':
+            rows.extend({**row, 'host': label} for row in result['data'])
+    if request['action'] == 'list' and len(failed) < len(results):
+        list_processes(rows)
+    print(f"{len(results) - len(failed)} of {len(results)} hosts responded")
+    for label, error in failed.items():
+        print(f"  {label}: {error}")
+    return not failed
+
+
+def daemon_running():
+    """Return True if a daemon is accepting connections on the control socket."""
+    try:
+        return send_request({'action': 'ping'}, timeout=2).get('ok', False)
+    except (OSError, ValueError):
+        return False
+
+
+def ensure_daemon():
+    """Start the daemon if it is not running and wait for its socket to come up."""
+    if daemon_running():
+        return True
+    start_self()
+    for _ in range(50):
+        if daemon_running():
+            return True
+        time.sleep(0.1)
+    print(f"PyPM daemon did not come up, check {LOG_FILE}")
+    return False
+
+
+def stop_self():
+    pid = get_saved_pid()
+    if pid and psutil.pid_exists(pid):
+        try:
+            parent = psutil.Process(pid)
+            parent.terminate()
+            # Wait for the daemon to stop its processes and exit
+            parent.wait(timeout=30)
+            print(f"PyPM (PID: {pid}) has been stopped.")
+        except psutil.NoSuchProcess:
+            print("PyPM process not found.")
+        except psutil.TimeoutExpired:
+            print(f"PyPM (PID: {pid}) did not exit within 30 seconds.")
+    else:
+        print("No running PyPM process found.")
+    if PYPM_PID_FILE.exists():
+        PYPM_PID_FILE.unlink()
+
+
+def restart_self():
+    """Restart the daemon in place (e.g. after an upgrade). Managed processes keep running."""
+    if not daemon_running():
+        start_self()
+        return
+    pid = get_saved_pid()
+    response = send_request({'action': 'reexec'})
+    for line in response.get('messages', []):
+        print(line)
+    time.sleep(0.2)
+    for _ in range(100):
+        if daemon_running():
+            print(f"PyPM (PID: {pid}) has been restarted.")
+            return
+        time.sleep(0.1)
+    print(f"PyPM did not come back up, check {LOG_FILE}")
+
+
+def daemon_command(*args):
+    """Command line that runs the daemon with this file imported as a module.
+
+    Python keeps the syntax tree of a script it runs (about 10 MB for this one) until
+    the script returns, which for the daemon is never. Imported, only the compiled
+    code stays, and the cached bytecode spares compiling it on every start.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    module = Path(__file__).stem
+    code = f"import sys; sys.path.insert(0, {directory!r}); import {module}; {module}.cli()"
+    return [sys.executable, '-c', code, 'daemon', *args]
+
+
+def start_self():
+    if daemon_running():
+        print("PyPM is already running.")
+        return
+    subprocess.Popen(
+        daemon_command(),
+        start_new_session=True,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    print("PyPM has been started.")
+
+def setup_signal_handlers(loop, callback):
+    """Set up signal handlers for graceful shutdown."""
+    def signal_handler(sig):
+        logging.info(f"Received signal {sig}, shutting down gracefully")
+        callback()
+
+    loop.add_signal_handler(signal.SIGINT, signal_handler, signal.SIGINT)
+    loop.add_signal_handler(signal.SIGTERM, signal_handler, signal.SIGTERM)
+
+
+def listening_ports(pid):
+    """Return the TCP ports a process or any of its descendants is listening on."""
+    ports = set()
+    try:
+        parent = psutil.Process(pid)
+        for p in [parent] + parent.children(recursive=True):
+            try:
+                connections = p.net_connections(kind='inet') if hasattr(p, 'net_connections') else p.connections(kind='inet')
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            ports.update(c.laddr.port for c in connections if c.status == psutil.CONN_LISTEN)
+    except psutil.NoSuchProcess:
+        pass
+    return ports
+
+
+def check_ready(spec, pid, started_at):
+    """Evaluate a readiness check for a freshly started instance.
+
+    `spec` is one of `port:<port>` (the instance listens on the port),
+    `socket:<path>` (a Unix socket accepts connections) or `file:<path>`
+    (the file was touched after the instance started).
+    """
+    kind, _, target = spec.partition(':')
+    if kind == 'port':
+        return int(target) in listening_ports(pid)
+    elif kind == 'socket':
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(0.5)
+            try:
+                sock.connect(target)
+                return True
+            except OSError:
+                return False
+    elif kind == 'file':
+        try:
+            return os.stat(target).st_mtime >= started_at
+        except FileNotFoundError:
+            return False
+    raise ValueError(f"Unknown readiness check '{spec}', use port:<port>, socket:<path> or file:<path>")
+
+
+def parse_probe(spec):
+    """Validate a probe spec such as 'http://127.0.0.1:8000/health' or 'tcp:8000'."""
+    kind = spec.partition(':')[0]
+    if kind not in PROBE_KINDS or not spec.partition(':')[2]:
+        raise ValueError(f"use one of {', '.join(kind + ':...' for kind in PROBE_KINDS)}")
+    return spec
+
+
+async def http_probe(url):
+    """GET the URL; passes on a 2xx or 3xx response."""
+    from urllib.parse import urlsplit
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    try:
+        path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        writer.write(f"GET {path} HTTP/1.0\r\nHost: {parts.netloc}\r\nConnection: close\r\n\r\n".encode())
+        status = (await reader.readline()).split()
+        return len(status) >= 2 and status[1][:1] in (b'2', b'3')
+    finally:
+        writer.close()
+
+
+async def tcp_probe(address):
+    """Passes if a TCP connection to '[HOST:]PORT' can be opened."""
+    host, _, port = address.rpartition(':')
+    _, writer = await asyncio.open_connection(host.strip('[]') or '127.0.0.1', int(port))
+    writer.close()
+    return True
+
+
+def exec_probe(command, directory, timeout):
+    """Run a shell command; passes if it exits 0. Returns (pid, passed)."""
+    process = subprocess.Popen(command, shell=True, cwd=directory, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    try:
+        return process.pid, process.wait(timeout) == 0
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+        return process.pid, False
+
+
+class Inotify:
+    """Minimal inotify(7) binding over ctypes: one non-blocking fd, watches added by path."""
+
+    CLOSE_WRITE = 0x00000008
+    MOVED_FROM = 0x00000040
+    MOVED_TO = 0x00000080
+    CREATE = 0x00000100
+    DELETE = 0x00000200
+    Q_OVERFLOW = 0x00004000
+    IGNORED = 0x00008000
+    ISDIR = 0x40000000
+    # File contents and directory entries; plain IN_MODIFY would fire for every write()
+    MASK = CLOSE_WRITE | MOVED_FROM | MOVED_TO | CREATE | DELETE
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_init1: {os.strerror(ctypes.get_errno())}")
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def remove_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """Return the pending events as (wd, mask, name) tuples."""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + 16 <= len(data):
+            wd, mask, _cookie, length = struct.unpack_from('iIII', data, offset)
+            name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+            events.append((wd, mask, os.fsdecode(name)))
+            offset += 16 + length
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+def watch_ignored(process_config, relative_path):
+    """True if a path inside the process directory, or any directory above it, is ignored."""
+    parts = relative_path.split(os.sep)
+    return any(fnmatch.fnmatch(relative_path, pattern) or any(fnmatch.fnmatch(part, pattern) for part in parts)
+               for pattern in process_config.get('watch_ignore') or DEFAULT_WATCH_IGNORE)
+
+
+def watch_matches(process_config, relative_path):
+    """True if a change to relative_path (inside the process directory) should restart it."""
+    if watch_ignored(process_config, relative_path):
+        return False
+    include = process_config.get('watch_include')
+    if not include:
+        return True
+    filename = os.path.basename(relative_path)
+    return any(fnmatch.fnmatch(relative_path, pattern) or fnmatch.fnmatch(filename, pattern) for pattern in include)
+
+
+def watch_directories(process_config):
+    """The process directory and its subdirectories, minus the ignored ones."""
+    directory = process_config['directory']
+    found = []
+    for root, dirs, _files in os.walk(directory):
+        relative = os.path.relpath(root, directory)
+        dirs[:] = [d for d in dirs if not watch_ignored(process_config, os.path.normpath(os.path.join(relative, d)))]
+        found.append(root)
+    return found
+
+
+def pidfd_supported():
+    """Return True if the kernel supports pidfd_open (Linux 5.3+)."""
+    if not hasattr(os, 'pidfd_open'):
+        return False
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+        return True
+    except OSError:
+        return False
+
+
+class Supervisor:
+    """Resident PyPM daemon that owns all managed processes.
+
+    Child exits are collected by a single reaper on the event loop (pidfds, or
+    SIGCHLD where pidfds are unavailable) that also dispatches restarts.
+
+    The CLI talks to it over SOCKET_FILE using one JSON request per connection.
+    Every handler appends human readable lines to `out`, which the client prints.
+    """
+
+    def __init__(self, lock_fd, handoff=None):
+        self.lock_fd = lock_fd   # holds the daemon lock, passed on across restart-self
+        self.handoff_state = handoff or {}
+        self.reexec = False
+        self.adopted = set()     # PIDs taken over that aren't our children, see adopt_processes()
+        self.timings = {operation: Timing() for operation in SUPERVISOR_TIMINGS}
+        started = time.perf_counter()
+        self.state = StateStore()
+        self.config = self.state.load()
+        self.timings['state_load'].observe(time.perf_counter() - started)
+        self.dirty = set()       # names whose state rows need writing
+        self.samples = {}        # name -> latest resource sample from sample_loop
+        self.metrics = {}        # name -> MetricsRing with the sample history
+        self.last_metrics_time = 0
+        self.started_at = time.time()
+        self.spawns_pending = 0  # launch() calls waiting for or holding a spawn slot
+        self.profiling = False
+        self.log_writers = {}    # name -> LogWriter
+        self.log_streams = {}    # pipe fd -> [name, label, file object, partial line]
+        self.paused_logs = set() # names whose pipes are paused until their log buffer drains
+        self.logs_closed = False
+        self.cgroup_root = None
+        # Names PyPM is restarting while they still run, for exceeding max_memory or on their
+        # cron_restart schedule. Either trigger skips a process the other is already restarting
+        self.forced_restarts = set()
+        self.launch_specs = {}  # (directory, command) -> resolved argv/executable/env, see launch_spec()
+        self.listeners = {}     # listen spec -> bound socket shared by the processes using it
+        self.health = {}             # name -> latest probe results, see check_health()
+        self.probe_queue = []        # heap of (due, name, probe key, generation)
+        self.probe_generations = {}  # name -> generation; bumping it drops queued probes
+        self.probe_tasks = set()
+        self.probe_wakeup = None
+        self.inotify = None          # shared by every process with `watch` set, see update_watches()
+        self.watch_paths = {}        # watched directory -> inotify watch descriptor
+        self.watch_wds = {}          # watch descriptor -> directory
+        self.watch_timers = {}       # name -> debounce timer for a restart after file changes
+        self.watch_tasks = {}        # name -> running restart after file changes
+        self.jobs = self.state.load_jobs()  # name -> job definition and running PIDs, see do_job()
+        self.timer_queue = []        # heap of (due, kind, name, generation) for cron restarts and jobs
+        self.timer_generations = {}  # (kind, name) -> generation; bumping it drops queued timers
+        self.timer_wakeup = None
+        self.job_tasks = set()
+        # Log writes get their own thread so a slow disk can't hold up spawns in the default executor
+        from concurrent.futures import ThreadPoolExecutor
+        self.log_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pypm-log')
+        self.metrics_server = None
+        self.agent_server = None
+        self.agent_token = None
+        self.agent_connections = 0
+        self.events = collections.deque(maxlen=EVENT_BUFFER)
+        self.event_seq = 0
+        self.event_signal = asyncio.Event()   # replaced on every event, see emit()
+        self.event_subscribers = 0
+        self.flush_handle = None
+        self.children = {}       # pid -> subprocess.Popen for children we spawned
+        self.pid_names = {}      # pid -> name for every child the reaper is watching
+        self.pidfds = {}         # pid -> pidfd registered with the event loop
+        self.exit_waiters = {}   # pid -> Future resolved with the exit code
+        self.expected_exits = set()  # PIDs we are stopping on purpose, never restarted
+        self.restart_tasks = {}      # name -> pending delayed restart
+        self.unclaimed_exits = {}    # pid -> exit code reaped before the child was registered
+        self.use_pidfd = pidfd_supported()
+        self.spawn_limit = None
+        self.loop = None
+        self.shutdown_event = None
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.shutdown_event = asyncio.Event()
+        self.spawn_limit = asyncio.Semaphore(DEFAULT_CONCURRENCY)
+        self.probe_wakeup = asyncio.Event()
+        self.timer_wakeup = asyncio.Event()
+        self.cgroup_root = find_cgroup_root()
+        if self.cgroup_root is not None:
+            logging.info(f"Placing managed processes in cgroup v2 subtree {self.cgroup_root}")
+        save_pid()
+        setup_signal_handlers(self.loop, self.shutdown_event.set)
+        # SIGHUP restarts the daemon in place, like `pypm restart-self`
+        self.loop.add_signal_handler(signal.SIGHUP, self.request_reexec)
+        if not self.use_pidfd:
+            # Without pidfds every exit is collected from the SIGCHLD handler instead
+            self.loop.add_signal_handler(signal.SIGCHLD, self.reap_children)
+
+        if SOCKET_FILE.exists():
+            SOCKET_FILE.unlink()
+        server = await asyncio.start_unix_server(self.handle_client, path=str(SOCKET_FILE), limit=REQUEST_LIMIT)
+        os.chmod(SOCKET_FILE, 0o600)
+        logging.info(f"PyPM daemon listening on {SOCKET_FILE} (PID: {os.getpid()}, "
+                     f"exit detection: {'pidfd' if self.use_pidfd else 'SIGCHLD'})")
+
+        self.adopt_processes()
+        self.update_watches()
+        sampler = asyncio.create_task(self.sample_loop())
+        prober = asyncio.create_task(self.health_loop())
+        for name in self.config:
+            if self.config[name].get('pid'):
+                self.schedule_probes(name)
+        self.adopt_jobs()
+        scheduler = asyncio.create_task(self.timer_loop())
+        for name in self.config:
+            self.schedule_timer('restart', name)
+        for name in self.jobs:
+            self.schedule_timer('job', name)
+        self.resurrect_after_boot()
+        metrics_address = self.state.get_setting('metrics_address')
+        if metrics_address:
+            try:
+                await self.start_metrics_server(*metrics_address)
+            except OSError as e:
+                logging.error(f"Could not start metrics endpoint on {metrics_address[0]}:{metrics_address[1]}: {e}")
+        agent_address = self.state.get_setting('agent_address')
+        if agent_address:
+            try:
+                await self.start_agent_server(*agent_address)
+            except OSError as e:
+                logging.error(f"Could not start fleet agent on {agent_address[0]}:{agent_address[1]}: {e}")
+
+        async with server:
+            await self.shutdown_event.wait()
+
+        sampler.cancel()
+        prober.cancel()
+        scheduler.cancel()
+        for task in self.probe_tasks:
+            task.cancel()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        if self.agent_server is not None:
+            self.agent_server.close()
+        if self.reexec:
+            self.handoff()
+        await self.shutdown()
+
+    def request_reexec(self):
+        logging.info("Restarting PyPM daemon in place")
+        self.reexec = True
+        self.shutdown_event.set()
+
+    def handoff(self):
+        """Replace the daemon's code in place, leaving every managed process running.
+
+        os.execv keeps the PID, so the children stay our children. Their output pipes,
+        the listening sockets and the daemon lock are inherited by the new image, which
+        finds them in HANDOFF_FILE. Pending restarts are listed there too.
+        """
+        self.flush_state()
+        self.state.close()
+        streams = self.close_logs(handoff=True)
+        listeners = {spec: sock.fileno() for spec, sock in self.listeners.items()}
+        for fd in [stream['fd'] for stream in streams] + list(listeners.values()) + [self.lock_fd]:
+            os.set_inheritable(fd, True)
+        handoff = {
+            'lock_fd': self.lock_fd,
+            'streams': streams,
+            'listeners': listeners,
+            'children': list(self.pid_names),
+            'pending_restarts': list(self.restart_tasks),
+        }
+        with open(HANDOFF_FILE, 'w') as f:
+            json.dump(handoff, f)
+        if SOCKET_FILE.exists():
+            SOCKET_FILE.unlink()
+        logging.info(f"Re-executing PyPM daemon with {len(self.pid_names)} managed processes left running")
+        os.execv(sys.executable, daemon_command('--handoff'))
+
+    def adopt_processes(self):
+        """Take over processes recorded in the state that are still running.
+
+        A recorded PID is only trusted if the process's boot ID, start time and command
+        line match what was recorded at spawn. After restart-self the processes are still
+        our children and their output pipes are handed over, so they are fully adopted.
+
+        After the daemon died this is only monitoring: the read ends of the processes'
+        stdout/stderr pipes died with it. A process that writes output again gets EPIPE
+        (or SIGPIPE) and usually exits, which is then handled like any other crash and
+        restarts it with fresh pipes. Only processes that stay silent keep running, and
+        their exit codes are unknown.
+
+        Processes recorded during an earlier boot are simply forgotten, not restarted:
+        the boot resurrect (`pypm startup`) starts the saved ones in dependency order.
+        """
+        handoff = self.handoff_state
+        boot_id = read_boot_id()
+        for spec, fd in handoff.get('listeners', {}).items():
+            os.set_inheritable(fd, False)
+            self.listeners[spec] = socket.socket(fileno=fd)
+        for stream in handoff.get('streams', []):
+            os.set_inheritable(stream['fd'], False)
+            if stream['name'] in self.config or stream['name'] in self.jobs:
+                self.attach_stream(stream['name'], stream['label'], open(stream['fd'], 'rb', buffering=0),
+                                   stream['partial'].encode('latin-1'))
+            else:
+                os.close(stream['fd'])
+        children = set(handoff.get('children', []))
+
+        for name, process_config in self.config.items():
+            pid = process_config.get('pid')
+            if name in handoff.get('pending_restarts', []) and not pid:
+                self.restart_tasks[name] = asyncio.create_task(
+                    self.monitor_and_restart(name, None, process_config.get('last_exit_code'), resume=True))
+                continue
+            if not pid:
+                continue
+            recorded = process_config.get('identity')
+            if boot_id and recorded and recorded.get('boot_id') != boot_id:
+                logging.info(f"Process {name} (PID: {pid}) was running before the reboot")
+                process_config['pid'] = None
+                self.save_state(name)
+                continue
+            identity = process_identity(pid)
+            if identity is None or identity != recorded:
+                logging.warning(f"Process {name} (PID: {pid}) stopped while PyPM was not running")
+                process_config['pid'] = None
+                self.save_state(name)
+                self.restart_tasks[name] = asyncio.create_task(self.monitor_and_restart(name, pid, None))
+                continue
+            self.watch_exit(name, pid)
+            if pid in children:
+                logging.info(f"Adopted process {name} (PID: {pid})")
+            else:
+                self.adopted.add(pid)
+                logging.warning(f"Monitoring process {name} (PID: {pid}) left by a previous daemon, "
+                                f"it has lost its output pipes and will exit if it writes output")
+
+    def record_identity(self, name, pid):
+        """Remember what a freshly spawned process looks like, for adopt_processes()."""
+        identity = process_identity(pid)
+        if identity is not None:
+            # /proc may still show the pre-exec command line of a bash wrapper
+            process_config = self.config[name]
+            identity['cmdline'] = self.launch_specs[process_config['directory'], process_config['command']]['argv']
+        self.config[name]['identity'] = identity
+
+    def check_adopted(self):
+        """Without pidfds, notice adopted processes exiting by polling for them."""
+        for pid in list(self.adopted):
+            if not psutil.pid_exists(pid):
+                self.handle_exit(pid, None)
+
+    async def do_reexec(self, request, out):
+        out.append("Restarting PyPM in place, managed processes keep running")
+        self.reexec = True
+        # Give the response time to go out before the server closes
+        self.loop.call_later(0.1, self.shutdown_event.set)
+        return None
+
+    async def shutdown(self):
+        # Stop all managed processes concurrently
+        names = [name for name in self.config if self.is_active(name)]
+        for name in names:
+            logging.info(f"Stopping process {name} (PID: {self.config[name]['pid']})")
+        await asyncio.gather(*(self.stop(name) for name in names))
+        for name in names:
+            self.config[name]['pid'] = None
+        for name, job in self.jobs.items():
+            for pid, run in job['running'].items():
+                logging.info(f"Stopping run of job {name} (PID: {pid})")
+                try:
+                    os.kill(int(pid), signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+                self.state.finish_run(run['run_id'], None, 'stopped')
+            if job['running']:
+                job['running'] = {}
+                self.state.write_job(name, job)
+
+        self.save_state(*names)
+        self.flush_state()
+        self.state.close()
+        self.close_logs()
+        self.close_listeners(unused_only=False)
+        if SOCKET_FILE.exists():
+            SOCKET_FILE.unlink()
+        if PYPM_PID_FILE.exists() and get_saved_pid() == os.getpid():
+            PYPM_PID_FILE.unlink()
+        logging.info("PyPM daemon stopped")
+
+    def save_state(self, *names):
+        """Queue state rows for writing; changes arriving close together share one commit."""
+        self.dirty.update(names)
+        if self.flush_handle is None:
+            self.flush_handle = self.loop.call_later(STATE_FLUSH_DELAY, self.flush_state)
+
+    def flush_state(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.dirty:
+            return
+        names, self.dirty = self.dirty, set()
+        try:
+            started = time.perf_counter()
+            self.state.write(self.config, names)
+            self.timings['state_write'].observe(time.perf_counter() - started)
+        except sqlite3.Error as e:
+            logging.error(f"Failed to write process state: {e}")
+            self.dirty.update(names)
+
+    async def handle_client(self, reader, writer):
+        try:
+            request = json.loads(await reader.readline())
+            if request.get('action') == 'events' and request.get('follow'):
+                await self.stream_events(request, reader, writer)
+                return
+            response = await self.dispatch(request)
+        except Exception as e:
+            logging.error(f"Error handling request: {e}", exc_info=True)
+            response = {'ok': False, 'messages': [f"Error: {e}"], 'data': None}
+        try:
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def dispatch(self, request):
+        action = request.get('action', '')
+        handler = getattr(self, f"do_{action.replace('-', '_')}", None)
+        if handler is None:
+            return {'ok': False, 'messages': [f"Unknown action: {action}"], 'data': None}
+        out = []
+        data = await handler(request, out)
+        return {'ok': True, 'messages': out, 'data': data}
+
+    def is_alive(self, name, pid):
+        """Check a managed PID. Our own children count as alive until the reaper collects them."""
+        if pid in self.pid_names:
+            return True
+        return pid not in self.children and psutil.pid_exists(pid)
+
+    def is_active(self, name):
+        """True if a process is running or waiting for a scheduled restart."""
+        return bool(self.config[name].get('pid')) or name in self.restart_tasks
+
+    async def launch(self, name, limit=None):
+        """Start a new copy of a configured process and register it with the reaper.
+
+        The fork/exec runs in a worker thread so many spawns proceed in parallel,
+        at most `limit` (a semaphore, DEFAULT_CONCURRENCY by default) at a time.
+        The new child does not replace the recorded PID; see spawn() for that.
+        """
+        process_config = self.config[name]
+        try:
+            spec = self.launch_spec(name)
+        except ValueError as e:
+            logging.error(f"Invalid command for {name}: {e}")
+            return None
+        try:
+            apply_limits = build_limits(process_config, self.prepare_cgroup(name))
+        except (OSError, ValueError) as e:
+            logging.error(f"Invalid resource limits for {name}: {e}")
+            return None
+        try:
+            listeners = self.open_listeners(name)
+        except (OSError, ValueError) as e:
+            logging.error(f"Failed to listen for {name}: {e}")
+            return None
+        def timed_start(queued_at):
+            # Popen returns once the exec has succeeded, so this is fork and exec together
+            started = time.perf_counter()
+            process = start_process(name, spec, process_config.get('env'), apply_limits, listeners)
+            return process, started - queued_at, time.perf_counter() - started
+
+        self.spawns_pending += 1
+        try:
+            async with limit or self.spawn_limit:
+                process, waited, took = await self.loop.run_in_executor(None, timed_start, time.perf_counter())
+        finally:
+            self.spawns_pending -= 1
+        self.timings['spawn_wait'].observe(waited)
+        if process is not None:
+            self.timings['spawn'].observe(took)
+            self.children[process.pid] = process
+            self.capture_output(name, process)
+            self.watch_exit(name, process.pid)
+        return process
+
+    def open_listeners(self, name):
+        """Return the process's listening sockets, binding any that aren't open yet.
+
+        Sockets stay open in the daemon across restarts, so connections wait in the
+        backlog instead of being refused, and instances with the same address share it.
+        """
+        listeners = {}
+        for spec in self.config[name].get('listen', []):
+            if spec not in self.listeners:
+                self.listeners[spec] = open_listener(spec)
+                logging.info(f"Listening on {spec} for {name}")
+            listeners[spec] = self.listeners[spec]
+        return listeners
+
+    def close_listeners(self, unused_only=True):
+        """Close listening sockets, by default only those no configured process uses anymore."""
+        in_use = {spec for process in self.config.values() for spec in process.get('listen', [])}
+        for spec in list(self.listeners):
+            if unused_only and spec in in_use:
+                continue
+            self.listeners.pop(spec).close()
+            family, address = parse_listen_spec(spec)
+            if family == socket.AF_UNIX and os.path.exists(address):
+                os.unlink(address)
+            logging.info(f"Closed listening socket {spec}")
+
+    def launch_spec(self, name):
+        """Return the cached launch spec for a process, resolving it again if its script or
+        venv changed since it was cached. Processes with the same command and directory,
+        like the instances of a group, share one spec."""
+        process_config = self.config[name]
+        key = (process_config['directory'], process_config['command'])
+        spec = self.launch_specs.get(key)
+        if spec is None or launch_fingerprint(spec['watched']) != spec['fingerprint']:
+            started = time.perf_counter()
+            spec = resolve_launch_spec(*key)
+            self.timings['launch_spec'].observe(time.perf_counter() - started)
+            self.launch_specs[key] = spec
+        return spec
+
+    def prune_launch_specs(self):
+        """Forget the launch specs no configured process uses anymore."""
+        in_use = {(process['directory'], process['command']) for process in self.config.values()}
+        for key in [key for key in self.launch_specs if key not in in_use]:
+            del self.launch_specs[key]
+
+    async def spawn(self, name, reset_backoff=True, limit=None):
+        """Start a configured process as its current instance. Returns the PID or None."""
+        process_config = self.config[name]
+        process = await self.launch(name, limit)
+        if process is None:
+            return None
+        process_config['pid'] = process.pid
+        process_config['started_at'] = time.time()
+        self.record_identity(name, process.pid)
+        self.emit('spawned', name, pid=process.pid)
+        process_config.pop('status', None)
+        if reset_backoff:
+            # Started by hand, so earlier crashes no longer count
+            process_config['crash_count'] = 0
+        self.schedule_probes(name)
+        return process.pid
+
+    def prepare_cgroup(self, name):
+        """Create or update a process's cgroup and return its cgroup.procs path, or None."""
+        if self.cgroup_root is None:
+            return None
+        process_config = self.config[name]
+        cgroup = self.cgroup_root / f"app-{name}"
+        cgroup.mkdir(exist_ok=True)
+        max_memory = process_config.get('max_memory')
+        if (cgroup / 'memory.max').exists():
+            memory_max = str(int(max_memory * CGROUP_MEMORY_HEADROOM)) if max_memory else 'max'
+            (cgroup / 'memory.max').write_text(memory_max)
+        cpu_quota = process_config.get('cpu_quota')
+        if (cgroup / 'cpu.max').exists():
+            cpu_max = f"{int(cpu_quota / 100 * CPU_PERIOD)} {CPU_PERIOD}" if cpu_quota else f"max {CPU_PERIOD}"
+            (cgroup / 'cpu.max').write_text(cpu_max)
+        return str(cgroup / 'cgroup.procs')
+
+    def remove_cgroup(self, name):
+        if self.cgroup_root is None:
+            return
+        try:
+            (self.cgroup_root / f"app-{name}").rmdir()
+        except OSError:
+            # Missing, or processes are still in it
+            pass
+
+    def check_memory_limits(self):
+        """Restart processes whose sampled memory is above their max_memory."""
+        for name, sample in self.samples.items():
+            process_config = self.config.get(name)
+            if process_config is None or name in self.forced_restarts:
+                continue
+            max_memory = process_config.get('max_memory')
+            if max_memory and sample.pid == process_config.get('pid') and sample.memory * 1024 * 1024 > max_memory:
+                logging.warning(f"Process {name} (PID: {sample.pid}) uses {sample.memory:.1f}MB, "
+                                f"above max_memory of {max_memory / 1024 / 1024:.1f}MB, restarting")
+                self.emit('resource_limit', name, pid=sample.pid, limit='max_memory',
+                          memory_mb=round(sample.memory, 1), max_memory_mb=round(max_memory / 1024 / 1024, 1))
+                self.forced_restarts.add(name)
+                task = asyncio.create_task(self.restart_process(name))
+                task.add_done_callback(lambda done, name=name: self.forced_restarts.discard(name))
+
+    def capture_output(self, name, process):
+        """Drain a child's stdout/stderr pipes from the event loop into its log."""
+        self.attach_stream(name, 'out', process.stdout)
+        self.attach_stream(name, 'err', process.stderr)
+
+    def log_writer(self, name):
+        if name not in self.log_writers:
+            process_config = self.config.get(name) or self.jobs[name]
+            self.log_writers[name] = LogWriter(
+                process_log_path(name),
+                max_size=process_config.get('log_max_size', LOG_MAX_SIZE),
+                max_age=process_config.get('log_max_age', LOG_MAX_AGE),
+                keep=process_config.get('log_keep', LOG_KEEP),
+                compress=process_config.get('log_compress', LOG_COMPRESS),
+            )
+        return self.log_writers[name]
+
+    def attach_stream(self, name, label, pipe, partial=b''):
+        self.log_writer(name)
+        fd = pipe.fileno()
+        os.set_blocking(fd, False)
+        self.log_streams[fd] = [name, label, pipe, partial]
+        if name not in self.paused_logs:
+            self.loop.add_reader(fd, self.read_output, fd)
+
+    def read_output(self, fd):
+        stream = self.log_streams.get(fd)
+        if stream is None:
+            return
+        name, label, pipe, partial = stream
+        try:
+            data = os.read(fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            # EOF: every writer of the pipe has exited
+            self.loop.remove_reader(fd)
+            del self.log_streams[fd]
+            pipe.close()
+            if partial:
+                self.write_log(name, label, [partial])
+            return
+
+        lines = (partial + data).split(b'\n')
+        stream[3] = lines.pop()
+        if len(stream[3]) > LOG_MAX_LINE:
+            lines.append(stream[3])
+            stream[3] = b''
+        if lines:
+            self.write_log(name, label, lines)
+
+    def write_log(self, name, label, lines):
+        writer = self.log_writers.get(name)
+        if writer is None:
+            return
+        writer.append(format_log_lines(label, lines))
+        if writer.pending > LOG_BUFFER_LIMIT and name not in self.paused_logs:
+            # Backpressure: stop reading, so the process blocks on its own full pipe
+            self.paused_logs.add(name)
+            for fd, stream in self.log_streams.items():
+                if stream[0] == name:
+                    self.loop.remove_reader(fd)
+        self.flush_log(name)
+
+    def flush_log(self, name):
+        """Hand buffered output to the log thread; data arriving meanwhile joins the next batch."""
+        writer = self.log_writers.get(name)
+        if writer is None or writer.flushing or not writer.pending or self.logs_closed:
+            return
+        writer.flushing = True
+        future = self.loop.run_in_executor(self.log_executor, writer.write_chunks, writer.take())
+        future.add_done_callback(lambda done: self.log_flushed(name, writer, done))
+
+    def log_flushed(self, name, writer, done):
+        writer.flushing = False
+        if done.exception() is not None:
+            logging.error(f"Failed to write log for {name}: {done.exception()}")
+        if name in self.paused_logs and writer.pending < LOG_BUFFER_LIMIT // 2:
+            self.paused_logs.discard(name)
+            for fd, stream in self.log_streams.items():
+                if stream[0] == name:
+                    self.loop.add_reader(fd, self.read_output, fd)
+        self.flush_log(name)
+
+    def close_logs(self, handoff=False):
+        """Drain what is left in the pipes and write every buffer out before exiting.
+
+        With `handoff` the pipes stay open for the next daemon image instead, and their
+        descriptions (including any partial line) are returned.
+        """
+        self.logs_closed = True
+        streams = []
+        for fd in list(self.log_streams):
+            name, label, pipe, partial = self.log_streams.pop(fd)
+            self.loop.remove_reader(fd)
+            if handoff:
+                streams.append({'fd': fd, 'name': name, 'label': label, 'partial': partial.decode('latin-1')})
+                continue
+            chunks = [partial]
+            try:
+                while True:
+                    data = os.read(fd, 65536)
+                    if not data:
+                        break
+                    chunks.append(data)
+            except OSError:
+                pass
+            pipe.close()
+            remaining = b''.join(chunks)
+            if remaining and name in self.log_writers:
+                self.log_writers[name].append(format_log_lines(label, remaining.rstrip(b'\n').split(b'\n')))
+        self.log_executor.shutdown(wait=True)
+        for writer in self.log_writers.values():
+            if writer.pending:
+                writer.write_chunks(writer.take())
+            writer.close()
+        return streams
+
+    def watch_exit(self, name, pid):
+        """Register a child with the reaper so its exit is seen as soon as it happens."""
+        self.pid_names[pid] = name
+        if pid in self.unclaimed_exits:
+            # SIGCHLD fallback reaped it while the spawn was still returning
+            self.loop.call_soon(self.handle_exit, pid, self.unclaimed_exits.pop(pid))
+        elif self.use_pidfd:
+            try:
+                fd = os.pidfd_open(pid)
+            except ProcessLookupError:
+                # Already exited and reaped by nobody yet; collect it right away
+                self.loop.call_soon(self.reap_pid, pid)
+                return
+            self.pidfds[pid] = fd
+            self.loop.add_reader(fd, self.reap_pid, pid)
+
+    def reap_pid(self, pid):
+        """pidfd readiness callback: the child has exited, collect its status."""
+        try:
+            wpid, status = os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            # An adopted process that isn't our child: it exited, but its exit code is unknown
+            wpid, status = pid, None
+        if wpid == 0:
+            return
+        fd = self.pidfds.pop(pid, None)
+        if fd is not None:
+            self.loop.remove_reader(fd)
+            os.close(fd)
+        self.handle_exit(pid, None if status is None else os.waitstatus_to_exitcode(status))
+
+    def reap_children(self):
+        """SIGCHLD fallback: collect every child that has exited since the last signal."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.handle_exit(pid, os.waitstatus_to_exitcode(status))
+
+    def handle_exit(self, pid, exit_code):
+        self.adopted.discard(pid)
+        name = self.pid_names.pop(pid, None)
+        if name is None:
+            if not self.use_pidfd:
+                self.unclaimed_exits[pid] = exit_code
+            return
+        process = self.children.pop(pid, None)
+        if process is not None:
+            # Tell subprocess the child is gone so it never tries to reap the PID itself
+            process.returncode = exit_code
+
+        waiter = self.exit_waiters.pop(pid, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(exit_code)
+
+        process_config = self.config.get(name)
+        if process_config is None:
+            return
+        process_config['last_exit_code'] = exit_code
+        self.save_state(name)
+        self.emit('exited', name, pid=pid, exit_code=exit_code, expected=pid in self.expected_exits)
+        if pid in self.expected_exits:
+            self.expected_exits.discard(pid)
+            return
+        if process_config.get('pid') != pid:
+            # A replacement that never became current, e.g. one that failed its readiness check
+            return
+
+        process_config['pid'] = None
+        self.restart_tasks[name] = asyncio.create_task(self.monitor_and_restart(name, pid, exit_code))
+
+    async def monitor_and_restart(self, name, pid, exit_code, resume=False):
+        """Apply the restart policy to a process the reaper saw exit.
+
+        Crashes in a row (exits before `stable_after` seconds of uptime) count toward
+        `max_restarts` and back off exponentially with jitter. Past `max_restarts` the
+        circuit opens: the process is marked failed and, after `circuit_cooldown`
+        seconds, gets a single probe start. If the probe stays up for `stable_after`
+        seconds the count resets, if it crashes the circuit opens again.
+
+        `resume` continues a restart that was pending when the daemon restarted itself,
+        so the exit isn't counted a second time.
+        """
+        process_config = self.config[name]
+        exited_at = time.perf_counter()
+
+        try:
+            if resume:
+                crash_count = process_config.get('crash_count', 0)
+            else:
+                policy = restart_policy(process_config, exit_code)
+                if not RESTART_POLICIES[policy](exit_code):
+                    logging.info(f"Process {name} (PID: {pid}) exited with code {exit_code}, "
+                                 f"not restarting (restart policy {policy})")
+                    self.emit('not_restarting', name, exit_code=exit_code, restart_policy=policy)
+                    return
+
+                uptime = time.time() - process_config.get('started_at', 0)
+                if uptime >= process_config.get('stable_after', DEFAULT_STABLE_AFTER):
+                    process_config['crash_count'] = 0
+                crash_count = process_config.get('crash_count', 0) + 1
+                process_config['crash_count'] = crash_count
+                self.save_state(name)
+
+            max_restarts = process_config.get('max_restarts', 5)
+            if crash_count > max_restarts:
+                process_config['status'] = 'failed'
+                self.save_state(name)
+                cooldown = process_config.get('circuit_cooldown', DEFAULT_CIRCUIT_COOLDOWN)
+                self.emit('gave_up', name, restarts=max_restarts, retry_in=cooldown or None)
+                if not cooldown:
+                    logging.warning(f"Process {name} failed to stay running after {max_restarts} restarts. Giving up.")
+                    return
+                logging.warning(f"Process {name} failed to stay running after {max_restarts} restarts, "
+                                f"trying again in {cooldown}s")
+                await asyncio.sleep(cooldown)
+                # Half-open: one more crash opens the circuit again
+                process_config['crash_count'] = max_restarts
+                delay = cooldown
+            else:
+                delay = backoff_delay(process_config.get('restart_delay', 3), crash_count - 1,
+                                      process_config.get('max_restart_delay', DEFAULT_MAX_RESTART_DELAY))
+                logging.info(f"Process {name} (PID: {pid}) exited with code {exit_code}, restarting in {delay:.1f}s...")
+                self.emit('backoff', name, delay=round(delay, 3), crash_count=crash_count)
+                await asyncio.sleep(delay)
+
+            # Start the process again
+            self.emit('restarting', name, reason='crash')
+            new_pid = await self.spawn(name, reset_backoff=False)
+            if new_pid is None:
+                logging.error(f"Failed to restart process {name}")
+                self.emit('spawn_failed', name)
+                process_config['status'] = 'failed'
+                self.save_state(name)
+                return
+
+            # Update the config with the new restart count
+            process_config['restart_count'] = process_config.get('restart_count', 0) + 1
+            self.save_state(name)
+            self.timings['restart'].observe(time.perf_counter() - exited_at - delay)
+        finally:
+            if self.restart_tasks.get(name) is asyncio.current_task():
+                del self.restart_tasks[name]
+
+    async def stop(self, name):
+        """Stop a managed process and cancel any pending restart. Returns True once it is gone."""
+        restart_task = self.restart_tasks.pop(name, None)
+        if restart_task is not None:
+            restart_task.cancel()
+
+        return await self.stop_process(name, self.config[name].get('pid'))
+
+    async def wait_for_exit(self, pid, timeout):
+        """Wait for the reaper to collect a child. Returns False on timeout."""
+        if pid not in self.pid_names:
+            return True
+        waiter = self.exit_waiters.get(pid)
+        if waiter is None:
+            waiter = self.exit_waiters[pid] = self.loop.create_future()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def stop_process(self, name, pid, expected=True):
+        """SIGTERM a process group, then SIGKILL it after stop_timeout.
+
+        An unexpected stop (a failed liveness probe) is handled like a crash, so the
+        restart policy decides what happens next.
+        """
+        if pid and self.is_alive(name, pid):
+            if expected:
+                self.expected_exits.add(pid)
+            try:
+                # Send SIGTERM to process group; children are session leaders so pgid == pid
+                os.killpg(pid, signal.SIGTERM)
+
+                # Wait up to stop_timeout seconds for process to terminate
+                timeout = self.config[name].get('stop_timeout', 5)
+                if pid not in self.pid_names:
+                    deadline = time.monotonic() + timeout
+                    while time.monotonic() < deadline:
+                        if not psutil.pid_exists(pid):
+                            return True
+                        await asyncio.sleep(0.1)
+                elif await self.wait_for_exit(pid, timeout):
+                    return True
+
+                # If process still exists, send SIGKILL
+                if self.is_alive(name, pid):
+                    logging.warning(f"Process {pid} did not terminate with SIGTERM, sending SIGKILL")
+                    os.killpg(pid, signal.SIGKILL)
+                    await self.wait_for_exit(pid, 5)
+                    return True
+            except (ProcessLookupError, psutil.NoSuchProcess):
+                # Process already gone
+                return True
+            except Exception as e:
+                logging.error(f"Error stopping process {pid}: {e}")
+                self.expected_exits.discard(pid)
+                return False
+        return True
+
+    def probe_spec(self, name, key):
+        """Return a process's probe spec with {instance} and {name} filled in, or None."""
+        process_config = self.config[name]
+        spec = process_config.get(key)
+        if spec:
+            spec = spec.format(instance=process_config.get('instance', 0), name=name)
+        return spec
+
+    async def run_probe(self, name, spec, pid, started_at, timeout):
+        """Run one probe against a process. Returns True if it passed."""
+        process_config = self.config[name]
+        kind, _, target = spec.partition(':')
+        try:
+            if kind == 'http':
+                return await asyncio.wait_for(http_probe(spec), timeout)
+            elif kind == 'tcp':
+                return await asyncio.wait_for(tcp_probe(target), timeout)
+            elif kind == 'exec':
+                probe_pid, passed = await self.loop.run_in_executor(
+                    None, exec_probe, target, process_config['directory'], timeout)
+                # Without pidfds the SIGCHLD handler may have reaped the probe first
+                exit_code = self.unclaimed_exits.pop(probe_pid, None)
+                return passed if exit_code is None else exit_code == 0
+            elif kind == 'heartbeat':
+                # The process has to touch the file at least once per interval
+                interval = process_config.get('health_interval', DEFAULT_HEALTH_INTERVAL)
+                return time.time() - os.stat(target).st_mtime <= interval
+            return check_ready(spec, pid, started_at)
+        except (OSError, ValueError, asyncio.TimeoutError):
+            return False
+
+    def schedule_probes(self, name):
+        """Queue the first round of a process's probes, replacing any already queued."""
+        process_config = self.config[name]
+        generation = self.probe_generations[name] = self.probe_generations.get(name, 0) + 1
+        self.health.pop(name, None)
+        interval = process_config.get('health_interval', DEFAULT_HEALTH_INTERVAL)
+        now = time.monotonic()
+        if process_config.get('health_check'):
+            heapq.heappush(self.probe_queue, (now + interval, name, 'health_check', generation))
+        if process_config.get('ready_check'):
+            heapq.heappush(self.probe_queue, (now + READY_GRACE_PERIOD, name, 'ready_check', generation))
+        if self.probe_wakeup is not None:
+            self.probe_wakeup.set()
+
+    async def health_loop(self):
+        """A single scheduler for all probes: sleep until the earliest one is due, then run it."""
+        while True:
+            if not self.probe_queue or self.probe_queue[0][0] > time.monotonic():
+                timeout = self.probe_queue[0][0] - time.monotonic() if self.probe_queue else None
+                self.probe_wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.probe_wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, name, key, generation = heapq.heappop(self.probe_queue)
+            if self.probe_generations.get(name) != generation:
+                continue
+            task = asyncio.create_task(self.check_health(name, key, generation))
+            self.probe_tasks.add(task)
+            task.add_done_callback(self.probe_tasks.discard)
+
+    async def check_health(self, name, key, generation):
+        """Run a due probe, record the result and queue the next one.
+
+        health_threshold failed liveness probes in a row stop the process as if it had
+        crashed, so the restart policy and backoff apply to hung processes too.
+        """
+        process_config = self.config.get(name)
+        pid = process_config and process_config.get('pid')
+        spec = process_config and self.probe_spec(name, key)
+        if not pid or not spec or not self.is_alive(name, pid):
+            return
+        timeout = process_config.get('health_timeout', DEFAULT_HEALTH_TIMEOUT)
+        started = time.perf_counter()
+        passed = await self.run_probe(name, spec, pid, process_config.get('started_at', 0), timeout)
+        latency = time.perf_counter() - started
+        self.timings['health_check'].observe(latency)
+        if self.probe_generations.get(name) != generation:
+            return
+
+        health = self.health.setdefault(name, {'live': None, 'ready': None, 'failures': 0, 'latency': None})
+        if key == 'ready_check':
+            health['ready'] = passed
+        else:
+            health['live'] = passed
+            health['latency'] = latency
+            health['failures'] = 0 if passed else health['failures'] + 1
+            threshold = process_config.get('health_threshold', DEFAULT_HEALTH_THRESHOLD)
+            if not passed:
+                self.emit('health_failed', name, pid=pid, check=spec, failures=health['failures'], threshold=threshold)
+            if health['failures'] >= threshold:
+                logging.warning(f"Process {name} (PID: {pid}) failed {health['failures']} health checks "
+                                f"in a row ({spec}), restarting")
+                self.probe_generations[name] += 1
+                await self.stop_process(name, pid, expected=False)
+                return
+            if not passed:
+                logging.info(f"Health check {spec} failed for {name} (PID: {pid}), "
+                             f"{health['failures']}/{threshold}")
+
+        interval = process_config.get('health_interval', DEFAULT_HEALTH_INTERVAL)
+        heapq.heappush(self.probe_queue, (time.monotonic() + interval, name, key, generation))
+        self.probe_wakeup.set()
+
+    def health_status(self, name):
+        """Summarize a running process's probes for pypm list, or None if it has none."""
+        process_config = self.config[name]
+        if not process_config.get('health_check') and not process_config.get('ready_check'):
+            return None
+        health = self.health.get(name)
+        if health is None:
+            return 'pending'
+        if health['live'] is False:
+            status = 'failing'
+        elif health['ready'] is False:
+            status = 'unready'
+        elif health['live'] is None and health['ready'] is None:
+            status = 'pending'
+        else:
+            status = 'healthy'
+        if health['latency'] is not None:
+            status += f" {health['latency'] * 1000:.0f}ms"
+        return status
+
+    async def do_ping(self, request, out):
+        return {'pid': os.getpid()}
+
+    async def sample_loop(self):
+        """Refresh resource samples for every managed process at SAMPLE_INTERVAL."""
+        while True:
+            started = time.perf_counter()
+            try:
+                await self.sample_now()
+                self.check_memory_limits()
+                if not self.use_pidfd:
+                    self.check_adopted()
+                if time.time() - self.last_metrics_time >= METRICS_INTERVAL:
+                    self.record_metrics()
+                    release_free_memory()
+            except Exception as e:
+                logging.error(f"Resource sampling failed: {e}")
+            self.timings['sample'].observe(time.perf_counter() - started)
+            sleep_started = time.perf_counter()
+            await asyncio.sleep(SAMPLE_INTERVAL)
+            self.timings['loop_lag'].observe(max(0.0, time.perf_counter() - sleep_started - SAMPLE_INTERVAL))
+
+    def record_metrics(self):
+        """Append the latest samples to each process's history ring."""
+        self.last_metrics_time = now = time.time()
+        for name, sample in self.samples.items():
+            if name not in self.config:
+                continue
+            ring = self.metrics.get(name)
+            if ring is None:
+                ring = self.metrics[name] = MetricsRing()
+            ring.append(sample, now)
+        # Forget the history of deleted processes
+        for name in [name for name in self.metrics if name not in self.config]:
+            del self.metrics[name]
+
+    async def sample_now(self):
+        roots = {name: process['pid'] for name, process in self.config.items() if process.get('pid')}
+        if not roots:
+            self.samples = {}
+            return
+        self.samples = await self.loop.run_in_executor(None, sample_process_trees, roots, self.samples)
+
+    async def do_list(self, request, out):
+        # Processes started since the last pass have no sample yet, take one now
+        if any(process.get('pid') and getattr(self.samples.get(name), 'pid', None) != process['pid']
+               for name, process in self.config.items()):
+            await self.sample_now()
+
+        rows = []
+        for name, process in self.config.items():
+            status = 'FAILED' if process.get('status') == 'failed' else 'STOPPED'
+            row = {'name': name, 'status': status, 'pid': None, 'cpu': None, 'memory': None,
+                   'threads': None, 'processes': None, 'health': None,
+                   'restarts': process.get('restart_count', 0)}
+            pid = process.get('pid')
+            if pid and self.is_alive(name, pid):
+                row['pid'] = pid
+                sample = self.samples.get(name)
+                if sample is not None and sample.pid == pid:
+                    row.update(status='RUNNING', cpu=sample.cpu, memory=sample.memory,
+                               threads=sample.threads, processes=sample.processes,
+                               health=self.health_status(name))
+                else:
+                    row['status'] = 'ERROR'
+            rows.append(row)
+        return rows
+
+    def update_watches(self):
+        """Watch the directory trees of the processes with `watch` set, and nothing else.
+
+        All of them share one inotify fd read on the event loop; a directory that
+        several processes watch is watched once.
+        """
+        wanted = set()
+        for process in self.config.values():
+            if process.get('watch'):
+                wanted.update(watch_directories(process))
+        if not wanted:
+            if self.inotify is not None:
+                self.loop.remove_reader(self.inotify.fd)
+                self.inotify.close()
+                self.inotify = None
+                self.watch_paths.clear()
+                self.watch_wds.clear()
+            return
+        if self.inotify is None:
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                logging.error(f"File watching is unavailable: {e}")
+                return
+            self.loop.add_reader(self.inotify.fd, self.read_watch_events)
+
+        for path in set(self.watch_paths) - wanted:
+            wd = self.watch_paths.pop(path)
+            self.watch_wds.pop(wd, None)
+            self.inotify.remove_watch(wd)
+        for path in wanted - set(self.watch_paths):
+            try:
+                wd = self.inotify.add_watch(path)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    logging.error(f"Cannot watch {path}: raise fs.inotify.max_user_watches or add watch_ignore patterns")
+                    break
+                continue  # removed while we were walking
+            self.watch_paths[path] = wd
+            self.watch_wds[wd] = path
+
+    def read_watch_events(self):
+        watched = {name: process for name, process in self.config.items() if process.get('watch')}
+        changed = set()
+        new_directories = False
+        for wd, mask, filename in self.inotify.read_events():
+            if mask & Inotify.Q_OVERFLOW:
+                # Events were dropped, so any watched process may have changed
+                changed.update(watched)
+                continue
+            if mask & Inotify.IGNORED:
+                path = self.watch_wds.pop(wd, None)
+                if path is not None:
+                    self.watch_paths.pop(path, None)
+                continue
+            directory = self.watch_wds.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, filename)
+            if mask & Inotify.ISDIR and mask & (Inotify.CREATE | Inotify.MOVED_TO):
+                new_directories = True
+            for name, process in watched.items():
+                root = process['directory'].rstrip(os.sep)
+                if path.startswith(root + os.sep) and watch_matches(process, os.path.relpath(path, root)):
+                    changed.add(name)
+        if new_directories:
+            self.update_watches()
+        for name in changed:
+            self.schedule_watch_restart(name)
+
+    def schedule_watch_restart(self, name):
+        """Restart once no more changes arrive for watch_delay seconds, so a burst of
+        events (a `git pull`, an editor saving several files) leads to one restart."""
+        timer = self.watch_timers.pop(name, None)
+        if timer is not None:
+            timer.cancel()
+        delay = self.config[name].get('watch_delay', DEFAULT_WATCH_DELAY)
+        self.watch_timers[name] = self.loop.call_later(delay, self.restart_for_changes, name)
+
+    def restart_for_changes(self, name):
+        self.watch_timers.pop(name, None)
+        process_config = self.config.get(name)
+        if process_config is None or not process_config.get('watch') or not self.is_active(name):
+            return
+        if name in self.watch_tasks:
+            # Changed again while restarting, go once more when the restart is done
+            self.schedule_watch_restart(name)
+            return
+        logging.info(f"Files changed in {process_config['directory']}, restarting {name}")
+        self.emit('restarting', name, reason='watch')
+        task = asyncio.create_task(self.restart_process(name))
+        self.watch_tasks[name] = task
+        task.add_done_callback(lambda _: self.watch_tasks.pop(name, None))
+
+    def emit(self, event, name, **fields):
+        """Record a lifecycle event for `pypm events`.
+
+        This only appends to the ring buffer and wakes the subscribers; each one sends
+        from the buffer at its own pace, so a slow reader never holds up supervision.
+        """
+        self.event_seq += 1
+        self.events.append({'seq': self.event_seq, 'time': time.time(), 'event': event, 'name': name, **fields})
+        self.event_signal.set()
+        self.event_signal = asyncio.Event()
+
+    def recent_events(self, after, target=None):
+        """Buffered events with a sequence number above `after`, for one process or group if given."""
+        oldest = self.events[0]['seq'] if self.events else self.event_seq + 1
+        events = itertools.islice(self.events, max(0, after + 1 - oldest), None)
+        if target:
+            events = (event for event in events if event['name'] == target or
+                      (event['name'] or '').rpartition(':')[0] == target)
+        return list(events)
+
+    def last_events(self, request):
+        lines = request.get('lines', 20)
+        return self.recent_events(0, request.get('target'))[-lines:] if lines > 0 else []
+
+    async def do_events(self, request, out):
+        return self.last_events(request)
+
+    async def stream_events(self, request, reader, writer):
+        """Send events to a `pypm events -f` client as they happen, one JSON object per line.
+
+        A client more than EVENT_BUFFER events behind gets a 'dropped' event with the
+        number it missed, then carries on from the oldest event still buffered.
+        """
+        target = request.get('target')
+        closed = asyncio.ensure_future(reader.read())
+        self.event_subscribers += 1
+        try:
+            for event in self.last_events(request):
+                writer.write(json.dumps(event).encode() + b'\n')
+            cursor = self.event_seq
+            while True:
+                signal_event = self.event_signal
+                oldest = self.events[0]['seq'] if self.events else self.event_seq + 1
+                if cursor + 1 < oldest:
+                    dropped = {'seq': oldest - 1, 'time': time.time(), 'event': 'dropped', 'name': None,
+                               'count': oldest - 1 - cursor}
+                    writer.write(json.dumps(dropped).encode() + b'\n')
+                    cursor = oldest - 1
+                for event in self.recent_events(cursor, target):
+                    writer.write(json.dumps(event).encode() + b'\n')
+                cursor = self.event_seq
+                await writer.drain()
+                waiter = asyncio.ensure_future(signal_event.wait())
+                await asyncio.wait([waiter, closed], return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                if closed.done():
+                    return
+        except ConnectionError:
+            pass
+        finally:
+            self.event_subscribers -= 1
+            closed.cancel()
+            writer.close()
+
+    async def do_debug(self, request, out):
+        if request['command'] == 'stats':
+            return self.debug_stats()
+        if self.profiling:
+            out.append("A profile is already being taken")
+            return None
+        self.profiling = True
+        try:
+            return await self.loop.run_in_executor(None, profile_stacks, request['seconds'], PROFILE_INTERVAL)
+        finally:
+            self.profiling = False
+
+    def debug_stats(self):
+        """The daemon's own resource use, queue depths and operation timings."""
+        status = {}
+        with open('/proc/self/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                status[key] = value.split()
+        return {
+            'pid': os.getpid(),
+            'uptime': time.time() - self.started_at,
+            'rss_mb': int(status['VmRSS'][0]) / 1024,
+            'fds': len(os.listdir('/proc/self/fd')),
+            'threads': int(status['Threads'][0]),
+            'thread_names': sorted(thread.name for thread in threading.enumerate()),
+            'exit_detection': 'pidfd' if self.use_pidfd else 'SIGCHLD',
+            'processes': len(self.config),
+            'children': len(self.children),
+            'adopted': len(self.adopted),
+            'queues': {
+                'asyncio tasks': len(asyncio.all_tasks(self.loop)),
+                'spawns pending': self.spawns_pending,
+                'restarts pending': len(self.restart_tasks),
+                'exits awaited': len(self.exit_waiters),
+                'state rows dirty': len(self.dirty),
+                'probes queued': len(self.probe_queue),
+                'probes running': len(self.probe_tasks),
+                'log streams': len(self.log_streams),
+                'log streams paused': len(self.paused_logs),
+                'fleet connections': self.agent_connections,
+                'events buffered': len(self.events),
+                'event subscribers': self.event_subscribers,
+                'watch restarts queued': len(self.watch_timers),
+                'watched directories': len(self.watch_paths),
+                'timers queued': len(self.timer_queue),
+                'jobs running': sum(len(job['running']) for job in self.jobs.values()),
+            },
+            'timings': {operation: {'count': timing.count, 'total': timing.total, 'max': timing.max}
+                        for operation, timing in self.timings.items()},
+        }
+
+    async def do_metrics(self, request, out):
+        name = request['name']
+        if name not in self.config:
+            out.append(f"Process {name} not found")
+            return None
+        ring = self.metrics.get(name)
+        history = ring.since(time.time() - request['since']) if ring else {'time': []}
+        if not history['time']:
+            out.append(f"No metrics recorded for {name} in that window yet")
+            return None
+
+        times = history['time']
+        return {
+            'name': name,
+            'since': request['since'],
+            'samples': len(times),
+            'first': times[0],
+            'last': times[-1],
+            'metrics': {
+                'cpu': summarize(history['cpu']),
+                'memory': summarize(history['memory']),
+                'fds': summarize(history['fds']),
+                'threads': summarize(history['threads']),
+                'read_rate': summarize(counter_rates(times, history['read_bytes'])),
+                'write_rate': summarize(counter_rates(times, history['write_bytes'])),
+            },
+        }
+
+    async def start_metrics_server(self, host, port):
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            self.metrics_server = None
+        self.metrics_server = await asyncio.start_server(self.handle_metrics_request, host, port)
+        logging.info(f"Serving Prometheus metrics on http://{host}:{port}/metrics")
+
+    async def handle_metrics_request(self, reader, writer):
+        """Minimal HTTP/1.1 handler: GET /metrics returns the exposition text."""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            # Skip the headers, nothing in them matters here
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.split()
+            if len(parts) >= 2 and parts[0] == b'GET' and parts[1].split(b'?')[0] == b'/metrics':
+                status, body = '200 OK', self.render_metrics().encode()
+            else:
+                status, body = '404 Not Found', b'Not Found\n'
+            writer.write(f"HTTP/1.1 {status}\r\n"
+                         f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start_agent_server(self, host, port):
+        if self.agent_server is not None:
+            self.agent_server.close()
+            self.agent_server = None
+        self.agent_token = fleet_token(create=True)
+        self.agent_server = await asyncio.start_server(self.handle_agent, host, port, limit=REQUEST_LIMIT)
+        logging.info(f"Serving the fleet agent on {host}:{port}")
+
+    async def handle_agent(self, reader, writer):
+        """Serve `pypm fleet` over TCP: a challenge-response login, then requests one per line.
+
+        Both sides sign the other's random challenge with the shared token, so it never
+        goes over the wire. Every request and response after that is signed with a key
+        derived from the token and both challenges (see fleet_seal); the first message
+        that fails the check closes the connection. Messages are not encrypted. The
+        connection stays open for further requests until it has been idle for
+        AGENT_IDLE_TIMEOUT seconds.
+        """
+        peer = (writer.get_extra_info('peername') or ['?'])[0]
+        self.agent_connections += 1
+        try:
+            challenge = secrets.token_hex(16)
+            writer.write(json.dumps({'challenge': challenge}).encode() + b'\n')
+            await writer.drain()
+            login = json.loads(await asyncio.wait_for(reader.readline(), AGENT_AUTH_TIMEOUT) or b'{}')
+            if not isinstance(login, dict) or not hmac.compare_digest(
+                    str(login.get('auth', '')), fleet_signature(self.agent_token, 'fleet', challenge)):
+                logging.warning(f"Rejected fleet connection from {peer}: authentication failed")
+                writer.write(json.dumps({'ok': False, 'messages': ["Error: authentication failed"]}).encode() + b'\n')
+                await writer.drain()
+                return
+            client_challenge = str(login.get('challenge', ''))
+            proof = fleet_signature(self.agent_token, 'agent', client_challenge)
+            writer.write(json.dumps({'ok': True, 'auth': proof}).encode() + b'\n')
+            await writer.drain()
+            key = fleet_session_key(self.agent_token, challenge, client_challenge)
+
+            for sequence in itertools.count():
+                line = await asyncio.wait_for(reader.readline(), AGENT_IDLE_TIMEOUT)
+                if not line:
+                    return
+                try:
+                    request = fleet_unseal(key, 'fleet', sequence, line)
+                except ValueError:
+                    logging.warning(f"Closed fleet connection from {peer}: a request failed the integrity check")
+                    return
+                action = request.get('action', '')
+                if action not in FLEET_ACTIONS:
+                    response = {'ok': False, 'messages': [f"Error: {action} is not allowed over the fleet agent"],
+                                'data': None}
+                else:
+                    if action not in ['list', 'status', 'metrics']:
+                        logging.info(f"Fleet request from {peer}: {action}")
+                    try:
+                        response = await self.dispatch(request)
+                    except Exception as e:
+                        logging.error(f"Error handling fleet request: {e}", exc_info=True)
+                        response = {'ok': False, 'messages': [f"Error: {e}"], 'data': None}
+                writer.write(fleet_seal(key, 'agent', sequence, response))
+                await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, ValueError):
+            # ValueError covers malformed JSON and lines over REQUEST_LIMIT
+            pass
+        finally:
+            self.agent_connections -= 1
+            writer.close()
+
+    def render_metrics(self):
+        """Render process and supervisor metrics in the Prometheus text format from cached samples."""
+        families = {
+            'pypm_process_up': ('gauge', 'Whether the process is running (1) or not (0).'),
+            'pypm_process_pid': ('gauge', 'PID of the running process.'),
+            'pypm_process_cpu_seconds_total': ('counter', 'CPU time used by the process and its descendants.'),
+            'pypm_process_resident_memory_bytes': ('gauge', 'Resident memory of the process and its descendants.'),
+            'pypm_process_open_fds': ('gauge', 'Open file descriptors of the process and its descendants.'),
+            'pypm_process_threads': ('gauge', 'Threads of the process and its descendants.'),
+            'pypm_process_restarts_total': ('counter', 'Number of times PyPM restarted the process.'),
+            'pypm_process_last_exit_code': ('gauge', 'Exit code of the last exit, negative for signals.'),
+            'pypm_process_uptime_seconds': ('gauge', 'Seconds since the running process was started.'),
+        }
+        values = {family: [] for family in families}
+        now = time.time()
+        for name, process in self.config.items():
+            labels = prometheus_labels(name=name, group=process.get('group', name))
+            pid = process.get('pid')
+            running = bool(pid) and self.is_alive(name, pid)
+            values['pypm_process_up'].append((labels, 1 if running else 0))
+            values['pypm_process_restarts_total'].append((labels, process.get('restart_count', 0)))
+            if process.get('last_exit_code') is not None:
+                values['pypm_process_last_exit_code'].append((labels, process['last_exit_code']))
+            if not running:
+                continue
+            values['pypm_process_pid'].append((labels, pid))
+            if process.get('started_at'):
+                values['pypm_process_uptime_seconds'].append((labels, round(now - process['started_at'], 3)))
+            sample = self.samples.get(name)
+            if sample is not None and sample.pid == pid:
+                values['pypm_process_cpu_seconds_total'].append((labels, sample.cpu_ticks / CLOCK_TICKS))
+                values['pypm_process_resident_memory_bytes'].append((labels, int(sample.memory * 1024 * 1024)))
+                values['pypm_process_open_fds'].append((labels, sample.fds))
+                values['pypm_process_threads'].append((labels, sample.threads))
+
+        lines = []
+        for family, (kind, help_text) in families.items():
+            lines.append(f"# HELP {family} {help_text}")
+            lines.append(f"# TYPE {family} {kind}")
+            lines.extend(f"{family}{labels} {value}" for labels, value in values[family])
+
+        lines.append("# HELP pypm_managed_processes Number of processes managed by PyPM.")
+        lines.append("# TYPE pypm_managed_processes gauge")
+        lines.append(f"pypm_managed_processes {len(self.config)}")
+        for operation, help_text in SUPERVISOR_TIMINGS.items():
+            timing = self.timings[operation]
+            family = f"pypm_supervisor_{operation}_duration_seconds"
+            lines.append(f"# HELP {family} {help_text}")
+            lines.append(f"# TYPE {family} summary")
+            lines.append(f"{family}_sum {timing.total}")
+            lines.append(f"{family}_count {timing.count}")
+        return "\n".join(lines) + "\n"
+
+    async def do_serve_metrics(self, request, out):
+        if request.get('stop'):
+            if self.metrics_server is not None:
+                self.metrics_server.close()
+                self.metrics_server = None
+            self.state.set_setting('metrics_address', None)
+            out.append("Stopped the metrics endpoint")
+            return None
+
+        host, port = request['host'], request['port']
+        try:
+            await self.start_metrics_server(host, port)
+        except OSError as e:
+            out.append(f"Error: could not listen on {host}:{port}: {e}")
+            return None
+        self.state.set_setting('metrics_address', [host, port])
+        out.append(f"Serving Prometheus metrics on http://{host}:{port}/metrics")
+        return None
+
+    async def do_serve_agent(self, request, out):
+        if request.get('stop'):
+            if self.agent_server is not None:
+                self.agent_server.close()
+                self.agent_server = None
+            self.state.set_setting('agent_address', None)
+            out.append("Stopped the fleet agent")
+            return None
+
+        host, port = request['host'], request['port']
+        try:
+            await self.start_agent_server(host, port)
+        except OSError as e:
+            out.append(f"Error: could not listen on {host}:{port}: {e}")
+            return None
+        self.state.set_setting('agent_address', [host, port])
+        out.append(f"Serving the fleet agent on {host}:{port}")
+        if not is_loopback(host):
+            out.append("Requests are signed but not encrypted, only expose the agent on a trusted network "
+                       "or reach it through a VPN or SSH tunnel")
+        if not os.environ.get('PYPM_FLEET_TOKEN'):
+            out.append(f"Clients need the token in {FLEET_TOKEN_FILE}")
+        return None
+
+    async def do_start(self, request, out):
+        name = request['name']
+        directory = request['directory']
+        command = request['command']
+        instances = request.get('instances') or 1
+
+        # Validate process name
+        valid_name, name_msg = validate_process_name(name, self.config)
+        if valid_name and name in self.jobs:
+            valid_name, name_msg = False, f"A job named '{name}' already exists. Use a different name."
+        if valid_name and self.group_members(name):
+            valid_name, name_msg = False, f"Process group '{name}' already exists. Use a different name or delete the existing group first."
+        if not valid_name:
+            out.append(f"Error: {name_msg}")
+            return None
+
+        valid, msg = validate_command(directory, command)
+        if not valid:
+            out.append(f"Error: {msg}")
+            return None
+
+        if instances < 1:
+            out.append("Error: Number of instances must be at least 1")
+            return None
+
+        try:
+            for spec in request.get('listen') or []:
+                parse_listen_spec(spec)
+            for key in ['ready_check', 'cron_restart']:
+                if request.get(key):
+                    parse_setting(key, request[key])
+        except ValueError as e:
+            out.append(f"Error: {e}")
+            return None
+
+        # Cluster mode: one entry per instance, named <group>:<index>
+        if instances == 1:
+            names = [name]
+        else:
+            names = [f"{name}:{index}" for index in range(instances)]
+
+        for index, instance_name in enumerate(names):
+            self.config[instance_name] = ProcessRecord({
+                'command': command,
+                'pid': None,
+                'directory': directory,
+                'max_restarts': 5,  # Default value
+                'restart_delay': 3,  # Default value
+                'restart_count': 0,
+                'created_at': time.time()
+            })
+            if instances > 1:
+                self.config[instance_name].update({
+                    'group': name,
+                    'instance': index,
+                    'env': {'PYPM_INSTANCE': str(index)},
+                })
+            if request.get('ready_check'):
+                self.config[instance_name]['ready_check'] = request['ready_check']
+            if request.get('ready_timeout'):
+                self.config[instance_name]['ready_timeout'] = request['ready_timeout']
+            if request.get('listen'):
+                self.config[instance_name]['listen'] = request['listen']
+            if request.get('watch'):
+                self.config[instance_name]['watch'] = True
+            for key in ['watch_include', 'watch_ignore', 'cron_restart']:
+                if request.get(key):
+                    self.config[instance_name][key] = request[key]
+
+        pids = await asyncio.gather(*(self.spawn(instance_name) for instance_name in names))
+        for instance_name in names:
+            self.schedule_timer('restart', instance_name)
+
+        started = []
+        for instance_name, pid in zip(names, pids):
+            if pid:
+                started.append(pid)
+                out.append(f"Started {instance_name} with PID {pid}")
+            else:
+                del self.config[instance_name]
+                out.append(f"Error starting process {instance_name}, see {LOG_FILE}")
+        if len(started) < len(names):
+            self.close_listeners()
+        if request.get('watch'):
+            self.update_watches()
+        self.save_state(*names)
+        return started
+
+    def group_members(self, group):
+        return [name for name, process in self.config.items() if process.get('group') == group]
+
+    def resolve_targets(self, target, out, active_only=True):
+        """Expand a CLI target ('all', a process name or a group) into the matching process names."""
+        if target == 'all':
+            return [name for name in self.config if self.is_active(name) or not active_only]
+        elif target in self.config:
+            return [target]
+        members = self.group_members(target)
+        if not members:
+            out.append(f"Process {target} not found")
+        return members
+
+    async def do_stop(self, request, out, delete=False):
+        names = self.resolve_targets(request['target'], out)
+        return await self.stop_processes(names, out, delete)
+
+    async def stop_processes(self, names, out, delete=False):
+
+        async def stop_one(name):
+            if not self.is_active(name):
+                return True, False
+            return await self.stop(name), True
+
+        # Signal every target at once and wait for all of them concurrently
+        results = await asyncio.gather(*(stop_one(name) for name in names))
+
+        for name, (stopped, was_active) in zip(names, results):
+            if not stopped:
+                out.append(f"Failed to stop {name}")
+                logging.error(f"Failed to stop process {name}")
+            elif delete:
+                del self.config[name]
+                self.remove_cgroup(name)
+                out.append(f"Deleted {name}")
+                logging.info(f"Deleted process {name}")
+            elif was_active:
+                self.config[name]['pid'] = None
+                out.append(f"Stopped {name}")
+                logging.info(f"Stopped process {name}")
+            else:
+                out.append(f"{name} is already stopped")
+
+        if delete:
+            self.close_listeners()
+            self.prune_launch_specs()
+            self.update_watches()
+        self.save_state(*names)
+        return None
+
+    async def do_delete(self, request, out):
+        return await self.do_stop(request, out, delete=True)
+
+    async def restart_process(self, name, limit=None):
+        """Stop (if running) and start one process. Returns (message, new PID or None)."""
+        process_config = self.config[name]
+        if self.is_active(name):
+            if not await self.stop(name):
+                return f"Failed to stop {name} for restart", None
+            process_config['pid'] = None
+            verb = "Restarted"
+        else:
+            # Process is already stopped, just start it
+            verb = "Started"
+
+        new_pid = await self.spawn(name, limit=limit)
+        if new_pid:
+            process_config['restart_count'] = process_config.get('restart_count', 0) + 1
+            self.save_state(name)
+            logging.info(f"{verb} process {name} with PID {new_pid}")
+            return f"{verb} {name} with PID {new_pid}", new_pid
+        logging.error(f"Failed to restart process {name}")
+        return f"Failed to restart {name}", None
+
+    async def do_restart(self, request, out):
+        names = self.resolve_targets(request['target'], out)
+        limit = asyncio.Semaphore(request.get('concurrency') or DEFAULT_CONCURRENCY)
+
+        # Each process is stopped and started independently, so the whole batch
+        # takes about as long as the slowest single stop
+        results = await asyncio.gather(*(self.restart_process(name, limit) for name in names))
+        out.extend(message for message, _ in results)
+
+        self.save_state(*names)
+        return None
+
+    async def wait_until_ready(self, name, pid, started_at, timeout):
+        """Poll an instance's readiness check. Returns False if it exits or times out."""
+        spec = self.probe_spec(name, 'ready_check')
+        deadline = time.monotonic() + timeout
+        while pid in self.pid_names:
+            if spec is None:
+                if time.time() - started_at >= READY_GRACE_PERIOD:
+                    return True
+            elif await self.run_probe(name, spec, pid, started_at, min(deadline - time.monotonic(), 1)):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(0.1)
+        return False
+
+    async def reload_one(self, name, limit):
+        """Replace one instance with a fresh copy, stopping the old one only after the new one is ready."""
+        process_config = self.config[name]
+        old_pid = process_config.get('pid')
+        self.emit('restarting', name, reason='reload')
+        if not old_pid or not self.is_alive(name, old_pid):
+            # Nothing to hand over from, just (re)start it
+            await self.stop(name)
+            pid = await self.spawn(name, limit=limit)
+            if pid:
+                return True, f"Started {name} with PID {pid}"
+            return False, f"Failed to start {name}"
+
+        timeout = process_config.get('ready_timeout', DEFAULT_READY_TIMEOUT)
+        started_at = time.time()
+        process = await self.launch(name, limit)
+        if process is None:
+            self.emit('spawn_failed', name)
+            return False, f"Failed to start new instance of {name}"
+
+        if not await self.wait_until_ready(name, process.pid, started_at, timeout):
+            self.emit('spawn_failed', name, pid=process.pid, reason='not_ready')
+            await self.stop_process(name, process.pid)
+            logging.error(f"New instance of {name} (PID: {process.pid}) did not become ready, keeping PID {old_pid}")
+            return False, f"New instance of {name} (PID: {process.pid}) did not become ready within {timeout}s, keeping PID {old_pid}"
+
+        # Hand over: the new instance becomes current before the old one is told to stop
+        process_config['pid'] = process.pid
+        process_config['started_at'] = started_at
+        self.record_identity(name, process.pid)
+        self.emit('spawned', name, pid=process.pid)
+        process_config['restart_count'] = process_config.get('restart_count', 0) + 1
+        process_config.pop('status', None)
+        process_config['crash_count'] = 0
+        self.schedule_probes(name)
+        await self.stop_process(name, old_pid)
+        logging.info(f"Reloaded process {name}: PID {old_pid} -> {process.pid}")
+        return True, f"Reloaded {name}: PID {old_pid} -> {process.pid}"
+
+    async def do_reload(self, request, out):
+        """Zero-downtime restart: replace instances batch by batch, each gated on readiness."""
+        names = self.resolve_targets(request['target'], out, active_only=False)
+        batch = max(request.get('batch') or 1, 1)
+        limit = asyncio.Semaphore(request.get('concurrency') or DEFAULT_CONCURRENCY)
+
+        for index in range(0, len(names), batch):
+            results = await asyncio.gather(*(self.reload_one(name, limit) for name in names[index:index + batch]))
+            out.extend(message for _, message in results)
+            if not all(ok for ok, _ in results):
+                remaining = names[index + batch:]
+                if remaining:
+                    out.append(f"Reload aborted, not reloaded: {', '.join(remaining)}")
+                break
+
+        self.save_state(*names)
+        return None
+
+    async def do_config(self, request, out):
+        name = request['name']
+        names = self.resolve_targets(name, out, active_only=False)
+        if not names:
+            return None
+
+        key = request['key']
+        if key is None:
+            # Show the settings instead of changing one
+            return {member: {setting: self.config[member][setting] for setting in ['command', 'directory', *SETTING_KEYS]
+                             if self.config[member].get(setting) is not None}
+                    for member in names}
+        if key not in SETTING_KEYS:
+            out.append(f"Unknown setting '{key}'. Available settings: {', '.join(SETTING_KEYS)}")
+            return None
+        # Convert value to appropriate type
+        try:
+            value = parse_setting(key, request['value'])
+        except ValueError as e:
+            out.append(str(e))
+            return None
+
+        # Update config, for every instance when a group is targeted
+        for member in names:
+            self.config[member][key] = value
+            self.apply_setting(member, key, out)
+        self.save_state(*names)
+        out.append(f"Updated {key} to {value} for process {name}")
+        logging.info(f"Updated {key} to {value} for process {name}")
+        return {member: {key: value} for member in names}
+
+    def apply_setting(self, name, key, out):
+        """Make a changed setting take effect on a running process where that's possible."""
+        value = self.config[name].get(key)
+        if key in ['log_max_size', 'log_max_age', 'log_keep', 'log_compress'] and name in self.log_writers:
+            setattr(self.log_writers[name], key[len('log_'):], value)
+        if key in ['max_memory', 'cpu_quota'] and self.cgroup_root is not None:
+            # cgroup limits apply to running processes immediately
+            try:
+                self.prepare_cgroup(name)
+            except OSError as e:
+                out.append(f"Failed to update cgroup for {name}: {e}")
+        if key.startswith('health_') or key == 'ready_check':
+            if self.config[name].get('pid'):
+                self.schedule_probes(name)
+        if key in ['watch', 'watch_ignore']:
+            self.update_watches()
+        if key == 'cron_restart':
+            self.schedule_timer('restart', name)
+
+    def desired_config(self, declarations):
+        """Expand an ecosystem file's declarations into config entries, keyed by process name.
+
+        Raises ValueError if a declaration is invalid.
+        """
+        desired = {}
+        for name, declaration in declarations.items():
+            declaration = dict(declaration)
+            if not re.match(r'^[a-zA-Z0-9_-]+$', name):
+                raise ValueError(f"Invalid process name '{name}': use only alphanumeric characters, underscores, and hyphens.")
+            if name in self.jobs:
+                raise ValueError(f"A job named '{name}' already exists")
+            command = declaration.pop('command', None)
+            directory = declaration.pop('directory', None)
+            if not command or not directory:
+                raise ValueError(f"Process {name} needs a command and a directory")
+            valid, msg = validate_command(directory, command)
+            if not valid:
+                raise ValueError(f"{name}: {msg}")
+            instances = int(declaration.pop('instances', 1))
+            if instances < 1:
+                raise ValueError(f"{name}: Number of instances must be at least 1")
+            env = {str(key): str(value) for key, value in (declaration.pop('env', None) or {}).items()}
+            listen = declaration.pop('listen', None) or []
+            listen = listen.split(',') if isinstance(listen, str) else list(listen)
+            for spec in listen:
+                parse_listen_spec(spec)
+
+            entry = {'command': command, 'directory': directory, 'max_restarts': 5, 'restart_delay': 3}
+            for key, value in declaration.items():
+                if key not in SETTING_KEYS:
+                    raise ValueError(f"{name}: unknown setting '{key}'")
+                value = parse_setting(key, value)
+                if value is not None:
+                    entry[key] = value
+            if listen:
+                entry['listen'] = listen
+
+            if instances == 1:
+                if env:
+                    entry['env'] = env
+                desired[name] = entry
+            else:
+                for index in range(instances):
+                    desired[f"{name}:{index}"] = {**entry, 'group': name, 'instance': index,
+                                                  'env': {**env, 'PYPM_INSTANCE': str(index)}}
+        return desired
+
+    async def do_apply(self, request, out):
+        """Bring the managed processes in line with an ecosystem file.
+
+        Only what differs is touched: new processes are started, processes whose
+        command, directory, environment or sockets changed are restarted, processes
+        with only changed settings are updated in place, and with `prune` processes
+        missing from the file are deleted. All of it runs concurrently and the state
+        is committed once at the end.
+        """
+        try:
+            desired = self.desired_config(request['processes'])
+        except ValueError as e:
+            out.append(f"Error: {e}")
+            return None
+
+        removed = [name for name in self.config if name not in desired] if request.get('prune') else []
+        kept = set(self.config) - set(removed)
+        for name in desired:
+            group = desired[name].get('group')
+            clash = [other for other in kept
+                     if other not in desired and (other == group or self.config[other].get('group') == name)]
+            if clash:
+                out.append(f"Error: {name} clashes with existing process {clash[0]}, use --prune to replace it")
+                return None
+
+        created, relaunched, updated, started, unchanged = [], [], [], [], []
+        changes = {}
+        for name, entry in desired.items():
+            current = self.config.get(name)
+            if current is None:
+                created.append(name)
+                continue
+            if 'autostart' not in entry and current.get('autostart') is not None:
+                # Left out of the file, `pypm save` or `pypm config` decides
+                entry['autostart'] = current['autostart']
+            changes[name] = [key for key in DECLARED_KEYS if current.get(key) != entry.get(key)]
+            if any(key in RELAUNCH_KEYS for key in changes[name]):
+                relaunched.append(name)
+            elif changes[name]:
+                updated.append(name)
+            else:
+                unchanged.append(name)
+            if name not in relaunched and not self.is_active(name):
+                started.append(name)
+
+        for name in created:
+            out.append(f"+ {name}")
+        for name in relaunched:
+            out.append(f"~ {name} (restart: {', '.join(changes[name])})")
+        for name in updated:
+            out.append(f"~ {name} ({', '.join(changes[name])})")
+        for name in removed:
+            out.append(f"- {name}")
+        out.append(f"{len(created)} to create, {len(relaunched)} to restart, {len(updated)} to update, "
+                   f"{len(removed)} to delete, {len(unchanged)} unchanged")
+        if request.get('dry_run'):
+            return None
+
+        # Deletions first, so their names and sockets are free for the rest
+        if removed:
+            await self.stop_processes(removed, out, delete=True)
+
+        for name in updated + relaunched:
+            current = self.config[name]
+            runtime = {key: value for key, value in current.items() if key not in DECLARED_KEYS}
+            self.config[name] = ProcessRecord({**runtime, **desired[name]})
+            if name in updated:
+                for key in changes[name]:
+                    self.apply_setting(name, key, out)
+        for name in created:
+            self.config[name] = ProcessRecord({**desired[name], 'pid': None, 'restart_count': 0,
+                                               'created_at': time.time()})
+        if relaunched:
+            self.prune_launch_specs()
+
+        limit = asyncio.Semaphore(request.get('concurrency') or DEFAULT_CONCURRENCY)
+
+        async def launch_one(name):
+            if name in relaunched:
+                return (await self.restart_process(name, limit))[0]
+            pid = await self.spawn(name, limit=limit)
+            return f"Started {name} with PID {pid}" if pid else f"Failed to start {name}, see {LOG_FILE}"
+
+        out.extend(await asyncio.gather(*(launch_one(name) for name in created + relaunched + started)))
+        self.close_listeners()
+        self.update_watches()
+        for name in created + relaunched:
+            self.schedule_timer('restart', name)
+        self.save_state(*desired)
+        # One transaction for the whole apply
+        self.flush_state()
+        logging.info(f"Applied ecosystem file: {len(created)} created, {len(relaunched)} restarted, "
+                     f"{len(updated)} updated, {len(removed)} deleted")
+        return None
+
+    async def do_resurrect(self, request, out):
+        """Start every process saved for autostart that isn't running, in dependency order.
+
+        A process holds one of `concurrency` slots until it passes its readiness check
+        (or has stayed up READY_GRACE_PERIOD), and starts are at least `stagger` seconds
+        apart, so a cold boot doesn't have every app importing its dependencies at once.
+        """
+        names = [name for name, process in self.config.items()
+                 if process.get('autostart') and name not in self.restart_tasks
+                 and not (process.get('pid') and self.is_alive(name, process['pid']))]
+        if not names:
+            out.append("No saved processes need to be started")
+            return None
+        try:
+            waves = dependency_waves(self.config, names)
+        except ValueError as e:
+            out.append(f"Error: {e}")
+            return None
+
+        limit = asyncio.Semaphore(request.get('concurrency') or os.cpu_count() or 1)
+        stagger = request.get('stagger') or 0
+        next_start = time.monotonic()
+
+        async def start_one(name):
+            nonlocal next_start
+            async with limit:
+                now = time.monotonic()
+                slot = max(next_start, now)
+                next_start = slot + stagger
+                await asyncio.sleep(slot - now)
+                process_config = self.config[name]
+                # Left over from before the reboot
+                process_config['pid'] = None
+                started_at = time.time()
+                pid = await self.spawn(name)
+                if pid is None:
+                    return f"Failed to start {name}, see {LOG_FILE}"
+                timeout = process_config.get('ready_timeout', DEFAULT_READY_TIMEOUT)
+                if not await self.wait_until_ready(name, pid, started_at, timeout):
+                    return f"Started {name} with PID {pid}, but it did not become ready within {timeout}s"
+                return f"Started {name} with PID {pid}"
+
+        for wave in waves:
+            out.extend(await asyncio.gather(*(start_one(name) for name in wave)))
+        self.save_state(*names)
+        logging.info(f"Resurrected {len(names)} saved processes in {len(waves)} dependency waves")
+        return None
+
+    def schedule_timer(self, kind, name):
+        """Queue the next cron restart of a process ('restart') or run of a job ('job').
+
+        Replaces anything already queued for it; nothing is queued if it has no schedule.
+        """
+        key = (kind, name)
+        generation = self.timer_generations[key] = self.timer_generations.get(key, 0) + 1
+        if kind == 'restart':
+            expression = self.config.get(name, {}).get('cron_restart')
+            due = next_cron_time(parse_cron(expression), time.time()) if expression else None
+        else:
+            job = self.jobs.get(name, {})
+            if job.get('cron'):
+                due = next_cron_time(parse_cron(job['cron']), time.time())
+            elif job.get('at') and not job.get('fired'):
+                due = job['at']
+            else:
+                due = None
+            job['next_run'] = due
+        if due is None:
+            return
+        heapq.heappush(self.timer_queue, (due, kind, name, generation))
+        if self.timer_wakeup is not None:
+            self.timer_wakeup.set()
+
+    async def timer_loop(self):
+        """A single scheduler for every cron restart and job, however many there are."""
+        while True:
+            now = time.time()
+            if not self.timer_queue or self.timer_queue[0][0] > now:
+                timeout = SCHEDULER_MAX_SLEEP
+                if self.timer_queue:
+                    timeout = min(timeout, self.timer_queue[0][0] - now)
+                self.timer_wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.timer_wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, kind, name, generation = heapq.heappop(self.timer_queue)
+            if self.timer_generations.get((kind, name)) != generation:
+                continue
+            if kind == 'restart':
+                self.cron_restart(name)
+            else:
+                self.start_job(name, 'schedule')
+            self.schedule_timer(kind, name)
+
+    def cron_restart(self, name):
+        if name not in self.config or not self.is_active(name):
+            return
+        if name in self.forced_restarts:
+            logging.info(f"Skipping the cron_restart of {name}, it is already being restarted")
+            return
+        logging.info(f"Restarting {name} on its cron_restart schedule ({self.config[name]['cron_restart']})")
+        self.emit('restarting', name, reason='cron')
+        self.forced_restarts.add(name)
+        task = asyncio.create_task(self.restart_process(name))
+        task.add_done_callback(lambda done: self.forced_restarts.discard(name))
+
+    def start_job(self, name, trigger):
+        job = self.jobs[name]
+        if trigger == 'schedule' and not job.get('cron'):
+            job['fired'] = True
+            self.state.write_job(name, job)
+        if job['running'] and job.get('overlap', 'skip') == 'skip':
+            logging.warning(f"Job {name} is still running, skipping this run")
+            self.emit('job_skipped', name, trigger=trigger)
+            self.state.start_run(name, trigger, None, status='skipped')
+            return
+        task = asyncio.create_task(self.run_job(name, trigger))
+        self.job_tasks.add(task)
+        task.add_done_callback(self.job_tasks.discard)
+
+    async def run_job(self, name, trigger):
+        """Run a job once and record the run. Jobs are never restarted when they fail."""
+        job = self.jobs[name]
+        try:
+            spec = resolve_launch_spec(job['directory'], job['command'])
+        except ValueError as e:
+            logging.error(f"Invalid command for job {name}: {e}")
+            self.state.start_run(name, trigger, None, status='failed')
+            return
+        process = await self.loop.run_in_executor(None, start_process, name, spec, job.get('env'))
+        if process is None:
+            self.state.start_run(name, trigger, None, status='failed')
+            return
+        run_id = self.state.start_run(name, trigger, process.pid)
+        identity = process_identity(process.pid)
+        if identity is not None:
+            identity['cmdline'] = spec['argv']
+        job['running'][str(process.pid)] = {'run_id': run_id, 'identity': identity}
+        self.state.write_job(name, job)
+        self.children[process.pid] = process
+        self.capture_output(name, process)
+        logging.info(f"Started job {name} with PID {process.pid}")
+        self.emit('job_started', name, pid=process.pid, trigger=trigger)
+        await self.finish_job(name, process.pid)
+
+    async def finish_job(self, name, pid):
+        waiter = self.exit_waiters[pid] = self.loop.create_future()
+        self.watch_exit(name, pid)
+        exit_code = await waiter
+        job = self.jobs.get(name)
+        if job is None:
+            return  # deleted while running, together with its history
+        run = job['running'].pop(str(pid), None)
+        if run is None:
+            return
+        status = 'unknown' if exit_code is None else 'ok' if exit_code == 0 else 'failed'
+        self.state.finish_run(run['run_id'], exit_code, status)
+        self.state.write_job(name, job)
+        logging.info(f"Job {name} (PID: {pid}) finished with exit code {exit_code}")
+        self.emit('job_finished', name, pid=pid, exit_code=exit_code, status=status)
+
+    def adopt_jobs(self):
+        """Keep track of job runs that were in progress when the daemon last stopped."""
+        children = set(self.handoff_state.get('children', []))
+        for name, job in self.jobs.items():
+            for pid, run in list(job['running'].items()):
+                pid = int(pid)
+                if process_identity(pid) != run['identity'] or run['identity'] is None:
+                    job['running'].pop(str(pid))
+                    self.state.finish_run(run['run_id'], None, 'unknown')
+                    self.state.write_job(name, job)
+                    continue
+                if pid not in children:
+                    self.adopted.add(pid)
+                logging.info(f"Adopted run of job {name} (PID: {pid})")
+                task = asyncio.create_task(self.finish_job(name, pid))
+                self.job_tasks.add(task)
+                task.add_done_callback(self.job_tasks.discard)
+
+    async def do_job(self, request, out):
+        command = request['command']
+        name = request.get('name')
+        if command == 'list':
+            return [self.job_row(job_name) for job_name in sorted(self.jobs)]
+        if name not in self.jobs and command != 'create':
+            out.append(f"Job {name} not found")
+            return None
+
+        if command == 'run':
+            self.start_job(name, 'manual')
+            out.append(f"Started job {name}, see `pypm logs {name}`")
+        elif command == 'history':
+            return self.state.job_runs(name, request.get('limit') or 20)
+        elif command == 'delete':
+            for pid in self.jobs[name]['running']:
+                try:
+                    os.kill(int(pid), signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            del self.jobs[name]
+            self.timer_generations.pop(('job', name), None)
+            self.state.write_job(name, None)
+            out.append(f"Deleted job {name}")
+            logging.info(f"Deleted job {name}")
+        elif command == 'create':
+            valid, msg = validate_process_name(name, self.jobs)
+            if valid and (name in self.config or self.group_members(name)):
+                valid, msg = False, f"A process named '{name}' already exists. Use a different name."
+            if valid:
+                valid, msg = validate_command(request['directory'], request['job_command'])
+            if valid and request.get('overlap', 'skip') not in ['skip', 'allow']:
+                valid, msg = False, "--overlap must be skip or allow"
+            if valid and request.get('cron'):
+                try:
+                    parse_setting('cron_restart', request['cron'])
+                except ValueError as e:
+                    valid, msg = False, str(e).replace('cron_restart', '--cron')
+            if not valid:
+                out.append(f"Error: {msg}")
+                return None
+            self.jobs[name] = {
+                'command': request['job_command'],
+                'directory': request['directory'],
+                'cron': request.get('cron'),
+                'at': request.get('at'),
+                'overlap': request.get('overlap', 'skip'),
+                'created_at': time.time(),
+                'running': {},
+            }
+            self.state.write_job(name, self.jobs[name])
+            if request.get('cron') or request.get('at'):
+                self.schedule_timer('job', name)
+                out.append(f"Created job {name}, next run at {format_time(self.jobs[name]['next_run'])}")
+            else:
+                self.start_job(name, 'manual')
+                out.append(f"Started job {name}, see `pypm logs {name}`")
+            logging.info(f"Created job {name}: {request['job_command']}")
+        return None
+
+    def job_row(self, name):
+        job = self.jobs[name]
+        runs = self.state.job_runs(name, 1)
+        return {
+            'name': name,
+            'schedule': job.get('cron') or (f"once at {format_time(job['at'])}" if job.get('at') else 'once'),
+            'next_run': job.get('next_run'),
+            'running': len(job['running']),
+            'last_run': runs[0] if runs else None,
+        }
+
+    def resurrect_after_boot(self):
+        """Start the saved processes on the daemon's first start after a reboot, if `pypm startup` asked for it."""
+        boot_id = read_boot_id()
+        if boot_id is None or self.state.get_setting('boot_id') == boot_id:
+            return
+        self.state.set_setting('boot_id', boot_id)
+        options = self.state.get_setting('resurrect_at_boot')
+        if options is None:
+            return
+
+        async def resurrect():
+            out = []
+            await self.do_resurrect(options, out)
+            for line in out:
+                logging.info(f"Boot resurrect: {line}")
+        logging.info("First start since boot, starting saved processes")
+        task = asyncio.create_task(resurrect())
+        self.job_tasks.add(task)
+        task.add_done_callback(self.job_tasks.discard)
+
+    async def do_startup(self, request, out):
+        self.state.set_setting('resurrect_at_boot', {'concurrency': request.get('concurrency'),
+                                                     'stagger': request.get('stagger')})
+        saved = sum(1 for process in self.config.values() if process.get('autostart'))
+        out.append(f"Saved processes ({saved}) will be started when PyPM first starts after a reboot")
+        if not saved:
+            out.append("No processes are saved yet, run `pypm save` first")
+        logging.info("Enabled resurrect at boot")
+        return None
+
+    async def do_disable_startup(self, request, out):
+        self.state.set_setting('resurrect_at_boot', None)
+        out.append("Disabled autostart of saved processes")
+        logging.info("Disabled resurrect at boot")
+        return None
+
+    async def do_status(self, request, out):
+        return {
+            'resurrect_at_boot': self.state.get_setting('resurrect_at_boot') is not None,
+            'jobs': len(self.jobs),
+            'timers': len(self.timer_queue),
+        }
+
+    async def do_save(self, request, out):
+        # Processes set to `autostart false` stay out
+        for name, process in self.config.items():
+            if process.get('autostart') is not False:
+                process['autostart'] = True
+        self.save_state(*self.config)
+        out.append("Saved current process list for autostart")
+        logging.info("Saved current process list for autostart")
+        return None
+
+
+def run_daemon(handoff=False):
+    """Entry point for the resident daemon started by `pypm start-self`.
+
+    With `handoff` this is the new image after restart-self, which inherits the lock.
+    """
+    state = None
+    if handoff and HANDOFF_FILE.exists():
+        with open(HANDOFF_FILE) as f:
+            state = json.load(f)
+        HANDOFF_FILE.unlink()
+        os.set_inheritable(state['lock_fd'], False)
+        lock_file = os.fdopen(state['lock_fd'], 'w')
+    else:
+        # Hold an exclusive lock for the daemon's lifetime so concurrent CLI calls can't start two
+        lock_file = open(DAEMON_LOCK_FILE, 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print("PyPM is already running.")
+            return
+    trim_runtime()
+    try:
+        asyncio.run(Supervisor(lock_file.fileno(), state).run())
+    finally:
+        lock_file.close()
+
+
+def trim_runtime():
+    """Leave out what the resident daemon never uses, before asyncio is imported."""
+    # asyncio imports ssl, and with it OpenSSL (about 4.5 MB), for TLS that PyPM doesn't use.
+    # Hiding it is opt-in (PYPM_NO_SSL=1), since nothing else in the daemon can use ssl then
+    if os.environ.get('PYPM_NO_SSL') and 'ssl' not in sys.modules:
+        sys.modules['ssl'] = None
+    # Two malloc arenas are plenty for the event loop and a few worker threads, and each
+    # extra arena keeps its own free memory resident
+    try:
+        ctypes.CDLL(None).mallopt(M_ARENA_MAX, 2)
+    except AttributeError:
+        pass  # not glibc
+
+
+def release_free_memory():
+    """Give memory malloc holds on to but no longer uses back to the OS.
+
+    Without cached bytecode, compiling this file at daemon start leaves over 10 MB
+    of freed scratch memory behind, and bursts like mass starts add to it.
+    """
+    try:
+        ctypes.CDLL(None).malloc_trim(0)
+    except AttributeError:
+        pass  # not glibc
+
+
+def pop_option(args, flag, default=None, cast=str):
+    """Remove `flag VALUE` from args and return VALUE (converted with cast), or default."""
+    if flag not in args:
+        return default
+    index = args.index(flag)
+    if index + 1 >= len(args):
+        raise ValueError(f"Option {flag} requires a value")
+    value = args[index + 1]
+    del args[index:index + 2]
+    return cast(value)
+
+
+def load_ecosystem(path):
+    """Read the process declarations from an ecosystem file (TOML, YAML or JSON).
+
+    Relative directories are resolved against the file's own directory.
+    Raises ValueError if the file can't be used.
+    """
+    path = Path(path)
+    with open(path, 'rb') as f:
+        if path.suffix == '.toml':
+            try:
+                import tomllib
+            except ImportError:
+                raise ValueError("TOML ecosystem files need Python 3.11 or later, use JSON instead")
+            data = tomllib.load(f)
+        elif path.suffix in ['.yaml', '.yml']:
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("YAML ecosystem files need PyYAML (pip install pyyaml)")
+            data = yaml.safe_load(f)
+        elif path.suffix == '.json':
+            data = json.load(f)
+        else:
+            raise ValueError("Ecosystem file must end in .toml, .yaml, .yml or .json")
+
+    processes = data.get('processes') if isinstance(data, dict) else None
+    if not isinstance(processes, dict):
+        raise ValueError(f"{path} must contain a 'processes' table")
+    base = path.resolve().parent
+    for name, declaration in processes.items():
+        if not isinstance(declaration, dict):
+            raise ValueError(f"Process {name} must be a table of settings")
+        declaration['directory'] = str(base / declaration.get('directory', '.'))
+    return processes
+
+
+def build_request(action, args):
+    """Turn CLI arguments into a daemon request, or return None after printing usage."""
+    args = list(args)
+    if action == 'list':
+        return {'action': 'list'}
+    elif action == 'metrics':
+        since = pop_option(args, '--since', default='1h', cast=parse_duration)
+        if len(args) < 1:
+            print("Usage: pypm metrics <name> [--since 1h]")
+            return None
+        return {'action': 'metrics', 'name': args[0], 'since': since}
+    elif action == 'serve-metrics':
+        return {
+            'action': 'serve-metrics',
+            'host': pop_option(args, '--host', default=METRICS_HOST),
+            'port': pop_option(args, '--port', default=METRICS_PORT, cast=int),
+            'stop': '--stop' in args,
+        }
+    elif action == 'serve-agent':
+        return {
+            'action': 'serve-agent',
+            'host': pop_option(args, '--host', default=AGENT_HOST),
+            'port': pop_option(args, '--port', default=AGENT_PORT, cast=int),
+            'stop': '--stop' in args,
+        }
+    elif action == 'start':
+        request = {'action': 'start'}
+        if args:
+            request['name'] = args.pop(0)
+        # Options go between the name and the command
+        while args and (args[0] in START_OPTIONS or args[0] == '--watch'):
+            if args[0] == '--watch':
+                request['watch'] = True
+                args.pop(0)
+                continue
+            key, cast = START_OPTIONS[args[0]]
+            request[key] = pop_option(args, args[0], cast=cast)
+        if 'name' not in request or not args:  # Require command parameter
+            print("Usage: pypm start <name> [-i N] [--ready port:N|socket:PATH|file:PATH] [--ready-timeout S] "
+                  "[--listen tcp:PORT|unix:PATH,...] [--watch] [--watch-include GLOBS] [--watch-ignore GLOBS] <command>")
+            return None
+        request.update({'directory': os.getcwd(), 'command': ' '.join(args)})
+        return request
+    elif action == 'reload':
+        batch = pop_option(args, '--batch', cast=int)
+        concurrency = pop_option(args, '--concurrency', cast=int)
+        if len(args) < 1:
+            print("Usage: pypm reload <name|group|all> [--batch N]")
+            return None
+        return {'action': 'reload', 'target': args[0], 'batch': batch, 'concurrency': concurrency}
+    elif action in ['stop', 'delete', 'restart']:
+        concurrency = pop_option(args, '--concurrency', cast=int)
+        if len(args) < 1:
+            print(f"Usage: pypm {action} <name|all> [--concurrency N]")
+            return None
+        return {'action': action, 'target': args[0], 'concurrency': concurrency}
+    elif action == 'apply':
+        concurrency = pop_option(args, '--concurrency', cast=int)
+        flags = [arg for arg in args if arg.startswith('--')]
+        args = [arg for arg in args if not arg.startswith('--')]
+        if len(args) < 1:
+            print("Usage: pypm apply <ecosystem.toml|.yaml|.json> [--prune] [--dry-run] [--concurrency N]")
+            return None
+        try:
+            processes = load_ecosystem(args[0])
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            return None
+        return {'action': 'apply', 'processes': processes, 'prune': '--prune' in flags,
+                'dry_run': '--dry-run' in flags, 'concurrency': concurrency}
+    elif action == 'job':
+        usage = ("Usage: pypm job <name> [--cron EXPR | --at [YYYY-MM-DDT]HH:MM] [--overlap skip|allow] <command>\n"
+                 "       pypm job list | run <name> | history <name> [--lines N] | delete <name>")
+        if args[:1] == ['list']:
+            return {'action': 'job', 'command': 'list'}
+        if args[:1] in (['run'], ['history'], ['delete']):
+            limit = pop_option(args, '--lines', default=20, cast=int)
+            if len(args) < 2:
+                print(usage)
+                return None
+            return {'action': 'job', 'command': args[0], 'name': args[1], 'limit': limit}
+        request = {'action': 'job', 'command': 'create'}
+        if args:
+            request['name'] = args.pop(0)
+        while args and args[0] in JOB_OPTIONS:
+            key, cast = JOB_OPTIONS[args[0]]
+            request[key] = pop_option(args, args[0], cast=cast)
+        if 'name' not in request or not args or (request.get('cron') and request.get('at')):
+            print(usage)
+            return None
+        request.update({'directory': os.getcwd(), 'job_command': ' '.join(args)})
+        return request
+    elif action in ['resurrect', 'startup']:
+        return {
+            'action': action,
+            'concurrency': pop_option(args, '--concurrency', cast=int),
+            'stagger': pop_option(args, '--stagger', cast=float),
+        }
+    elif action == 'config':
+        if len(args) == 1:
+            return {'action': 'config', 'name': args[0], 'key': None}
+        if len(args) < 3:
+            print("Usage: pypm config <name> [<key> <value>]")
+            return None
+        return {'action': 'config', 'name': args[0], 'key': args[1], 'value': args[2]}
+    elif action == 'events':
+        follow = '-f' in args or '--follow' in args
+        lines = pop_option(args, '--lines', default=0 if follow else 20, cast=int)
+        args = [arg for arg in args if arg not in ('-f', '--follow')]
+        return {'action': 'events', 'follow': follow, 'lines': lines, 'target': args[0] if args else None}
+    elif action == 'debug':
+        seconds = pop_option(args, '--seconds', default=30, cast=float)
+        output = pop_option(args, '--output', default=f"pypm-profile-{time.strftime('%Y%m%d-%H%M%S')}.txt")
+        if not args or args[0] not in ['stats', 'profile'] or seconds <= 0:
+            print("Usage: pypm debug stats | pypm debug profile [--seconds 30] [--output FILE]")
+            return None
+        # The output file is written by the client, the daemon only returns the samples
+        return {'action': 'debug', 'command': args[0], 'seconds': seconds, 'output': os.path.abspath(output)}
+    return {'action': action}
+
+
+def print_metrics(report):
+    """Print the min/avg/p95/max table returned by the daemon's metrics action."""
+    print(f"Metrics for {report['name']}: {report['samples']} samples from "
+          f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(report['first']))} to "
+          f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(report['last']))}")
+    print(f"{'METRIC':<14} {'MIN':>12} {'AVG':>12} {'P95':>12} {'MAX':>12}")
+    print("-" * 66)
+    labels = [
+        ('cpu', 'CPU %'),
+        ('memory', 'Memory MB'),
+        ('fds', 'Open FDs'),
+        ('threads', 'Threads'),
+        ('read_rate', 'Read B/s'),
+        ('write_rate', 'Write B/s'),
+    ]
+    for key, label in labels:
+        stats = report['metrics'][key]
+        if stats is None:
+            print(f"{label:<14} {'N/A':>12} {'N/A':>12} {'N/A':>12} {'N/A':>12}")
+        else:
+            print(f"{label:<14} {stats['min']:>12.1f} {stats['avg']:>12.1f} {stats['p95']:>12.1f} {stats['max']:>12.1f}")
+
+
+def print_debug_stats(stats):
+    """Print the daemon internals returned by `pypm debug stats`."""
+    uptime = int(stats['uptime'])
+    print(f"PyPM daemon (PID: {stats['pid']}), up {uptime // 3600}h {uptime % 3600 // 60}m {uptime % 60}s, "
+          f"exit detection: {stats['exit_detection']}")
+    print(f"Processes: {stats['processes']} managed, {stats['children']} children, {stats['adopted']} adopted")
+    print(f"Memory: {stats['rss_mb']:.1f} MB, open fds: {stats['fds']}, "
+          f"threads: {stats['threads']} ({', '.join(stats['thread_names'])})")
+    print()
+    print(f"{'QUEUE':<22} {'DEPTH':>8}")
+    print("-" * 31)
+    for queue, depth in stats['queues'].items():
+        print(f"{queue:<22} {depth:>8}")
+    print()
+    print(f"{'OPERATION':<14} {'COUNT':>10} {'AVG ms':>10} {'MAX ms':>10} {'TOTAL s':>10}")
+    print("-" * 58)
+    for operation, timing in stats['timings'].items():
+        avg = timing['total'] / timing['count'] * 1000 if timing['count'] else 0
+        print(f"{operation:<14} {timing['count']:>10} {avg:>10.2f} {timing['max'] * 1000:>10.2f} {timing['total']:>10.3f}")
+
+
+def print_profile(profile, output):
+    """Write the folded stacks from `pypm debug profile` to output and print the hottest functions."""
+    stacks = profile['stacks']
+    with open(output, 'w') as f:
+        for stack, count in sorted(stacks.items(), key=lambda item: -item[1]):
+            f.write(f"{stack} {count}\n")
+
+    own, total = {}, {}
+    for stack, count in stacks.items():
+        thread, *frames = stack.split(';')
+        frames = [f"[{thread}] {frame}" for frame in frames]
+        if frames:
+            own[frames[-1]] = own.get(frames[-1], 0) + count
+        for frame in set(frames):
+            total[frame] = total.get(frame, 0) + count
+    passes = max(profile['passes'], 1)
+    print(f"{profile['passes']} samples over {profile['seconds']:g}s, folded stacks written to {output}")
+    print("Percentages are of samples; idle threads show up in select(), wait() and similar.")
+    print()
+    print(f"{'OWN %':>7} {'TOTAL %':>8}  FUNCTION")
+    print("-" * 80)
+    for frame, count in sorted(own.items(), key=lambda item: -item[1])[:20]:
+        print(f"{count / passes * 100:>7.1f} {total[frame] / passes * 100:>8.1f}  {frame}")
+
+
+def top(interval):
+    """Redraw the daemon's process samples continuously until interrupted."""
+    try:
+        while True:
+            rows = send_request({'action': 'list'})['data']
+            # Clear the screen and move the cursor home before each frame
+            print("\033[H\033[2J", end="")
+            print(f"PyPM top - {time.strftime('%H:%M:%S')} - refreshing every {interval:g}s (Ctrl+C to quit)\n")
+            print(f"{'NAME':<20} {'STATUS':<10} {'PID':<8} {'CPU':>7} {'MEM':>10} {'THREADS':>8} {'PROCS':>6} {'RESTARTS':>9}")
+            print("-" * 84)
+            for row in sorted(rows, key=lambda row: row['cpu'] or 0, reverse=True):
+                if row['status'] == 'RUNNING':
+                    print(f"{row['name']:<20} {'RUNNING':<10} {row['pid']:<8} {row['cpu']:>6.1f}% {row['memory']:>8.1f}MB "
+                          f"{row['threads']:>8} {row['processes']:>6} {row['restarts']:>9}")
+                else:
+                    print(f"{row['name']:<20} {row['status']:<10} {'N/A':<8} {'N/A':>7} {'N/A':>10} {'N/A':>8} {'N/A':>6} {row['restarts']:>9}")
+            sys.stdout.flush()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print()
+
+
+def print_settings(settings):
+    """Print the settings returned by `pypm config <name>`, one process at a time."""
+    for name, values in settings.items():
+        print(f"{name}:")
+        for key, value in values.items():
+            if isinstance(value, list):
+                value = ','.join(str(item) for item in value)
+            print(f"  {key:<20} {value}")
+
+
+def format_event(event):
+    details = ' '.join(f"{key}={value}" for key, value in event.items() if key not in ['seq', 'time', 'event', 'name'])
+    return (f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event['time']))} "
+            f"{event['name'] or '-':<20} {event['event']:<15} {details}").rstrip()
+
+
+def follow_events(request, as_json):
+    """Print the daemon's events as they happen, until interrupted or the daemon goes away."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(str(SOCKET_FILE))
+            sock.sendall(json.dumps(request).encode() + b'\n')
+            with sock.makefile('rb') as f:
+                for line in f:
+                    print(line.decode().rstrip() if as_json else format_event(json.loads(line)), flush=True)
+        print("PyPM daemon closed the event stream", file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+
+
+def status(as_json):
+    pid = get_saved_pid()
+    running = bool(pid) and daemon_running()
+    daemon_status = send_request({'action': 'status'}).get('data') or {} if running else {}
+    info = {
+        'running': running,
+        'pid': pid if running else None,
+        'log_file': str(LOG_FILE),
+        'state_file': str(STATE_DB),
+        'control_socket': str(SOCKET_FILE),
+        'autostart': autostart_enabled(),
+        'process_autostart': daemon_status.get('resurrect_at_boot', False),
+        'jobs': daemon_status.get('jobs', 0),
+    }
+    if as_json:
+        print(json.dumps(info, indent=2))
+    elif running:
+        print(f"PyPM is running with PID {pid}")
+        print(f"Log file: {LOG_FILE}")
+        print(f"State file: {STATE_DB}")
+        print(f"Control socket: {SOCKET_FILE}")
+        print(f"PyPM autostart: {'Enabled' if info['autostart'] else 'Disabled'}")
+        print(f"Process autostart: {'Enabled' if info['process_autostart'] else 'Disabled'}")
+        print(f"Jobs: {info['jobs']}")
+    else:
+        print("PyPM is not running")
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: pypm [list|top|metrics|serve-metrics|serve-agent|fleet|logs|events|start|stop|restart|reload|delete|apply|job|save|resurrect|startup|disable-startup|stop-self|restart-self|start-self|enable|disable|debug]")
+        return
+
+    action = sys.argv[1]
+    args = sys.argv[2:]
+    # --json prints the daemon's response as is. `start` and `job` take it only right after
+    # the action, since anything later may belong to the command being run
+    as_json = '--json' in (args[:1] if action in ['start', 'job'] else args)
+    if as_json:
+        args.remove('--json')
+
+    if action in DAEMON_ACTIONS:
+        request = build_request(action, args)
+        if request is None or not ensure_daemon():
+            return
+        if request.get('follow'):
+            follow_events(request, as_json)
+            return
+        response = send_request(request)
+        if as_json and action == 'events':
+            for event in response.get('data') or []:
+                print(json.dumps(event))
+            return
+        if as_json:
+            print(json.dumps(response, indent=2))
+            return
+        for line in response.get('messages', []):
+            print(line)
+        if action == 'list' and response.get('ok'):
+            list_processes(response['data'])
+        elif action == 'metrics' and response.get('data'):
+            print_metrics(response['data'])
+        elif action == 'job' and response.get('data') is not None:
+            if request['command'] == 'list':
+                print_jobs(response['data'])
+            else:
+                print_job_history(response['data'])
+        elif action in ['startup', 'disable-startup'] and response.get('ok'):
+            remove_legacy_cron_entries()
+            if action == 'startup' and not autostart_enabled():
+                print("Run `pypm enable` so PyPM itself starts at boot")
+        elif action == 'config' and request['key'] is None and response.get('data'):
+            print_settings(response['data'])
+        elif action == 'events':
+            for event in response.get('data') or []:
+                print(format_event(event))
+        elif action == 'debug' and response.get('data'):
+            if request['command'] == 'stats':
+                print_debug_stats(response['data'])
+            else:
+                print_profile(response['data'], request['output'])
+
+    elif action == 'logs':
+        lines = pop_option(args, '--lines', default=20, cast=int)
+        follow = '-f' in args or '--follow' in args
+        args = [arg for arg in args if arg not in ('-f', '--follow')]
+        if not args:
+            print("Usage: pypm logs <name> [-f] [--lines N]")
+            return
+        show_logs(args[0], lines, follow)
+
+    elif action == 'fleet':
+        if not fleet(args, as_json):
+            sys.exit(1)
+
+    elif action == 'top':
+        interval = pop_option(args, '--interval', default=SAMPLE_INTERVAL, cast=float)
+        if ensure_daemon():
+            top(interval)
+
+    elif action == 'status':
+        status(as_json)
+
+    elif action == 'stop-self':
+        logging.info("Stopping PyPM")
+        stop_self()
+    elif action == 'restart-self':
+        logging.info("Restarting PyPM")
+        restart_self()
+    elif action == 'start-self':
+        logging.info("Starting PyPM")
+        start_self()
+    elif action == 'daemon':
+        run_daemon(handoff='--handoff' in sys.argv)
+    elif action == 'enable':
+        enable_pypm_autostart()
+        logging.info("Enabled PyPM autostart")
+    elif action == 'disable':
+        disable_pypm_autostart()
+        logging.info("Disabled PyPM autostart")
+    else:
+        print("Unknown action. Use list, top, metrics, serve-metrics, serve-agent, fleet, logs, events, start, stop, restart, reload, delete, apply, job, save, resurrect, startup, disable-startup, stop-self, restart-self, start-self, enable, disable, config, debug, or status.")
+
+
+def cli():
+    try:
+        main()
+    except Exception as e:
+        logging.error(f"Unhandled exception: {e}", exc_info=True)
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    cli()
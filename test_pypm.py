@@ -0,0 +1,484 @@
+"""Behaviour checks for the parts of pypm.py that don't need a running daemon.
+
+Run with `python3 -m unittest test_pypm` (or pytest).
+"""
+import asyncio
+import contextlib
+import datetime
+import gzip
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+# pypm keeps its state and logs in the home directory, so give the tests their own
+os.environ['HOME'] = tempfile.mkdtemp(prefix='pypm-test-')
+
+import pypm
+
+
+def supervisor(processes=None):
+    """A Supervisor that isn't running, on a fresh state database holding `processes`."""
+    for suffix in ['', '-wal', '-shm']:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(f"{pypm.STATE_DB}{suffix}")
+    store = pypm.StateStore()
+    for name, process in (processes or {}).items():
+        store.write({name: process}, [name])
+    store.conn.close()
+    return pypm.Supervisor(lock_fd=None)
+
+
+def timestamp(*args):
+    return datetime.datetime(*args).timestamp()
+
+
+def next_run(expression, *after):
+    return datetime.datetime.fromtimestamp(pypm.next_cron_time(pypm.parse_cron(expression), timestamp(*after)))
+
+
+class CronTest(unittest.TestCase):
+    def test_steps(self):
+        self.assertEqual(pypm.parse_cron_field('*/15', 0, 59), {0, 15, 30, 45})
+        self.assertEqual(pypm.parse_cron_field('1-5/2', 0, 23), {1, 3, 5})
+        self.assertEqual(pypm.parse_cron_field('50/5', 0, 59), {50, 55})
+
+    def test_lists(self):
+        self.assertEqual(pypm.parse_cron_field('1,3,10-12', 1, 31), {1, 3, 10, 11, 12})
+
+    def test_names(self):
+        self.assertEqual(pypm.parse_cron('0 0 * * mon-fri')[4], {1, 2, 3, 4, 5})
+        self.assertEqual(pypm.parse_cron('0 0 * JAN,jul *')[3], {1, 7})
+        # Month names are not weekdays, and the other way round
+        self.assertRaises(ValueError, pypm.parse_cron, '0 0 * * jan')
+        self.assertRaises(ValueError, pypm.parse_cron, '0 0 * mon *')
+
+    def test_sunday_is_0_and_7(self):
+        self.assertEqual(pypm.parse_cron('0 0 * * 7')[4], {0})
+        self.assertEqual(pypm.parse_cron('0 0 * * 5-7')[4], {5, 6, 0})
+
+    def test_aliases(self):
+        self.assertEqual(pypm.parse_cron('@daily'), pypm.parse_cron('0 0 * * *'))
+        self.assertEqual(next_run('@hourly', 2025, 3, 10, 12, 30), datetime.datetime(2025, 3, 10, 13, 0))
+
+    def test_invalid(self):
+        for expression in ['0 0 * *', '60 * * * *', '* 24 * * *', '0 0 0 * *', '0 0 * 13 *', '0 0 * * 8',
+                           '5-1 * * * *', '*/0 * * * *', '0 0 * * fri-mon', 'x * * * *', '1,,2 * * * *']:
+            with self.subTest(expression=expression):
+                self.assertRaises(ValueError, pypm.parse_cron, expression)
+
+    def test_next_time(self):
+        self.assertEqual(next_run('*/15 * * * *', 2025, 3, 10, 12, 7), datetime.datetime(2025, 3, 10, 12, 15))
+        # Strictly after: a time that matches exactly moves on to the next match
+        self.assertEqual(next_run('*/15 * * * *', 2025, 3, 10, 12, 15), datetime.datetime(2025, 3, 10, 12, 30))
+        self.assertEqual(next_run('0 4 * * *', 2025, 12, 31, 5, 0), datetime.datetime(2026, 1, 1, 4, 0))
+
+    def test_weekdays(self):
+        # 2025-03-08 is a Saturday
+        self.assertEqual(next_run('30 9 * * mon-fri', 2025, 3, 8, 10, 0), datetime.datetime(2025, 3, 10, 9, 30))
+
+    def test_day_and_weekday_match_either(self):
+        # 2025-03-01 is a Saturday; the 13th is a Thursday, the first Friday is the 7th
+        self.assertEqual(next_run('0 0 13 * fri', 2025, 3, 1), datetime.datetime(2025, 3, 7))
+        self.assertEqual(next_run('0 0 13 * fri', 2025, 3, 7), datetime.datetime(2025, 3, 13))
+        self.assertEqual(next_run('0 0 13 * fri', 2025, 3, 13), datetime.datetime(2025, 3, 14))
+
+    def test_leap_day(self):
+        self.assertEqual(next_run('0 0 29 2 *', 2025, 3, 1), datetime.datetime(2028, 2, 29))
+        self.assertEqual(next_run('0 0 31 * *', 2025, 4, 1), datetime.datetime(2025, 5, 31))
+
+    def test_never_matches(self):
+        self.assertRaises(ValueError, pypm.next_cron_time, pypm.parse_cron('0 0 30 2 *'), timestamp(2025, 1, 1))
+        self.assertRaises(ValueError, pypm.parse_setting, 'cron_restart', '0 0 31 4 *')
+
+
+class DependencyWavesTest(unittest.TestCase):
+    def waves(self, config, names=None):
+        return [sorted(wave) for wave in pypm.dependency_waves(config, list(names or config))]
+
+    def test_no_dependencies(self):
+        self.assertEqual(self.waves({'a': {}, 'b': {}}), [['a', 'b']])
+
+    def test_chain(self):
+        config = {'web': {'depends_on': ['api']}, 'api': {'depends_on': ['db']}, 'db': {}}
+        self.assertEqual(self.waves(config), [['db'], ['api'], ['web']])
+
+    def test_diamond(self):
+        config = {'web': {'depends_on': ['api', 'cache']}, 'api': {'depends_on': ['db']},
+                  'cache': {'depends_on': ['db']}, 'db': {}}
+        self.assertEqual(self.waves(config), [['db'], ['api', 'cache'], ['web']])
+
+    def test_group_dependency(self):
+        config = {'web-0': {'group': 'web', 'depends_on': ['workers']},
+                  'workers-0': {'group': 'workers'}, 'workers-1': {'group': 'workers', 'depends_on': ['db']},
+                  'db': {}}
+        self.assertEqual(self.waves(config), [['db', 'workers-0'], ['workers-1'], ['web-0']])
+
+    def test_dependencies_outside_names_are_ignored(self):
+        config = {'web': {'depends_on': ['db', 'missing']}, 'db': {}}
+        self.assertEqual(self.waves(config, ['web']), [['web']])
+
+    def test_own_group(self):
+        # Instances depending on their own group don't wait for themselves
+        config = {'web-0': {'group': 'web', 'depends_on': ['web']}}
+        self.assertEqual(self.waves(config), [['web-0']])
+
+    def test_cycle(self):
+        config = {'a': {'depends_on': ['b']}, 'b': {'depends_on': ['c']}, 'c': {'depends_on': ['a']}, 'd': {}}
+        with self.assertRaisesRegex(ValueError, 'a, b, c'):
+            pypm.dependency_waves(config, list(config))
+
+
+def sample(cpu=1.5, memory=10.0, fds=4, threads=2, read_bytes=0, write_bytes=0):
+    return pypm.Sample(1, cpu, memory, threads, 1, fds, read_bytes, write_bytes, 0, 0)
+
+
+class MetricsRingTest(unittest.TestCase):
+    def test_round_trip(self):
+        ring = pypm.MetricsRing(4)
+        ring.append(sample(cpu=12.34, memory=20.5, fds=70000, read_bytes=5 << 20, write_bytes=1500), ring.base + 1)
+        history = ring.since(ring.base)
+        self.assertAlmostEqual(history['time'][0], ring.base + 1, places=3)
+        self.assertEqual(history['cpu'], [12.3])
+        self.assertEqual(history['memory'], [20.5])
+        # Counts are capped and I/O counters kept in whole KiB
+        self.assertEqual(history['fds'], [0xFFFF])
+        self.assertEqual(history['read_bytes'], [5 << 20])
+        self.assertEqual(history['write_bytes'], [1024])
+
+    def test_empty(self):
+        self.assertEqual(pypm.MetricsRing(4).since(0)['time'], [])
+
+    def test_wrap_around(self):
+        ring = pypm.MetricsRing(3)
+        for second in range(1, 6):
+            ring.append(sample(threads=second), ring.base + second)
+        # Only the newest three are kept, oldest first
+        self.assertEqual(ring.since(ring.base)['threads'], [3, 4, 5])
+        self.assertEqual(ring.count, 3)
+        ring.append(sample(threads=6), ring.base + 6)
+        self.assertEqual(ring.since(ring.base)['threads'], [4, 5, 6])
+
+    def test_since(self):
+        ring = pypm.MetricsRing(5)
+        for second in range(1, 8):
+            ring.append(sample(threads=second), ring.base + second + 0.04)
+        self.assertEqual(ring.since(ring.base + 5.04)['threads'], [5, 6, 7])
+        self.assertEqual(ring.since(ring.base + 5.5)['threads'], [6, 7])
+        self.assertEqual(ring.since(ring.base + 100)['threads'], [])
+        self.assertEqual(ring.since(0)['threads'], [3, 4, 5, 6, 7])
+
+    def test_counter_wrap_is_skipped(self):
+        ring = pypm.MetricsRing(3)
+        for second, kib in [(1, 0xFFFFFFF0), (2, 0xFFFFFFFF), (3, 0x10 + 0xFFFFFFFF + 1)]:
+            ring.append(sample(read_bytes=kib << 10), ring.base + second)
+        history = ring.since(ring.base)
+        self.assertEqual(history['read_bytes'][2], 0x10 << 10)
+        rates = pypm.counter_rates(history['time'], history['read_bytes'])
+        self.assertEqual(len(rates), 1)
+        self.assertAlmostEqual(rates[0], 15 << 10, delta=1024)
+
+
+class LogWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='pypm-logs-')
+        self.path = os.path.join(self.directory, 'web.log')
+
+    def segments(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_rotates_by_size_and_keeps_the_newest(self):
+        writer = pypm.LogWriter(self.path, max_size=10, max_age=0, keep=2, compress=False)
+        for batch in [b'first line\n', b'second line\n', b'third line\n']:
+            writer.write_chunks([batch])
+        writer.write_chunks([b'tail\n'])
+        writer.close()
+        self.assertEqual(self.segments(), ['web.log', 'web.log.1', 'web.log.2'])
+        with open(f"{self.path}.1", 'rb') as f:
+            self.assertEqual(f.read(), b'third line\n')
+        with open(f"{self.path}.2", 'rb') as f:
+            self.assertEqual(f.read(), b'second line\n')
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b'tail\n')
+
+    def test_rotates_by_age(self):
+        writer = pypm.LogWriter(self.path, max_size=0, max_age=60, keep=3, compress=False)
+        writer.write_chunks([b'fresh\n'])
+        self.assertEqual(self.segments(), ['web.log'])
+        writer.opened_at -= 61
+        writer.write_chunks([b'stale\n'])
+        writer.close()
+        self.assertEqual(self.segments(), ['web.log.1'])
+        with open(f"{self.path}.1", 'rb') as f:
+            self.assertEqual(f.read(), b'fresh\nstale\n')
+
+    def test_compresses_rotated_segments(self):
+        writer = pypm.LogWriter(self.path, max_size=5, max_age=0, keep=2, compress=True)
+        writer.write_chunks([b'one\n', b'two\n'])
+        writer.write_chunks([b'three\n'])
+        writer.close()
+        self.assertEqual(self.segments(), ['web.log.1.gz', 'web.log.2.gz'])
+        with gzip.open(f"{self.path}.1.gz") as f:
+            self.assertEqual(f.read(), b'three\n')
+        with gzip.open(f"{self.path}.2.gz") as f:
+            self.assertEqual(f.read(), b'one\ntwo\n')
+
+    def test_drops_segments_past_a_smaller_keep(self):
+        for index in range(1, 5):
+            with open(f"{self.path}.{index}", 'wb') as f:
+                f.write(b'old\n')
+        writer = pypm.LogWriter(self.path, max_size=1, max_age=0, keep=1, compress=False)
+        writer.write_chunks([b'new\n'])
+        self.assertEqual(self.segments(), ['web.log.1'])
+        with open(f"{self.path}.1", 'rb') as f:
+            self.assertEqual(f.read(), b'new\n')
+
+    def test_keep_zero_discards_the_log(self):
+        writer = pypm.LogWriter(self.path, max_size=1, max_age=0, keep=0, compress=False)
+        writer.write_chunks([b'gone\n'])
+        self.assertEqual(self.segments(), [])
+
+
+class FleetSealTest(unittest.TestCase):
+    key = pypm.fleet_session_key('token', 'agent challenge', 'client challenge')
+
+    def test_round_trip(self):
+        line = pypm.fleet_seal(self.key, 'fleet', 3, {'action': 'list'})
+        self.assertEqual(pypm.fleet_unseal(self.key, 'fleet', 3, line), {'action': 'list'})
+
+    def test_rejected(self):
+        line = pypm.fleet_seal(self.key, 'fleet', 3, {'action': 'list'})
+        other_key = pypm.fleet_session_key('token', 'agent challenge', 'another challenge')
+        for key, role, sequence, data in [(self.key, 'fleet', 4, line),       # replayed
+                                          (self.key, 'agent', 3, line),       # reflected
+                                          (other_key, 'fleet', 3, line),      # another session
+                                          (self.key, 'fleet', 3, line.replace(b'list', b'stop'))]:
+            with self.subTest(role=role, sequence=sequence):
+                self.assertRaises(ValueError, pypm.fleet_unseal, key, role, sequence, data)
+
+
+
+class ProcessTableTest(unittest.TestCase):
+    def test_columns_line_up(self):
+        rows = [{'name': 'web', 'status': 'RUNNING', 'pid': 101, 'cpu': 1.5, 'memory': 20.0, 'restarts': 0,
+                 'health': 'healthy'},
+                {'name': 'db', 'status': 'ERROR', 'pid': 102, 'restarts': 1},
+                {'name': 'worker', 'status': 'STOPPED', 'pid': None, 'restarts': 2}]
+        for fleet in [False, True]:
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                pypm.list_processes([{**row, 'host': 'web1'} if fleet else row for row in rows])
+            header, _, *lines = output.getvalue().splitlines()
+            with self.subTest(fleet=fleet):
+                self.assertEqual({len(line) for line in lines}, {len(header)})
+
+
+
+class SettingsTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(pypm.parse_setting('max_restarts', '7'), 7)
+        self.assertEqual(pypm.parse_setting('watch_delay', '0.5'), 0.5)
+        self.assertIs(pypm.parse_setting('autostart', 'False'), False)
+        self.assertEqual(pypm.parse_setting('depends_on', 'db, cache'), ['db', 'cache'])
+        self.assertEqual(pypm.parse_setting('max_memory', '512M'), 512 << 20)
+        self.assertIsNone(pypm.parse_setting('max_memory', 'none'))
+
+    def test_invalid(self):
+        for key, value in [('max_restarts', 'many'), ('log_compress', 'yes'), ('ready_check', 'bogus'),
+                           ('cron_restart', '61 * * * *'), ('nice', '40'), ('pid', '1'), ('listen', 'tcp:80')]:
+            with self.subTest(key=key):
+                self.assertRaises(ValueError, pypm.parse_setting, key, value)
+
+    def test_config_only_changes_settings(self):
+        async def run():
+            daemon = supervisor({'web': {'command': 'sleep 60', 'directory': '/'}})
+            daemon.loop = asyncio.get_running_loop()
+            out = []
+            await daemon.do_config({'name': 'web', 'key': 'pid', 'value': '1'}, out)
+            self.assertIsNone(daemon.config['web'].get('pid'))
+            self.assertIn("Unknown setting 'pid'", out[0])
+            await daemon.do_config({'name': 'web', 'key': 'max_restarts', 'value': '9'}, out)
+            self.assertEqual(daemon.config['web']['max_restarts'], 9)
+        asyncio.run(run())
+
+    def test_save_keeps_autostart_opt_out(self):
+        async def run():
+            daemon = supervisor({'web': {'command': 'sleep 60', 'directory': '/'},
+                                 'tool': {'command': 'sleep 60', 'directory': '/'}})
+            daemon.loop = asyncio.get_running_loop()
+            await daemon.do_config({'name': 'tool', 'key': 'autostart', 'value': 'false'}, [])
+            await daemon.do_save({}, [])
+            self.assertIs(daemon.config['web']['autostart'], True)
+            self.assertIs(daemon.config['tool']['autostart'], False)
+        asyncio.run(run())
+
+    def test_apply_leaves_undeclared_autostart_alone(self):
+        async def run():
+            directory = tempfile.mkdtemp()
+            with open(os.path.join(directory, 'app.py'), 'w') as f:
+                f.write("import time\ntime.sleep(60)\n")
+            command = 'python3 app.py'
+            entry = {'command': command, 'directory': directory, 'max_restarts': 5, 'restart_delay': 3}
+            daemon = supervisor({'web': {**entry, 'autostart': True}, 'tool': {**entry, 'autostart': True}})
+            daemon.loop = asyncio.get_running_loop()
+            daemon.is_active = lambda name: True
+            out = []
+            await daemon.do_apply({'processes': {'web': {'command': command, 'directory': directory},
+                                                 'tool': {'command': command, 'directory': directory,
+                                                          'autostart': False}},
+                                   'dry_run': True}, out)
+            self.assertEqual(out, ["~ tool (autostart)", "0 to create, 0 to restart, 1 to update, 0 to delete, 1 unchanged"])
+        asyncio.run(run())
+
+
+class AutostartTest(unittest.TestCase):
+    def test_status_check_runs_no_commands(self):
+        with mock.patch.object(pypm, 'subprocess') as subprocess:
+            self.assertFalse(pypm.autostart_enabled())
+            pypm.CRON_AUTOSTART_FILE.touch()
+            try:
+                self.assertTrue(pypm.autostart_enabled())
+            finally:
+                pypm.CRON_AUTOSTART_FILE.unlink()
+        subprocess.run.assert_not_called()
+
+
+class LimitsTest(unittest.TestCase):
+    spec = {'argv': ['sleep', '30'], 'executable': '/bin/sleep', 'env': {}, 'venv': None, 'directory': '/'}
+
+    def start(self, apply_limits):
+        process = pypm.start_process('sleeper', self.spec, apply_limits=apply_limits)
+        if process is not None:
+            self.addCleanup(process.stderr.close)
+            self.addCleanup(process.stdout.close)
+            self.addCleanup(process.wait)
+            self.addCleanup(process.kill)
+        return process
+
+    def test_applied_from_the_daemon(self):
+        apply_limits = pypm.build_limits({'nice': 5, 'max_open_files': 256, 'cpu_affinity': '0'})
+        process = self.start(apply_limits)
+        self.assertEqual(os.getpriority(os.PRIO_PROCESS, process.pid), 5)
+        self.assertEqual(pypm.resource.prlimit(process.pid, pypm.resource.RLIMIT_NOFILE), (256, 256))
+        self.assertEqual(os.sched_getaffinity(process.pid), {0})
+
+    def test_failure_kills_the_process(self):
+        apply_limits = pypm.build_limits({}, cgroup_procs=os.path.join(tempfile.mkdtemp(), 'missing', 'cgroup.procs'))
+        with mock.patch.object(pypm, 'logging'):
+            self.assertIsNone(self.start(apply_limits))
+
+    def test_nothing_to_apply(self):
+        self.assertIsNone(pypm.build_limits({'max_restarts': 5}))
+
+
+class AdoptionTest(unittest.TestCase):
+    def test_records_from_a_previous_boot_wait_for_boot_resurrect(self):
+        stale = {'boot_id': 'previous boot', 'start_ticks': 1, 'cmdline': ['sleep', '60']}
+        entry = {'command': 'sleep 60', 'directory': '/', 'pid': 4194000, 'identity': stale}
+
+        async def run():
+            daemon = supervisor({'web': {**entry, 'autostart': True, 'depends_on': ['db']},
+                                 'db': {**entry, 'autostart': True},
+                                 'scratch': entry})
+            daemon.loop = asyncio.get_running_loop()
+            daemon.state.set_setting('boot_id', 'previous boot')
+            daemon.state.set_setting('resurrect_at_boot', {'concurrency': None, 'stagger': None})
+            daemon.adopt_processes()
+            self.assertEqual(daemon.restart_tasks, {})
+            self.assertEqual({name: process.get('pid') for name, process in daemon.config.items()},
+                             {'web': None, 'db': None, 'scratch': None})
+
+            started = []
+
+            async def spawn(name, reset_backoff=True, limit=None):
+                started.append(name)
+                return 5000 + len(started)
+
+            async def wait_until_ready(name, pid, started_at, timeout):
+                return True
+            daemon.spawn, daemon.wait_until_ready = spawn, wait_until_ready
+            daemon.resurrect_after_boot()
+            await asyncio.gather(*daemon.job_tasks)
+            self.assertEqual(started, ['db', 'web'])
+            self.assertEqual(daemon.state.get_setting('boot_id'), pypm.read_boot_id())
+        asyncio.run(run())
+
+    def test_process_gone_during_this_boot_is_restarted(self):
+        identity = {'boot_id': pypm.read_boot_id(), 'start_ticks': 1, 'cmdline': ['sleep', '60']}
+
+        async def run():
+            daemon = supervisor({'web': {'command': 'sleep 60', 'directory': '/', 'pid': 4194000,
+                                         'identity': identity}})
+            daemon.loop = asyncio.get_running_loop()
+            restarted = []
+
+            async def monitor_and_restart(name, pid, exit_code, resume=False):
+                restarted.append((name, pid))
+            daemon.monitor_and_restart = monitor_and_restart
+            daemon.adopt_processes()
+            await asyncio.gather(*daemon.restart_tasks.values())
+            self.assertEqual(restarted, [('web', 4194000)])
+        asyncio.run(run())
+
+
+class ReloadTest(unittest.TestCase):
+    def reload(self, ready):
+        async def run():
+            daemon = supervisor({'web': {'command': 'sleep 60', 'directory': '/', 'pid': 100}})
+            daemon.loop = asyncio.get_running_loop()
+            stopped = []
+
+            async def launch(name, limit=None):
+                return mock.Mock(pid=200)
+
+            async def wait_until_ready(name, pid, started_at, timeout):
+                return ready
+
+            async def stop_process(name, pid):
+                stopped.append(pid)
+            daemon.is_alive = lambda name, pid: True
+            daemon.launch, daemon.wait_until_ready, daemon.stop_process = launch, wait_until_ready, stop_process
+            daemon.record_identity = daemon.schedule_probes = lambda *args: None
+            await daemon.reload_one('web', None)
+            events = [{key: value for key, value in event.items() if key not in ['seq', 'time']}
+                      for event in daemon.events]
+            return events, stopped, daemon.config['web']['pid']
+        return asyncio.run(run())
+
+    def test_events(self):
+        events, stopped, pid = self.reload(ready=True)
+        self.assertEqual(events, [{'event': 'restarting', 'name': 'web', 'reason': 'reload'},
+                                  {'event': 'spawned', 'name': 'web', 'pid': 200}])
+        self.assertEqual((stopped, pid), ([100], 200))
+
+    def test_not_ready(self):
+        events, stopped, pid = self.reload(ready=False)
+        self.assertEqual(events[-1], {'event': 'spawn_failed', 'name': 'web', 'pid': 200, 'reason': 'not_ready'})
+        self.assertEqual((stopped, pid), ([200], 100))
+
+
+class ForcedRestartTest(unittest.TestCase):
+    def test_cron_and_memory_restarts_do_not_overlap(self):
+        async def run():
+            daemon = supervisor({'web': {'command': 'sleep 60', 'directory': '/', 'pid': 1,
+                                         'cron_restart': '0 4 * * *'}})
+            restarts = []
+
+            async def restart_process(name, limit=None):
+                restarts.append(name)
+                await asyncio.sleep(0.01)
+            daemon.restart_process = restart_process
+            daemon.cron_restart('web')
+            daemon.cron_restart('web')
+            await asyncio.sleep(0.05)
+            self.assertEqual(restarts, ['web'])
+            self.assertEqual(daemon.forced_restarts, set())
+            daemon.cron_restart('web')
+            await asyncio.sleep(0.05)
+            self.assertEqual(restarts, ['web', 'web'])
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()